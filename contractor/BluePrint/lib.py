@@ -1,4 +1,7 @@
 import re
+from multiprocessing import get_context
+
+from contractor.tscript.parser import check, scriptHash
 
 
 def validateTemplate( id_map, template ):  # return message as a string if something does not match
@@ -12,3 +15,32 @@ def validateTemplate( id_map, template ):  # return message as a string if somet
       return 'Item "{0}" does not match "{1}"'.format( name, id_map[ name ] )
 
   return None
+
+
+def _checkScript( item ):  # runs in the worker processes of checkScripts, the caller stores the ASTs
+  ( name, script, optimize ) = item
+  ( message, ast ) = check( script, optimize )
+  return ( name, message, ast )
+
+
+# NOTE: the workers are spawned, not forked, forking a process with other threads (ie: the API server) can
+#       leave locks, like the parse cache's, held in the child for ever, spawning is slower to start, use
+#       processes=1 where the start up time is not worth it
+def checkScripts( script_map, optimize=False, processes=None ):  # script_map is name -> script, returns name -> lint message of the scripts that have problems, the good ones are stored as ScriptASTs for createJob
+  from contractor.Foreman.models import ScriptAST  # Foreman's models need ours
+
+  item_list = [ ( name, script, optimize ) for name, script in script_map.items() ]
+  if processes == 1 or len( item_list ) < 2:
+    result_list = [ _checkScript( item ) for item in item_list ]
+  else:
+    with get_context( 'spawn' ).Pool( processes ) as pool:  # processes of None is one per cpu
+      result_list = pool.map( _checkScript, item_list )
+
+  result = {}
+  for ( name, message, ast ) in result_list:
+    if message is not None:
+      result[ name ] = message
+    else:
+      ScriptAST.store( scriptHash( script_map[ name ], optimize ), ast )
+
+  return result
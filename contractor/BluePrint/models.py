@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.db.models.signals import post_save, post_delete
 from django.core.exceptions import ValidationError
@@ -7,7 +8,7 @@ from cinp.orm_django import DjangoCInP as CInP
 from contractor.fields import MapField, StringListField, name_regex, config_name_regex
 from contractor.tscript import parser
 from contractor.lib.config import getConfig
-from contractor.BluePrint.lib import validateTemplate
+from contractor.BluePrint.lib import validateTemplate, checkScripts
 from contractor.Records.lib import post_save_callback, post_delete_callback
 
 
@@ -198,6 +199,16 @@ class Script( models.Model ):
     if errors:
       raise ValidationError( errors )
 
+  @cinp.action( return_type={ 'type': 'Map' } )
+  @staticmethod
+  def checkAll():
+    """
+    Lints and parses all the Scripts, returns a map of the name of the
+    Scripts that have problems to what is wrong with them.  The parsed Scripts
+    are stored so the jobs using them do not have to parse them again.
+    """
+    return checkScripts( dict( Script.objects.all().values_list( 'name', 'script' ) ), getattr( settings, 'TSCRIPT_OPTIMIZE', False ), processes=1 )  # in the request, no worker processes from inside the API server
+
   def __str__( self ):
     return 'Script "{0}"({1})'.format( self.description, self.name )
 
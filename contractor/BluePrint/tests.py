@@ -0,0 +1,42 @@
+import pytest
+
+from contractor.tscript.parser import parse_cache, scriptHash
+from contractor.Foreman.models import ScriptAST
+from contractor.BluePrint.models import Script
+from contractor.BluePrint.lib import checkScripts
+
+
+@pytest.mark.django_db()
+def test_check_scripts():
+  script_map = { 'good': 'aa = 1', 'bad_parse': 'aa = ', 'bad_function': 'aa = 1\nlenn( array=[] )', 'optimize': 'aa = ( 1 + 2 )' }
+  for processes in ( 1, 2 ):
+    parse_cache.clear()
+    ScriptAST.objects.all().delete()
+    assert checkScripts( script_map, processes=processes ) == { 'bad_parse': 'Incomplete Parsing on line: 1 column: 1', 'bad_function': 'Not Defined "lenn" line 2' }
+    assert scriptHash( 'aa = 1' ) in parse_cache
+    assert scriptHash( 'aa = ( 1 + 2 )' ) in parse_cache
+    assert len( parse_cache ) == 2
+    assert sorted( ScriptAST.objects.all().values_list( 'script_hash', flat=True ) ) == sorted( [ scriptHash( 'aa = 1' ), scriptHash( 'aa = ( 1 + 2 )' ) ] )
+
+  parse_cache.clear()
+  assert checkScripts( { 'optimize': 'aa = ( 1 + 2 )' }, optimize=True ) == {}
+  assert parse_cache.get( scriptHash( 'aa = ( 1 + 2 )', True ) )[1][ '_children' ][0][1][1][ 'value' ] == ( 'C', 3 )
+  parse_cache.clear()  # other processes load it from the table
+  assert ScriptAST.load( scriptHash( 'aa = ( 1 + 2 )', True ) )[1][ '_children' ][0][1][1][ 'value' ] == ( 'C', 3 )
+
+  assert checkScripts( {} ) == {}
+
+
+@pytest.mark.django_db()
+def test_script_check_all():
+  for name, script in ( ( 'aa', 'aa = 1' ), ( 'bb', 'bb = 2' ) ):
+    s = Script( name=name, description=name, script=script )
+    s.full_clean()
+    s.save()
+
+  Script.objects.filter( name='bb' ).update( script='bb = ' )  # the clean would not let this in
+
+  parse_cache.clear()
+  assert Script.checkAll() == { 'bb': 'Incomplete Parsing on line: 1 column: 1' }
+  assert scriptHash( 'aa = 1' ) in parse_cache
+  assert ScriptAST.objects.filter( pk=scriptHash( 'aa = 1' ) ).exists()
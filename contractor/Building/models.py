@@ -269,6 +269,11 @@ class Foundation( models.Model ):
 
   @property
   def structure( self ):
+    try:
+      return self._prefetched_relations[ 'structure' ]  # set by contractor.Foreman.lib, for a batch of jobs
+    except ( AttributeError, KeyError ):
+      pass
+
     try:
       return Structure.objects.get( foundation=self )
     except Structure.DoesNotExist:
@@ -292,6 +297,11 @@ class Foundation( models.Model ):
 
   @property
   def dependency( self ):
+    try:
+      return self._prefetched_relations[ 'dependency' ]
+    except ( AttributeError, KeyError ):
+      pass
+
     try:
       return Dependency.objects.get( foundation=self )
     except Dependency.DoesNotExist:
@@ -458,6 +468,11 @@ class Structure( Networked ):
 
   @property
   def dependant_dependencies( self ):
+    try:
+      return self._prefetched_relations[ 'dependant_dependencies' ]
+    except ( AttributeError, KeyError ):
+      pass
+
     try:
       return Dependency.objects.filter( structure=self )
     except Dependency.DoesNotExist:
@@ -816,6 +831,11 @@ class Dependency( models.Model ):
 
   @property
   def dependant_dependencies( self ):
+    try:
+      return self._prefetched_relations[ 'dependant_dependencies' ]
+    except ( AttributeError, KeyError ):
+      pass
+
     try:
       return Dependency.objects.filter( dependency=self )
     except Dependency.DoesNotExist:
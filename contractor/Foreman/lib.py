@@ -1,16 +1,32 @@
-import pickle
+import time
+from datetime import timedelta
+
+from importlib import import_module
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Min
+from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 
 from contractor.Building.models import Foundation, Structure, Dependency
 from contractor.Foreman.runner_plugins.building import ConfigPlugin, FoundationPlugin, ROFoundationPlugin, StructurePlugin, ROStructurePlugin
-from contractor.Foreman.models import BaseJob, FoundationJob, StructureJob, DependencyJob, JobLog, ForemanException
+from contractor.Foreman.models import BaseJob, FoundationJob, StructureJob, DependencyJob, JobLog, ScriptAST, ForemanException
+from contractor.Foreman.notify import siteGeneration, siteIdle, idleGeneration, waitForChange
 from contractor.PostOffice.lib import registerEvent
 
-from contractor.tscript.parser import parse
+from contractor.tscript.parser import parse, scriptHash
+from contractor.tscript.analysis import moduleNames
+from contractor.tscript.vm import VMRunner
 from contractor.tscript.runner import Runner, Pause, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, ScriptError
 
 
 RUNNER_MODULE_LIST = []
+JOB_LEASE_TIME = timedelta( minutes=5 )  # how long other workers leave a claimed job alone, incase the worker that claimed it dies
+JOB_POLL_INTERVAL = 10  # seconds, how often a long polling processJobs checks anyway, things like changes made by other processes do not wake it up
+JOB_MAX_WAIT = 60  # seconds, the longest processJobs will wait for something to hand out
+JOB_TIME_BUDGET = 30  # seconds, how long processJobs spends running jobs, the jobs it did not get to are first in line next time
+JOB_TIME_SLICE = 5  # seconds, the most one job's script runs for in a processJobs, so one busy job can't hold up the rest
+JOB_SELECT_RELATED = ( 'foundationjob__foundation', 'structurejob__structure__foundation', 'dependencyjob__dependency__structure', 'dependencyjob__dependency__dependency', 'dependencyjob__dependency__foundation' )
 
 #  Job Can Create Matrix
 #                                    Associated Asset
@@ -39,6 +55,8 @@ RUNNER_MODULE_LIST = []
 # TODO: can't create a foundation destroy job when the structure has a create job - right now everything looks down to see if it can have a job
 #       do we want to look up too?  or should the job be created, but just not start....
 
+_site_cursor_map = {}  # site id -> pk of the last job this process ran, the next processJobs starts with the job after it
+
 JOB_LOOKUP_MAP = { 'Foundation': 'foundationjob', 'Structure': 'structurejob', 'Dependency': 'dependencyjob' }
 DEPENDENCY_LOOKUP_MAP = { 'Foundation': ( 'dependency', ), 'Structure': ( 'foundation', ), 'Dependency': ( 'structure', 'dependency' ) }
 
@@ -155,19 +173,32 @@ def createJob( script_name, target, creator ):
   if script is None:
     script = '# empty place holder'
 
-  runner = Runner( parse( script ) )
-  for module in RUNNER_MODULE_LIST:
-    runner.registerModule( module )
+  optimize = getattr( settings, 'TSCRIPT_OPTIMIZE', False )
+  script_hash = scriptHash( script, optimize )
+  try:
+    ast = ScriptAST.load( script_hash )  # stored by checkScripts or an other job with the same script
+  except ScriptAST.DoesNotExist:
+    ast = parse( script, optimize )
+    ScriptAST.store( script_hash, ast )
+
+  if getattr( settings, 'TSCRIPT_COMPILE', False ):
+    runner = VMRunner( ast )
+  else:
+    runner = Runner( ast )
+
+  runner.script_hash = script_hash
 
-  for module in ( 'contractor.Foreman.runner_plugins.dhcp', ):
-    runner.registerModule( module )
+  name_set = moduleNames( ast )  # only the function modules the script uses, the rest would just be stored with the job and re-loaded every time it runs
+  for module in RUNNER_MODULE_LIST + [ 'contractor.Foreman.runner_plugins.dhcp' ]:
+    if import_module( module ).TSCRIPT_NAME in name_set:
+      runner.registerModule( module )
 
-  for obj in obj_list:
+  for obj in obj_list:  # allways, functions can read these with getScriptValue even if the script does not name them, they are not loaded until used
     runner.registerObject( obj )
 
   job.state = 'waiting'
   job.script_name = script_name
-  job.script_runner = pickle.dumps( runner )
+  job.setRunner( runner )
   job.full_clean()
   job.save()
 
@@ -176,10 +207,213 @@ def createJob( script_name, target, creator ):
   return job.pk
 
 
-def processJobs( site, module_list, max_jobs=10 ):
+def _prefetch( instance_list, name, queryset, field, many ):  # for the Building relations that are properties, see Foundation.structure and the like
+  if not instance_list:
+    return
+
+  value_map = {}
+  for item in queryset.filter( **{ '{0}__in'.format( field ): instance_list } ):
+    value_map.setdefault( getattr( item, '{0}_id'.format( field ) ), [] ).append( item )
+
+  for instance in instance_list:
+    value_list = value_map.get( instance.pk, [] )
+    if not many:
+      value_list = value_list[0] if value_list else None
+
+    instance.__dict__.setdefault( '_prefetched_relations', {} )[ name ] = value_list
+
+
+def _prefetchJob( instance_list, job_class, field ):  # fills in the reverse accessor, ie: structure.structurejob, None is cached as DoesNotExist
+  if not instance_list:
+    return
+
+  cache_name = job_class._meta.get_field( field ).remote_field.get_cache_name()
+  job_map = dict( ( getattr( job, '{0}_id'.format( field ) ), job ) for job in job_class.objects.filter( **{ '{0}__in'.format( field ): instance_list } ) )
+  for instance in instance_list:
+    setattr( instance, cache_name, job_map.get( instance.pk, None ) )
+
+
+def _realJobMap( pk_list ):  # pk -> real job, in one query
+  # the lock is taken before this, FOR UPDATE can not be used with the outer joins
+  job_map = BaseJob.objects.select_related( *JOB_SELECT_RELATED ).in_bulk( pk_list )
+  return dict( ( pk, job.realJob ) for pk, job in job_map.items() )
+
+
+def _loadJobs( job_list ):  # the real jobs for a list of BaseJobs, with what can_start/done need, in a fixed number of queries
+  if not job_list:
+    return []
+
+  job_map = _realJobMap( [ job.pk for job in job_list ] )
+  job_list = [ job_map[ job.pk ] for job in job_list if job.pk in job_map ]
+
+  foundation_list = [ job.foundation for job in job_list if isinstance( job, FoundationJob ) ]
+  _prefetch( foundation_list, 'dependency', Dependency.objects.all(), 'foundation', False )
+  _prefetch( foundation_list, 'structure', Structure.objects.all(), 'foundation', False )
+  _prefetchJob( [ foundation.structure for foundation in foundation_list if foundation.structure is not None ], StructureJob, 'structure' )
+
+  structure_list = [ job.structure for job in job_list if isinstance( job, StructureJob ) ]
+  _prefetch( structure_list, 'dependant_dependencies', Dependency.objects.all(), 'structure', True )
+  _prefetchJob( [ dependency for structure in structure_list for dependency in structure.dependant_dependencies ], DependencyJob, 'dependency' )
+
+  dependency_list = [ job.dependency for job in job_list if isinstance( job, DependencyJob ) ]
+  _prefetch( dependency_list, 'dependant_dependencies', Dependency.objects.all(), 'dependency', True )
+  _prefetchJob( [ dependency.foundation for dependency in dependency_list if dependency.foundation is not None ], FoundationJob, 'foundation' )
+
+  return job_list
+
+
+def _saveJob( job ):
+  job.full_clean( exclude=( 'site', 'script_ast' ) )  # processJobs dosen't change these, and checking each is a query
+  job.save()
+
+
+def _lockJobs( queryset ):  # if the DB can, skip the jobs other workers have locked instead of waiting on them
+  if connection.features.has_select_for_update_skip_locked:
+    return queryset.select_for_update( skip_locked=True )
+
+  return queryset.select_for_update()
+
+
+def _claimJobList( job_list, count, now ):
+  if connection.features.has_select_for_update_skip_locked:
+    return list( job_list.select_for_update( skip_locked=True )[ :count ] )
+
+  # no row locks to skip, lease the jobs instead, the update only matches if no other worker has leased the job
+  available = Q( lease_expires__isnull=True ) | Q( lease_expires__lte=now )
+  result = []
+  for job in job_list.filter( available )[ :count ]:
+    job.lease_expires = now + JOB_LEASE_TIME
+    if BaseJob.objects.filter( available, pk=job.pk ).update( lease_expires=job.lease_expires ):
+      result.append( job )
+
+  return result
+
+
+def _claimJobs( site, count, exclude_list ):
+  now = timezone.now()
+  # skip the jobs that can't get anything done, they are waiting on subcontractor, or a delay and the like
+  job_list = BaseJob.objects.filter( site=site, state='queued', waiting_on_subcontractor=False ).exclude( pk__in=exclude_list )
+  job_list = job_list.filter( Q( wake_at__isnull=True ) | Q( wake_at__lte=now ) ).order_by( 'pk' )
+
+  # pick up where the last processJobs left off, then wrap around
+  cursor = _site_cursor_map.get( site.pk, 0 )
+  result = _claimJobList( job_list.filter( pk__gt=cursor ), count, now )
+  if len( result ) < count:
+    result += _claimJobList( job_list.filter( pk__lte=cursor ), count - len( result ), now )
+
+  return result
+
+
+def _releaseJobs( job_list ):  # give back the leases of claimed jobs that did not get run, row locks go with the transaction
+  pk_list = [ job.pk for job in job_list if job.lease_expires is not None ]
+  if pk_list:
+    BaseJob.objects.filter( pk__in=pk_list ).update( lease_expires=None )
+
+
+def _runJob( job, module_list, budget=None, max_tasks=1 ):  # job is the BaseJob, there is nothing here that needs the real job, returns the list of tasks for subcontractor
+  leased = job.lease_expires is not None
+  job.lease_expires = None
+  before = ( job.state, job.message, bytes( job.script_runner ), job.wake_at, job.waiting_on_subcontractor )
+  runner = job.getRunner()
+
+  if runner.aborted:
+    job.state = 'aborted'
+    _saveJob( job )
+    return []
+
+  if runner.done:
+    job.state = 'done'
+    _saveJob( job )
+    return []
+
+  try:
+    job.message = runner.run( budget=budget )
+
+  except Pause as e:
+    job.state = 'paused'
+    job.message = str( e )[ 0:1024 ]
+
+  except ExecutionError as e:
+    job.state = 'error'
+    job.message = str( e )[ 0:1024 ]
+
+  except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
+    job.state = 'aborted'
+    job.message = str( e )[ 0:1024 ]
+
+  except Exception as e:
+    job.state = 'aborted'
+    job.message = 'Unknown Runtime Exception ({0}): "{1}"'.format( type( e ).__name__, str( e ) )[ 0:1024 ]
+
+  task_list = []
+  while job.state == 'queued' and len( task_list ) < max_tasks:  # a parallel block can have more than one, the rest go out next time
+    task = runner.toSubcontractor( module_list )
+    if task is None:
+      break
+
+    task.update( { 'job_id': job.pk } )
+    task_list.append( task )
+
+  job.setRunner( runner )
+  if ( job.state, job.message, job.script_runner, job.wake_at, job.waiting_on_subcontractor ) == before:  # the runner did not move, so neither did the status, nothing to save
+    if leased:
+      job.save( update_fields=[ 'lease_expires' ] )
+
+    return task_list
+
+  job.status = runner.status
+  _saveJob( job )
+
+  return task_list
+
+
+def _hasWork( site ):  # without locking anything, is there something _processJobs might get done
+  job_list = BaseJob.objects.filter( site=site )
+  now = timezone.now()
+  runnable = Q( state='queued', waiting_on_subcontractor=False ) & ( Q( wake_at__isnull=True ) | Q( wake_at__lte=now ) )
+  return job_list.filter( Q( state__in=( 'waiting', 'done' ) ) | runnable ).exists()
+
+
+def _waitForWork( site, wait_seconds ):
+  # the wait happens before _processJobs locks anything, rows locked in a transaction stay locked till the end
+  # of it, which is the end of the request.  If the last processJobs for this site came up empty and nothing
+  # has changed since, wait for a change, a delay to be up, or every JOB_POLL_INTERVAL an unlocked look for work
+  expires = time.monotonic() + min( wait_seconds, JOB_MAX_WAIT )
+  generation = siteGeneration( site.pk )
+  changed = idleGeneration( site.pk ) != generation
+  while True:
+    if changed and _hasWork( site ):
+      return
+
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+      return
+
+    timeout = min( remaining, JOB_POLL_INTERVAL )
+    wake_at = BaseJob.objects.filter( site=site, state='queued', wake_at__isnull=False ).aggregate( Min( 'wake_at' ) )[ 'wake_at__min' ]
+    if wake_at is not None:
+      timeout = min( timeout, max( ( wake_at - timezone.now() ).total_seconds(), 1 ) )
+
+    waitForChange( site.pk, generation, timeout )
+    generation = siteGeneration( site.pk )
+    changed = True  # changed here, a delay is up, or it has been JOB_POLL_INTERVAL and other processes might of changed something
+
+
+def processJobs( site, module_list, max_jobs=10, wait_seconds=0 ):  # if there are no tasks to hand out, wait up to wait_seconds for some
   if max_jobs > 100:
     max_jobs = 100
 
+  if wait_seconds > 0:
+    _waitForWork( site, wait_seconds )
+
+  results = _processJobs( site, module_list, max_jobs )
+  if not results:
+    siteIdle( site.pk )
+
+  return results
+
+
+def _processJobs( site, module_list, max_jobs ):
   # how to know if something can just be located, for now, if it has a complex and the complex is up and running
   # then we can auto locate.  The question is, should we go back to the foundation haveing a can_auto_locate
   # flag again, do we need that kind of detail?
@@ -190,8 +424,7 @@ def processJobs( site, module_list, max_jobs=10 ):
       foundation.setLocated()
 
   # start waiting jobs
-  for job in BaseJob.objects.select_for_update().filter( site=site, state='waiting' ):
-    job = job.realJob
+  for job in _loadJobs( list( _lockJobs( BaseJob.objects.filter( site=site, state='waiting' ) ) ) ):
     if job.can_start:
       job.state = 'queued'
       job.full_clean()
@@ -200,8 +433,8 @@ def processJobs( site, module_list, max_jobs=10 ):
       JobLog.started( job )
 
   # clean up completed jobs
-  for job in BaseJob.objects.select_for_update().filter( site=site, state='done' ):
-    job = job.realJob
+  cleanup = False
+  for job in _loadJobs( list( _lockJobs( BaseJob.objects.filter( site=site, state='done' ) ) ) ):
     job.done()
     if isinstance( job, StructureJob ):
       registerEvent( job.structure, job=job )
@@ -212,57 +445,32 @@ def processJobs( site, module_list, max_jobs=10 ):
     JobLog.finished( job )
 
     job.delete()
+    cleanup = True
 
-  # iterate over the curent jobs
-  results = []
-  for job in BaseJob.objects.select_for_update().filter( site=site, state='queued' ).order_by( 'updated' ):
-    job = job.realJob
-    runner = pickle.loads( job.script_runner )
-
-    if runner.aborted:
-      job.state = 'aborted'
-      job.full_clean()
-      job.save()
-      continue
+  if cleanup:
+    ScriptAST.cleanup()
 
-    if runner.done:
-      job.state = 'done'
-      job.full_clean()
-      job.save()
-      continue
-
-    try:
-      job.message = runner.run()
-
-    except Pause as e:
-      job.state = 'paused'
-      job.message = str( e )[ 0:1024 ]
-
-    except ExecutionError as e:
-      job.state = 'error'
-      job.message = str( e )[ 0:1024 ]
-
-    except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
-      job.state = 'aborted'
-      job.message = str( e )[ 0:1024 ]
-
-    except Exception as e:
-      job.state = 'aborted'
-      job.message = 'Unknown Runtime Exception ({0}): "{1}"'.format( type( e ).__name__, str( e ) )[ 0:1024 ]
+  # claim and run the curent jobs a batch at a time, other workers polling the same site get the other jobs
+  # each job is limited to the tasks that are still wanted, so a batch never takes us past max_jobs
+  expires = time.monotonic() + JOB_TIME_BUDGET
+  results = []
+  claimed_list = []
+  while len( results ) < max_jobs and time.monotonic() < expires:
+    job_list = _claimJobs( site, max_jobs - len( results ), claimed_list )
+    if not job_list:
+      break
 
-    if job.state == 'queued':
-      task = runner.toSubcontractor( module_list )
-      if task is not None:
-        task.update( { 'job_id': job.pk } )
-        results.append( task )
+    while job_list:
+      remaining = expires - time.monotonic()
+      if remaining <= 0:
+        break
 
-    job.status = runner.status
-    job.script_runner = pickle.dumps( runner )
-    job.full_clean()
-    job.save()
+      job = job_list.pop( 0 )
+      claimed_list.append( job.pk )
+      _site_cursor_map[ site.pk ] = job.pk
+      results += _runJob( job, module_list, min( remaining, JOB_TIME_SLICE ), max_jobs - len( results ) )
 
-    if len( results ) >= max_jobs:
-      break
+    _releaseJobs( job_list )
 
   return results
 
@@ -270,6 +478,22 @@ def processJobs( site, module_list, max_jobs=10 ):
 # TODO: we will need some kind of job record locking, so only one thing can happen at a time, ie: rolling back when things are still comming in,
 #   trying to handler.run() when fromsubContractor is happening, pretty much, anything the runner is unpickled, nothing else should  happen to
 #   the job till it is pickled and saved
+def _applyResults( job, cookie, data ):
+  runner = job.getRunner()
+  ( result, message ) = runner.fromSubcontractor( cookie, data )
+  if result != 'Accepted':  # it wasn't valid/taken, no point in saving anything
+    return result
+
+  job.status = runner.status
+  if message is None:
+    job.message = ''
+  else:
+    job.message = message
+  job.setRunner( runner )
+
+  return result
+
+
 def jobResults( job_id, cookie, data ):
   try:
     job = BaseJob.objects.select_for_update().get( pk=job_id )
@@ -277,23 +501,54 @@ def jobResults( job_id, cookie, data ):
     raise ForemanException( 'JOB_NOT_FOUND', 'Error saving job results: "Job Not Found"' )
 
   job = job.realJob
-  runner = pickle.loads( job.script_runner )
-  ( result, message ) = runner.fromSubcontractor( cookie, data )
-  if result != 'Accepted':  # it wasn't valid/taken, no point in saving anything
+  result = _applyResults( job, cookie, data )
+  if result != 'Accepted':
     raise ForemanException( 'INVALID_RESULT', 'Error saving job results: "{0}"'.format( result ) )
 
-  job.status = runner.status
-  if message is None:
-    job.message = ''
-  else:
-    job.message = message
-  job.script_runner = pickle.dumps( runner )
   job.full_clean()
   job.save()
 
   return result
 
 
+def _validResult( item ):  # a bad entry is reported on it's own, not allowed to fail the rest of the batch
+  if not isinstance( item, dict ) or 'data' not in item:
+    return False
+
+  return isinstance( item.get( 'job_id' ), int ) and not isinstance( item[ 'job_id' ], bool ) and isinstance( item.get( 'cookie' ), str )
+
+
+def jobResultsBatch( result_list ):  # result_list is a list of { 'job_id', 'cookie', 'data' }, returns the result for each entry, in the same order, 'Accepted' if it was taken
+  valid_list = [ _validResult( item ) for item in result_list ]
+  job_id_list = sorted( set( item[ 'job_id' ] for item, valid in zip( result_list, valid_list ) if valid ) )
+  list( BaseJob.objects.select_for_update().filter( pk__in=job_id_list ).order_by( 'pk' ).values_list( 'pk', flat=True ) )  # lock in pk order so overlapping batches can't deadlock
+  job_map = _realJobMap( job_id_list )
+
+  results = []
+  dirty_map = {}
+  for item, valid in zip( result_list, valid_list ):
+    if not valid:
+      results.append( 'Invalid Entry' )
+      continue
+
+    try:
+      job = job_map[ item[ 'job_id' ] ]
+    except KeyError:
+      results.append( 'Job Not Found' )
+      continue
+
+    result = _applyResults( job, item[ 'cookie' ], item[ 'data' ] )
+    if result == 'Accepted':
+      dirty_map[ job.pk ] = job
+
+    results.append( result )
+
+  for job in dirty_map.values():
+    _saveJob( job )
+
+  return results
+
+
 def jobError( job_id, cookie, msg ):
   try:
     job = BaseJob.objects.select_for_update().get( pk=job_id )
@@ -301,8 +556,8 @@ def jobError( job_id, cookie, msg ):
     raise ForemanException( 'JOB_NOT_FOUND', 'Error setting job to error: "Job Not Found"' )
 
   job = job.realJob
-  runner = pickle.loads( job.script_runner )
-  if cookie != runner.contractor_cookie:  # we do our own out of bad cookie check b/c this type of error dosen't need to be propagated to the script runner
+  runner = job.getRunner()
+  if not runner.isValidCookie( cookie ):  # we do our own out of bad cookie check b/c this type of error dosen't need to be propagated to the script runner
     raise ForemanException( 'BAD_COOKIE', 'Error setting job to error: "Bad Cookie"' )
 
   job.message = msg[ 0:1024 ]
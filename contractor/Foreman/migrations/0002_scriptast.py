@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Foreman', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScriptAST',
+            fields=[
+                ('script_hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('ast', models.BinaryField(editable=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='basejob',
+            name='script_ast',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='Foreman.ScriptAST'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Foreman', '0002_scriptast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basejob',
+            name='wake_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='basejob',
+            name='waiting_on_subcontractor',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
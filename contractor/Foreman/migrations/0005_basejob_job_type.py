@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_job_type(apps, schema_editor):
+    BaseJob = apps.get_model('Foreman', 'BaseJob')
+    for job_type in ('foundationjob', 'structurejob', 'dependencyjob'):
+        BaseJob.objects.filter(**{'{0}__isnull'.format(job_type): False}).update(job_type=job_type)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Foreman', '0004_basejob_lease_expires'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basejob',
+            name='job_type',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+        migrations.RunPython(set_job_type, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,13 @@
+import io
+import copyreg
 import pickle
+import hashlib
+from datetime import timedelta
 
+from django.conf import settings
 from django.utils import timezone
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 
 from cinp.orm_django import DjangoCInP as CInP
@@ -9,10 +15,16 @@ from cinp.orm_django import DjangoCInP as CInP
 from contractor.fields import JSONField
 from contractor.Site.models import Site
 from contractor.Building.models import Foundation, Structure, Dependency
+from contractor.Foreman.notify import job_change_callback
+from contractor.BluePrint.models import Script
+from contractor.tscript.parser import parse_cache, scriptHash
+from contractor.tscript.runner import Runner, ProfileTracer
+from contractor.tscript.vm import VMRunner
 
 # stuff for getting handeling tasks, everything here should be ephemerial, only things that are in progress/flight
 
 PICKLE_PROTOCOL = 4
+SCRIPT_AST_MIN_AGE = timedelta( hours=1 )  # un-referenced ASTs younger than this are left alone, a job may be in the middle of being created with it
 cinp = CInP( 'Foreman', '0.1' )
 
 
@@ -30,20 +42,100 @@ class ForemanException( ValueError ):
     return 'ForemanException ({0}): {1}'.format( self.code, self.message )
 
 
-@cinp.model( not_allowed_verb_list=[ 'LIST', 'GET', 'CREATE', 'UPDATE', 'DELETE' ], hide_field_list=( 'script_runner', ), property_list=( 'progress', 'can_start' ) )
+# the parsed script, stored once and shared by all the jobs running that script
+class ScriptAST( models.Model ):
+  script_hash = models.CharField( max_length=64, primary_key=True )
+  ast = models.BinaryField( editable=False )
+  created = models.DateTimeField( editable=False, auto_now_add=True )
+
+  @staticmethod
+  def store( script_hash, ast ):
+    if not ScriptAST.objects.filter( pk=script_hash ).exists():
+      ScriptAST.objects.get_or_create( script_hash=script_hash, defaults={ 'ast': pickle.dumps( ast, protocol=PICKLE_PROTOCOL ) } )
+
+    parse_cache.set( script_hash, ast )
+
+  @staticmethod
+  def load( script_hash ):
+    try:
+      return parse_cache.get( script_hash )
+    except KeyError:
+      pass
+
+    ast = pickle.loads( ScriptAST.objects.get( pk=script_hash ).ast )
+    parse_cache.set( script_hash, ast )
+
+    return ast
+
+  @staticmethod
+  def cleanup():  # the ASTs of the current Scripts are kept, checkScripts stores them ahead of the jobs that will use them
+    optimize = getattr( settings, 'TSCRIPT_OPTIMIZE', False )
+    keep_list = [ scriptHash( script, optimize ) for script in Script.objects.all().values_list( 'script', flat=True ) ]
+    ScriptAST.objects.filter( basejob__isnull=True, created__lt=timezone.now() - SCRIPT_AST_MIN_AGE ).exclude( pk__in=keep_list ).delete()
+
+  def __str__( self ):
+    return 'ScriptAST "{0}"'.format( self.script_hash )
+
+
+def _runnerFromScriptAST( script_hash, runner_class=Runner ):
+  runner = runner_class( ScriptAST.load( script_hash ) )
+  runner.script_hash = script_hash
+  return runner
+
+
+def _reduceRunner( runner ):
+  return ( _runnerFromScriptAST, ( runner.script_hash, runner.__class__ ), runner.__getstate__() )
+
+
+_runner_dispatch_table = copyreg.dispatch_table.copy()
+_runner_dispatch_table[ Runner ] = _reduceRunner
+_runner_dispatch_table[ VMRunner ] = _reduceRunner
+
+
+# runners with a script_hash are pickled with a reference to their ScriptAST instead of a copy of the AST,
+# runners pickled before there was a ScriptAST, or without a script_hash, still have the AST embeded, pickle.loads handles both
+def dumpRunner( runner ):
+  if runner.script_hash is None:
+    return pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+
+  buff = io.BytesIO()
+  pickler = pickle.Pickler( buff, protocol=PICKLE_PROTOCOL )
+  pickler.dispatch_table = _runner_dispatch_table
+  pickler.dump( runner )
+
+  return buff.getvalue()
+
+
+def loadRunner( blob ):
+  return pickle.loads( blob )
+
+
+@cinp.model( not_allowed_verb_list=[ 'LIST', 'GET', 'CREATE', 'UPDATE', 'DELETE' ], hide_field_list=( 'script_runner', 'script_ast', 'wake_at', 'waiting_on_subcontractor', 'lease_expires' ), property_list=( 'progress', 'can_start' ) )
 class BaseJob( models.Model ):
   JOB_STATE_CHOICES = ( 'queued', 'waiting', 'done', 'paused', 'error', 'aborted' )
+  JOB_TYPE = None  # the subclass's accessor from BaseJob, stored in job_type
   site = models.ForeignKey( Site, editable=False, on_delete=models.CASCADE )
   state = models.CharField( max_length=10, choices=[ ( i, i ) for i in JOB_STATE_CHOICES ] )
   status = JSONField( default=[], blank=True )
   message = models.CharField( max_length=1024, default='', blank=True )
   script_runner = models.BinaryField( editable=False )
+  script_ast = models.ForeignKey( ScriptAST, null=True, blank=True, editable=False, on_delete=models.PROTECT )
+  wake_at = models.DateTimeField( null=True, blank=True, editable=False )  # the runner will not get anything done before this
+  waiting_on_subcontractor = models.BooleanField( default=False, editable=False )  # the runner will not get anything done until the results come back
+  lease_expires = models.DateTimeField( null=True, blank=True, editable=False )  # claimed by a worker until then, when the DB can not skip locked rows
   script_name = models.CharField( max_length=40, editable=False, default=False )
+  job_type = models.CharField( max_length=20, editable=False, blank=True, default='' )
   updated = models.DateTimeField( editable=False, auto_now=True )
   created = models.DateTimeField( editable=False, auto_now_add=True )
 
   @property
   def realJob( self ):
+    if self.JOB_TYPE is not None:
+      return self
+
+    if self.job_type:
+      return getattr( self, self.job_type )
+
     try:
       return self.foundationjob
     except ObjectDoesNotExist:
@@ -72,6 +164,23 @@ class BaseJob( models.Model ):
   def can_start( self ):
     return False
 
+  def getRunner( self ):
+    return loadRunner( self.script_runner )
+
+  def setRunner( self, runner ):
+    if runner.script_hash is None:  # pickled before there was ScriptAST, move it's AST out of the job
+      runner.script_hash = hashlib.sha256( pickle.dumps( runner.ast, protocol=PICKLE_PROTOCOL ) ).hexdigest()
+      ScriptAST.store( runner.script_hash, runner.ast )
+
+    self.script_runner = dumpRunner( runner )
+    self.script_ast_id = runner.script_hash
+
+    self.waiting_on_subcontractor = runner.waiting_on_subcontractor
+    wake_at = runner.wake_at
+    if wake_at is not None and timezone.is_naive( wake_at ):
+      wake_at = timezone.make_aware( wake_at, timezone.utc )
+    self.wake_at = wake_at
+
   @cinp.action()
   def pause( self ):
     """
@@ -113,10 +222,10 @@ class BaseJob( models.Model ):
     if self.state != 'error':
       raise ForemanException( 'NOT_ERRORED', 'Can only reset a job if it is in error' )
 
-    runner = pickle.loads( self.script_runner )
+    runner = self.getRunner()
     runner.clearDispatched()
     self.status = runner.status
-    self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    self.setRunner( runner )
 
     self.state = 'queued'
     self.full_clean()
@@ -133,13 +242,13 @@ class BaseJob( models.Model ):
     if self.state != 'error':
       raise ForemanException( 'NOT_ERRORED', 'Can only rollback a job if it is in error' )
 
-    runner = pickle.loads( self.script_runner )
+    runner = self.getRunner()
     msg = runner.rollback()
     if msg != 'Done':
       raise ValueError( 'Unable to rollback "{0}"'.format( msg ) )
 
     self.status = runner.status
-    self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    self.setRunner( runner )
     self.state = 'queued'
     self.full_clean()
     self.save()
@@ -156,10 +265,10 @@ class BaseJob( models.Model ):
     if self.state != 'queued':
       raise ForemanException( 'NOT_ERRORED', 'Can only clear the dispatched flag a job if it is in queued state' )
 
-    runner = pickle.loads( self.script_runner )
+    runner = self.getRunner()
     runner.clearDispatched()
     self.status = runner.status
-    self.script_runner = pickle.dumps( runner, protocol=PICKLE_PROTOCOL )
+    self.setRunner( runner )
 
     self.full_clean()
     self.save()
@@ -178,7 +287,8 @@ class BaseJob( models.Model ):
     Returns variables internal to the job script
     """
     result = {}
-    runner = pickle.loads( self.script_runner )
+    runner = self.getRunner()
+    runner.loadObjects()
 
     for module in runner.value_map:
       for name in runner.value_map[ module ]:
@@ -194,7 +304,7 @@ class BaseJob( models.Model ):
     Returns the state of the job script
     """
     result = {}
-    runner = pickle.loads( self.script_runner )
+    runner = self.getRunner()
 
     blueprint = None
 
@@ -225,6 +335,35 @@ class BaseJob( models.Model ):
 
     return result
 
+  @cinp.action( paramater_type_list=[ { 'type': 'Boolean' } ] )
+  def profile( self, enable ):
+    """
+    Start or stop collecting execution counts and times of the job script, see
+    jobRunnerProfile.  Stopping discards what has been collected.
+    """
+    job = BaseJob.objects.select_for_update().get( pk=self.pk )  # the job may of been run since this was loaded, don't write back an old runner
+    runner = job.getRunner()
+    if not enable:
+      runner.tracer = None
+    elif not isinstance( runner.tracer, ProfileTracer ):
+      runner.tracer = ProfileTracer()
+
+    job.setRunner( runner )
+    job.full_clean()
+    job.save( update_fields=[ 'script_runner', 'script_ast', 'waiting_on_subcontractor', 'wake_at', 'updated' ] )
+
+  @cinp.action( return_type={ 'type': 'Map' } )
+  def jobRunnerProfile( self ):
+    """
+    Returns the execution counts and times of the job script collected since profile
+    was enabled, by script line, by script node type, and wall time by external function
+    """
+    runner = self.getRunner()
+    if not isinstance( runner.tracer, ProfileTracer ):
+      return {}
+
+    return runner.tracer.summary()
+
   @cinp.check_auth()
   @staticmethod
   def checkAuth( user, verb, id_list, action=None ):
@@ -240,6 +379,9 @@ class BaseJob( models.Model ):
     super().clean( *args, **kwargs )
     errors = {}
 
+    if self.JOB_TYPE is not None:
+      self.job_type = self.JOB_TYPE
+
     if self.state not in self.JOB_STATE_CHOICES:
       errors[ 'state' ] = 'Invalid state "{0}"'.format( self.state )
 
@@ -250,8 +392,9 @@ class BaseJob( models.Model ):
     return 'BaseJob #{0} in "{1}"'.format( self.pk, self.site.pk )
 
 
-@cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE', 'DELETE' ], hide_field_list=( 'script_runner', ), property_list=( 'progress', 'can_start' ) )
+@cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE', 'DELETE' ], hide_field_list=( 'script_runner', 'script_ast', 'wake_at', 'waiting_on_subcontractor', 'lease_expires' ), property_list=( 'progress', 'can_start' ) )
 class FoundationJob( BaseJob ):
+  JOB_TYPE = 'foundationjob'
   foundation = models.OneToOneField( Foundation, editable=False, on_delete=models.CASCADE )
 
   def done( self ):
@@ -334,6 +477,20 @@ class FoundationJob( BaseJob ):
     """
     return super().jobRunnerState()
 
+  @cinp.action( paramater_type_list=[ { 'type': 'Boolean' } ] )
+  def profile( self, enable ):
+    """
+    See BaseJob.profile
+    """
+    super().profile( enable )
+
+  @cinp.action( return_type={ 'type': 'Map' } )
+  def jobRunnerProfile( self ):
+    """
+    See BaseJob.jobRunnerProfile
+    """
+    return super().jobRunnerProfile()
+
   @cinp.action( return_type={ 'type': 'Model', 'model': 'contractor.Foreman.models.FoundationJob' }, paramater_type_list=[ { 'type': 'Model', 'model': Foundation } ] )
   @staticmethod
   def getFoundationJob( foundation ):
@@ -359,8 +516,9 @@ class FoundationJob( BaseJob ):
     return 'FoundationJob #{0} for "{1}" in "{2}"'.format( self.pk, self.foundation.pk, self.foundation.site.pk )
 
 
-@cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE', 'DELETE' ], hide_field_list=( 'script_runner', ), property_list=( 'progress', 'can_start' ) )
+@cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE', 'DELETE' ], hide_field_list=( 'script_runner', 'script_ast', 'wake_at', 'waiting_on_subcontractor', 'lease_expires' ), property_list=( 'progress', 'can_start' ) )
 class StructureJob( BaseJob ):
+  JOB_TYPE = 'structurejob'
   structure = models.OneToOneField( Structure, editable=False, on_delete=models.CASCADE )
 
   def done( self ):
@@ -442,6 +600,20 @@ class StructureJob( BaseJob ):
     """
     return super().jobRunnerState()
 
+  @cinp.action( paramater_type_list=[ { 'type': 'Boolean' } ] )
+  def profile( self, enable ):
+    """
+    See BaseJob.profile
+    """
+    super().profile( enable )
+
+  @cinp.action( return_type={ 'type': 'Map' } )
+  def jobRunnerProfile( self ):
+    """
+    See BaseJob.jobRunnerProfile
+    """
+    return super().jobRunnerProfile()
+
   @cinp.action( return_type={ 'type': 'Model', 'model': 'contractor.Foreman.models.StructureJob' }, paramater_type_list=[ { 'type': 'Model', 'model': Structure } ] )
   @staticmethod
   def getStructureJob( structure ):
@@ -467,8 +639,9 @@ class StructureJob( BaseJob ):
     return 'StructureJob #{0} for "{1}" in "{2}"'.format( self.pk, self.structure.pk, self.structure.site.pk )
 
 
-@cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE', 'DELETE' ], hide_field_list=( 'script_runner', ), property_list=( 'progress', 'can_start' ) )
+@cinp.model( not_allowed_verb_list=[ 'CREATE', 'UPDATE', 'DELETE' ], hide_field_list=( 'script_runner', 'script_ast', 'wake_at', 'waiting_on_subcontractor', 'lease_expires' ), property_list=( 'progress', 'can_start' ) )
 class DependencyJob( BaseJob ):
+  JOB_TYPE = 'dependencyjob'
   dependency = models.OneToOneField( Dependency, editable=False, on_delete=models.CASCADE )
 
   def done( self ):
@@ -558,6 +731,20 @@ class DependencyJob( BaseJob ):
     """
     return super().jobRunnerState()
 
+  @cinp.action( paramater_type_list=[ { 'type': 'Boolean' } ] )
+  def profile( self, enable ):
+    """
+    See BaseJob.profile
+    """
+    super().profile( enable )
+
+  @cinp.action( return_type={ 'type': 'Map' } )
+  def jobRunnerProfile( self ):
+    """
+    See BaseJob.jobRunnerProfile
+    """
+    return super().jobRunnerProfile()
+
   @cinp.action( return_type={ 'type': 'Model', 'model': 'contractor.Foreman.models.DependencyJob' }, paramater_type_list=[ { 'type': 'Model', 'model': Dependency } ] )
   @staticmethod
   def getDependencyJob( dependency ):
@@ -688,3 +875,8 @@ class JobLog( models.Model ):
 
   def __str__( self ):
     return 'JobLog for Job #{0} for "{1}"({2}) at "{3}"'.format( self.job_id, self.target_id, self.target_class, self.at )
+
+
+for job_class in ( BaseJob, FoundationJob, StructureJob, DependencyJob ):
+  post_save.connect( job_change_callback, sender=job_class )
+  post_delete.connect( job_change_callback, sender=job_class )
@@ -0,0 +1,52 @@
+import threading
+
+from django.db import transaction
+
+# lets a long polling getJobs know that the jobs of it's site have changed, only works within this process, other
+# processes are picked up by the polling in processJobs
+
+_condition = threading.Condition()
+_generation_map = {}  # site id -> number of changes so far, so a waiter can tell if something changed before it started waiting
+_idle_map = {}  # site id -> the generation the last processJobs that had nothing to hand out commited at
+
+
+def siteGeneration( site_id ):
+  with _condition:
+    return _generation_map.get( site_id, 0 )
+
+
+def siteChanged( site_id ):
+  with _condition:
+    _generation_map[ site_id ] = _generation_map.get( site_id, 0 ) + 1
+    _condition.notify_all()
+
+
+def waitForChange( site_id, generation, timeout ):  # returns False if it timed out
+  with _condition:
+    return _condition.wait_for( lambda: _generation_map.get( site_id, 0 ) != generation, timeout )
+
+
+def siteIdle( site_id ):  # once commited, so the changes the empty processJobs made are included
+  def _idle():
+    with _condition:
+      _idle_map[ site_id ] = _generation_map.get( site_id, 0 )
+
+  _onCommit( _idle )
+
+
+def idleGeneration( site_id ):
+  with _condition:
+    return _idle_map.get( site_id, None )
+
+
+def _onCommit( func ):
+  connection = transaction.get_connection()
+  if not connection.in_atomic_block and not connection.get_autocommit():  # cinp runs requests with autocommit off, on_commit refuses that, django still runs the hooks when cinp turns autocommit back on after the commit
+    connection.run_on_commit.append( ( set(), func ) )
+  else:
+    transaction.on_commit( func )
+
+
+def job_change_callback( **kwargs ):
+  site_id = kwargs[ 'instance' ].site_id
+  _onCommit( lambda: siteChanged( site_id ) )
@@ -1,11 +1,16 @@
+import copy
+
 from contractor.fields import config_name_regex
 from contractor.lib.config import getConfig
 from contractor.tscript.runner import ParamaterError
 
 
-def getWrapper( target, key ):  # TODO: find a way to make this less expensive, mabey something that can detect if the target has changed, without calling getConfig
-  config = getConfig( target )
-  return config[ key ]
+_config_generation = 0  # bumped by anything that saves something config is built from, so ConfigPlugin snapshots know they are stale
+
+
+def _configChanged():
+  global _config_generation
+  _config_generation += 1
 
 
 class SetConfig():
@@ -46,6 +51,7 @@ class SetConfig():
 
     self.structure.full_clean()
     self.structure.save( update_fields=[ 'config_values' ] )
+    _configChanged()
 
 
 class ConfigPlugin( object ):
@@ -56,18 +62,48 @@ class ConfigPlugin( object ):
     if isinstance( target, tuple ):
       self.target_class = target[0]
       self.target_pk = target[1]
-      self.target = self.target_class.objects.get( pk=self.target_pk )
+      self._target = None
 
     else:
-      self.target = target.subclass
-      self.target_class = self.target.__class__
-      self.target_pk = self.target.pk
+      self._target = target.subclass
+      self.target_class = self._target.__class__
+      self.target_pk = self._target.pk
+
+    self._config = None
+    self._config_generation = None
+
+  @property
+  def target( self ):  # not loaded until needed, so unpickling a runner does not touch the db
+    if self._target is None:
+      self._target = self.target_class.objects.get( pk=self.target_pk )
+
+    return self._target
+
+  def _getConfig( self ):  # resolved at most once per run, unless something is saved, see _configChanged
+    if self._config is None or self._config_generation != _config_generation:
+      if self._config is not None:  # the change was saved through some other instance of the target, ie: StructurePlugin's
+        self._target = None
+
+      self._config_generation = _config_generation
+      self._config = getConfig( self.target )
+
+    return self._config
+
+  def _getValue( self, key ):
+    value = self._getConfig()[ key ]
+    if isinstance( value, ( dict, list ) ):  # the runner does not copy module values before changing them in place, ie: pop( array=config.thing ), so the snapshot stays as it is
+      return copy.deepcopy( value )
+
+    return value
+
+  def startRun( self ):
+    self._config = None
 
   def getValues( self ):
-    config = getConfig( self.target )
+    config = self._getConfig()
     result = {}
     for key in config:
-      result[ key ] = ( lambda key=key: getWrapper( self.target, key ), None )
+      result[ key ] = ( lambda key=key: self._getValue( key ), None )
 
     return result
 
@@ -90,17 +126,24 @@ class FoundationPlugin( object ):  # TODO: really should have the RO version be
     if isinstance( foundation, tuple ):
       self.foundation_class = foundation[0]
       self.foundation_pk = foundation[1]
-      self.foundation = self.foundation_class.objects.get( pk=self.foundation_pk )
+      self._foundation = None
 
     else:
-      self.foundation = foundation.subclass
-      self.foundation_class = self.foundation.__class__
-      self.foundation_pk = self.foundation.pk
+      self._foundation = foundation.subclass
+      self.foundation_class = self._foundation.__class__
+      self.foundation_pk = self._foundation.pk
 
     self.value_map = self.foundation_class.getTscriptValues( write )
     self.function_map = self.foundation_class.getTscriptFunctions()
 
-  def _setValue( self, name, val ):
+  @property
+  def foundation( self ):
+    if self._foundation is None:
+      self._foundation = self.foundation_class.objects.get( pk=self.foundation_pk )
+
+    return self._foundation
+
+  def _setValue( self, name, val ):  # NOTE: saved when the runner is stored, so config sees it on the next run, not this one
     setter = self.value_map[ name ][1]
     setter( self.foundation, val )
     self._dirty_list.append( name )
@@ -153,12 +196,19 @@ class StructurePlugin( object ):  # ie: structure with some settable attributes,
     if isinstance( structure, tuple ):
       self.structure_class = structure[0]
       self.structure_pk = structure[1]
-      self.structure = self.structure_class.objects.get( pk=self.structure_pk )
+      self._structure = None
 
     else:
-      self.structure = structure
-      self.structure_class = self.structure.__class__
-      self.structure_pk = self.structure.pk
+      self._structure = structure
+      self.structure_class = self._structure.__class__
+      self.structure_pk = self._structure.pk
+
+  @property
+  def structure( self ):
+    if self._structure is None:
+      self._structure = self.structure_class.objects.get( pk=self.structure_pk )
+
+    return self._structure
 
   def getValues( self ):
     result = {}
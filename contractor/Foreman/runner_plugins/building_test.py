@@ -1,7 +1,8 @@
 import pytest
 
-from contractor.Foreman.runner_plugins.building import SetConfig
-from contractor.tscript.runner import ParamaterError
+from contractor.Foreman.runner_plugins.building import SetConfig, ConfigPlugin, FoundationPlugin, StructurePlugin
+from contractor.tscript.parser import parse
+from contractor.tscript.runner import Runner, ParamaterError
 
 
 class fakeStructure():
@@ -15,6 +16,23 @@ class fakeStructure():
     pass
 
 
+class fakeManager():
+  def __init__( self ):
+    self.get_count = 0
+
+  def get( self, pk ):
+    self.get_count += 1
+    return fakeTarget()
+
+
+class fakeTarget():
+  objects = fakeManager()
+
+  def __init__( self ):
+    self.subclass = self
+    self.pk = 1
+
+
 def test_setconfig():
   s = fakeStructure( { 'a': 2, 'b': 10 } )
   sc = SetConfig( s )
@@ -88,3 +106,86 @@ def test_setconfig():
   sc = SetConfig( s )
   sc( 'a.a|d', 4 )
   assert s.config_values == { 'a': { 'a|d': 4 }, 'b': 10 }
+
+
+def test_config_snapshot( mocker ):
+  config_map = dict( ( 'key{0}'.format( i ), i ) for i in range( 0, 30 ) )
+  getConfig = mocker.patch( 'contractor.Foreman.runner_plugins.building.getConfig', side_effect=lambda target: dict( config_map ) )
+
+  script = '\n'.join( [ 'total = 0' ] + [ 'total = ( total + config.key{0} )'.format( i ) for i in range( 0, 30 ) ] )
+  runner = Runner( parse( script ) )
+  runner.registerObject( ConfigPlugin( fakeTarget() ) )
+  assert getConfig.call_count == 0
+  assert runner.run() == ''
+  assert runner.variable_map[ 'total' ] == 435
+  assert getConfig.call_count == 1
+
+  runner = Runner( parse( 'aa = config.key1\nbb = config.key2' ) )
+  runner.registerObject( ConfigPlugin( fakeTarget() ) )
+  assert runner.run() == ''
+  assert getConfig.call_count == 2
+  assert runner.run() == 'done'
+  assert getConfig.call_count == 2
+
+  runner = Runner( parse( 'aa = config.key1\nbb = config.key2' ) )
+  runner.registerObject( ConfigPlugin( fakeTarget() ) )
+  assert runner.getValue( 'config', 'key3' ) == 3
+  assert getConfig.call_count == 3
+  assert runner.run() == ''  # a new run re-resolves, but only once
+  assert getConfig.call_count == 4
+
+  s = fakeStructure( { 'key1': 2 } )
+  SetConfig( s )( 'key1', 20 )
+  config_map[ 'key1' ] = 20
+  assert runner.getValue( 'config', 'key1' ) == 20
+  assert runner.getValue( 'config', 'key2' ) == 2
+  assert getConfig.call_count == 5
+
+  # the target is re-loaded, SetConfig saved through StructurePlugin's instance
+  plugin = ConfigPlugin( ( fakeTarget, 1 ) )
+  runner = Runner( parse( 'aa = config.key1' ) )
+  runner.registerObject( plugin )
+  get_count = fakeTarget.objects.get_count
+  assert runner.getValue( 'config', 'key1' ) == 20
+  target = plugin.target
+  assert fakeTarget.objects.get_count == get_count + 1
+  assert runner.getValue( 'config', 'key2' ) == 2
+  assert plugin.target is target
+  SetConfig( s )( 'key1', 21 )
+  assert runner.getValue( 'config', 'key2' ) == 2
+  assert plugin.target is not target
+  assert fakeTarget.objects.get_count == get_count + 2
+
+  # changing a value in place does not change the snapshot
+  config_map[ 'lst' ] = [ 1, 2, 3 ]
+  config_map[ 'map' ] = { 'a': 1 }
+  runner = Runner( parse( 'aa = pop( array=config.lst )\nbb = config.lst\ncc = append( array=config.lst, value=4 )\ndd = config.lst\nee = config.map\nee[ "b" ] = 2\nff = config.map' ) )
+  runner.registerObject( ConfigPlugin( fakeTarget() ) )
+  assert runner.run() == ''
+  assert runner.done
+  assert runner.variable_map[ 'aa' ] == 3
+  assert runner.variable_map[ 'bb' ] == [ 1, 2, 3 ]
+  assert runner.variable_map[ 'dd' ] == [ 1, 2, 3 ]
+  assert runner.variable_map[ 'ee' ] == { 'a': 1, 'b': 2 }
+  assert runner.variable_map[ 'ff' ] == { 'a': 1 }
+
+
+class fakeTargetClass():
+  objects = fakeManager()
+
+  @staticmethod
+  def getTscriptValues( write_mode ):
+    return {}
+
+  @staticmethod
+  def getTscriptFunctions():
+    return {}
+
+
+def test_lazy_target():
+  ConfigPlugin( ( fakeTargetClass, 1 ) )
+  FoundationPlugin( ( fakeTargetClass, 1 ) )
+  plugin = StructurePlugin( ( fakeTargetClass, 1 ) )
+  assert fakeTargetClass.objects.get_count == 0
+  assert plugin.structure is plugin.structure
+  assert fakeTargetClass.objects.get_count == 1
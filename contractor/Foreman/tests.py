@@ -2,17 +2,23 @@ import pytest
 import pickle
 import time
 import threading
+from datetime import timedelta
 
-from django.db import transaction
+from django.db import transaction, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from contractor.tscript.parser import parse
+from contractor.tscript.parser import parse, parse_cache, scriptHash
 from contractor.tscript.runner import Runner
+from contractor.tscript.vm import VMRunner
 from contractor.Site.models import Site
-from contractor.Foreman.models import BaseJob  # , FoundationJob, StructureJob, DependencyJob
+from contractor.Foreman.models import BaseJob, ScriptAST, ForemanException, FoundationJob, StructureJob, DependencyJob
 from contractor.Building.models import Foundation, Structure, Dependency
-from contractor.BluePrint.models import StructureBluePrint, FoundationBluePrint  # , BluePrintScript, Script
+from contractor.BluePrint.models import StructureBluePrint, FoundationBluePrint, BluePrintScript, Script
 
-from contractor.Foreman.lib import processJobs, jobResults, createJob
+from contractor.Foreman import lib
+from contractor.Foreman.notify import siteGeneration, siteChanged, job_change_callback
+from contractor.Foreman.lib import processJobs, jobResults, jobResultsBatch, jobError, createJob
 
 
 class TestUser():
@@ -128,7 +134,7 @@ def test_job_locking( mocker ):
 
   with transaction.atomic():
     cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
-    assert rc == [{'function': 'remote_func', 'job_id': 1, 'module': 'testing', 'paramaters': 'the count "4"'}]
+    assert rc == [{'function': 'remote_func', 'job_id': 1, 'module': 'testing', 'paramaters': 'the count "3"'}]
 
   with transaction.atomic():
     j = BaseJob.objects.get()
@@ -164,7 +170,7 @@ def test_job_locking( mocker ):
   # now we test intrupting the job checking with results, first during a slow toSubcontractor
   with transaction.atomic():
     cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
-    assert rc == [{'function': 'remote_func', 'job_id': 1, 'module': 'testing', 'paramaters': 'the count "5"'}]
+    assert rc == [{'function': 'remote_func', 'job_id': 1, 'module': 'testing', 'paramaters': 'the count "4"'}]
 
   with transaction.atomic():
     j = BaseJob.objects.get()
@@ -206,13 +212,23 @@ def test_job_locking( mocker ):
   # then just before the transaction commits
   with transaction.atomic():
     cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
-    assert rc == [{'function': 'remote_func', 'job_id': 1, 'module': 'testing', 'paramaters': 'the count "7"'}]
+    assert rc == [{'function': 'remote_func', 'job_id': 1, 'module': 'testing', 'paramaters': 'the count "5"'}]
 
   with transaction.atomic():
     j = BaseJob.objects.get()
     assert j.state == 'queued'
+    assert j.waiting_on_subcontractor is True
     assert j.jobRunnerState()[ 'state' ][2][1][ 'dispatched' ] is True
 
+  with transaction.atomic():  # processJobs skips jobs waiting on subcontractor, so let this one run again
+    jobResults( rc[0][ 'job_id' ], cookie, None )
+
+  with transaction.atomic():
+    j = BaseJob.objects.get()
+    assert j.state == 'queued'
+    assert j.waiting_on_subcontractor is False
+    assert j.jobRunnerState()[ 'state' ][2][1][ 'dispatched' ] is False
+
   _to_can_continue = True
   _process_jobs_can_finish = False
   t = threading.Thread( target=_do_processJobs, args=( s, [ 'testing' ], 10 ) )
@@ -223,14 +239,14 @@ def test_job_locking( mocker ):
     with transaction.atomic():
       j = BaseJob.objects.get()
       assert j.state == 'queued'
-      assert j.jobRunnerState()[ 'state' ][2][1][ 'dispatched' ] is True
+      assert j.jobRunnerState()[ 'state' ][2][1][ 'dispatched' ] is False
 
       t2 = threading.Thread( target=_do_jobResults, args=( rc[0][ 'job_id' ], cookie, None ) )  # jobResults should block b/c the record is locked
       t2.start()
 
       j = BaseJob.objects.get()
       assert j.state == 'queued'
-      assert j.jobRunnerState()[ 'state' ][2][1][ 'dispatched' ] is True
+      assert j.jobRunnerState()[ 'state' ][2][1][ 'dispatched' ] is False
 
     time.sleep( 0.5 )
     _process_jobs_can_finish = True
@@ -260,7 +276,7 @@ def test_job_locking( mocker ):
   # and finish up the job
   with transaction.atomic():
     cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
-    assert rc == [{'function': 'remote_func', 'job_id': 1, 'module': 'testing', 'paramaters': 'the count "9"'}]
+    assert rc == [{'function': 'remote_func', 'job_id': 1, 'module': 'testing', 'paramaters': 'the count "7"'}]
 
   with transaction.atomic():
     jobResults( rc[0][ 'job_id' ], cookie, 'adf' )
@@ -287,6 +303,534 @@ def test_job_create():
   assert str( execinfo.value.code ) == 'INVALID_TARGET'
 
 
+@pytest.mark.django_db()
+def test_script_ast():
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  script = 'count = 1\nname = "stuff"\nwhile ( count < 3 ) do count = ( count + 1 )\n'
+  ast = parse( script )
+
+  runner = Runner( ast )
+  legacy_blob = pickle.dumps( runner )
+
+  runner.script_hash = scriptHash( script )
+  ScriptAST.store( runner.script_hash, ast )
+  assert ScriptAST.objects.count() == 1
+  ScriptAST.store( runner.script_hash, ast )
+  assert ScriptAST.objects.count() == 1
+
+  job = BaseJob( site=s, state='queued', script_name='test' )
+  job.setRunner( runner )
+  job.full_clean()
+  job.save()
+  assert job.script_ast_id == runner.script_hash
+  assert len( job.script_runner ) < len( legacy_blob )
+
+  parse_cache.clear()
+  job = BaseJob.objects.get( pk=job.pk )
+  runner = job.getRunner()
+  assert runner.ast == ast
+  assert runner.script_hash == scriptHash( script )
+  assert runner.run() == ''
+  assert runner.variable_map == { 'count': 3, 'name': 'stuff' }
+
+  job.setRunner( runner )
+  runner = job.getRunner()
+  assert runner.done
+  assert runner.variable_map == { 'count': 3, 'name': 'stuff' }
+
+  ScriptAST.cleanup()  # to young, and still in use
+  assert ScriptAST.objects.count() == 1
+
+  # jobs saved before ScriptAST move the AST out the next time they are saved
+  job2 = BaseJob( site=s, state='queued', script_name='test' )
+  job2.script_runner = legacy_blob
+  job2.full_clean()
+  job2.save()
+  runner = job2.getRunner()
+  assert runner.script_hash is None
+  assert runner.ast == ast
+  job2.setRunner( runner )
+  job2.save()
+  assert job2.script_ast_id is not None
+  assert job2.script_ast_id != job.script_ast_id
+  assert ScriptAST.objects.count() == 2
+  assert job2.getRunner().ast == ast
+
+  job2.setRunner( VMRunner( ast ) )
+  runner = job2.getRunner()
+  assert isinstance( runner, VMRunner )
+  runner.run()
+  assert runner.variable_map == { 'count': 3, 'name': 'stuff' }
+
+  job.delete()
+  job2.delete()
+  ScriptAST.objects.all().update( created='2000-01-01T00:00:00Z' )
+  Script( name='test', description='test', script=script ).save()
+  ScriptAST.cleanup()  # the AST of a current Script is kept
+  assert list( ScriptAST.objects.all().values_list( 'script_hash', flat=True ) ) == [ scriptHash( script ) ]
+
+  Script.objects.all().delete()
+  ScriptAST.cleanup()
+  assert ScriptAST.objects.count() == 0
+
+
+@pytest.mark.django_db()
+def test_job_wake( mocker ):
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  job = BaseJob( site=s, state='queued', script_name='test' )
+  job.setRunner( Runner( parse( 'delay( minutes=5 )' ) ) )
+  job.full_clean()
+  job.save()
+  assert job.wake_at is None
+  assert job.waiting_on_subcontractor is False
+
+  runner = Runner( parse( 'testing.remote()' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  job2 = BaseJob( site=s, state='queued', script_name='test' )
+  job2.setRunner( runner )
+  job2.full_clean()
+  job2.save()
+
+  get_runner = mocker.spy( BaseJob, 'getRunner' )
+
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
+  assert rc == [ { 'function': 'remote_func', 'job_id': job2.pk, 'module': 'testing', 'paramaters': 'the count "1"' } ]
+  assert get_runner.call_count == 2
+
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.wake_at > timezone.now() + timedelta( minutes=4 )
+  assert job.waiting_on_subcontractor is False
+  job2 = BaseJob.objects.get( pk=job2.pk )
+  assert job2.wake_at is None
+  assert job2.waiting_on_subcontractor is True
+
+  # neither can do anything
+  assert processJobs( s, [ 'testing' ], 10 ) == []
+  assert get_runner.call_count == 2
+
+  jobResults( job2.pk, cookie, 'stuff' )
+  job2 = BaseJob.objects.get( pk=job2.pk )
+  assert job2.waiting_on_subcontractor is False
+
+  BaseJob.objects.filter( pk=job.pk ).update( wake_at=timezone.now() )
+  assert processJobs( s, [ 'testing' ], 10 ) == []
+  assert get_runner.call_count == 5  # jobResults + the two jobs
+
+  job2 = BaseJob.objects.get( pk=job2.pk )
+  assert job2.getRunner().done
+
+
+@pytest.mark.django_db()
+def test_job_claim( mocker ):
+  mocker.patch.dict( lib._site_cursor_map, clear=True )
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  for i in range( 0, 5 ):
+    runner = Runner( parse( 'testing.remote()' ) )
+    runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+    job = BaseJob( site=s, state='queued', script_name='test' )
+    job.setRunner( runner )
+    job.full_clean()
+    job.save()
+
+  job_list = list( BaseJob.objects.all().order_by( 'pk' ) )
+
+  # leased by another worker
+  BaseJob.objects.filter( pk=job_list[0].pk ).update( lease_expires=timezone.now() + timedelta( minutes=1 ) )
+  # that worker died
+  BaseJob.objects.filter( pk=job_list[1].pk ).update( lease_expires=timezone.now() - timedelta( minutes=1 ) )
+
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 2 ) )
+  assert sorted( [ i[ 'job_id' ] for i in rc ] ) == [ job_list[1].pk, job_list[2].pk ]
+
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
+  assert sorted( [ i[ 'job_id' ] for i in rc ] ) == [ job_list[3].pk, job_list[4].pk ]
+
+  assert BaseJob.objects.filter( lease_expires__isnull=True ).count() == 4
+  assert BaseJob.objects.filter( waiting_on_subcontractor=True ).count() == 4
+
+  # DBs that can skip locked rows don't need the lease
+  mocker.patch.object( connection.features, 'has_select_for_update_skip_locked', True )
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
+  assert [ i[ 'job_id' ] for i in rc ] == [ job_list[0].pk ]
+
+
+@pytest.mark.django_db()
+def test_job_budget( mocker ):
+  mocker.patch.dict( lib._site_cursor_map, clear=True )
+  mocker.patch( 'contractor.Foreman.lib.JOB_TIME_BUDGET', 2.5 )
+  mocker.patch( 'contractor.Foreman.lib.JOB_TIME_SLICE', 2 )
+  clock = [ 0.0 ]
+  mocker.patch( 'contractor.Foreman.lib.time', mocker.Mock( monotonic=lambda: clock[0] ) )
+  run_list = []
+  real_runJob = lib._runJob
+
+  def _fake_runJob( job, module_list, budget, max_tasks ):  # each job takes a second
+    clock[0] += 1.0
+    run_list.append( ( job.pk, budget ) )
+    return real_runJob( job, module_list, budget, max_tasks )
+
+  mocker.patch( 'contractor.Foreman.lib._runJob', _fake_runJob )
+
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  for i in range( 0, 4 ):
+    runner = Runner( parse( 'testing.remote()' ) )
+    runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+    job = BaseJob( site=s, state='queued', script_name='test' )
+    job.setRunner( runner )
+    job.full_clean()
+    job.save()
+
+  job_list = [ job.pk for job in BaseJob.objects.all().order_by( 'pk' ) ]
+
+  assert processJobs( s, [], 10 ) == []
+  assert run_list == [ ( job_list[0], 2 ), ( job_list[1], 1.5 ), ( job_list[2], 0.5 ) ]
+  assert BaseJob.objects.filter( lease_expires__isnull=False ).count() == 0  # including the one it did not get to
+
+  run_list.clear()
+  assert processJobs( s, [], 10 ) == []
+  assert run_list == [ ( job_list[3], 2 ), ( job_list[0], 1.5 ), ( job_list[1], 0.5 ) ]
+
+  run_list.clear()
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
+  assert [ i[ 'job_id' ] for i in rc ] == [ job_list[2], job_list[3], job_list[0] ]
+  assert BaseJob.objects.filter( lease_expires__isnull=False ).count() == 0
+
+
+@pytest.mark.django_db()
+def test_job_parallel():
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  runner = VMRunner( parse( 'parallel()\n  aa = testing.remote()\n  bb = testing.remote()\n  cc = testing.remote()\nend' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  job = BaseJob( site=s, state='queued', script_name='test' )
+  job.setRunner( runner )
+  job.full_clean()
+  job.save()
+
+  rc = processJobs( s, [ 'testing' ], 2 )
+  assert len( rc ) == 2
+  assert len( set( [ i[ 'cookie' ] for i in rc ] ) ) == 2
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.waiting_on_subcontractor is False
+  assert [ i.get( 'dispatched' ) for i in job.status[ -1 ][2][ 'function_list' ] ] == [ True, True, False ]
+
+  rc += processJobs( s, [ 'testing' ], 10 )
+  assert len( rc ) == 3
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.waiting_on_subcontractor is True
+  assert processJobs( s, [ 'testing' ], 10 ) == []
+
+  assert jobResultsBatch( [ { 'job_id': job.pk, 'cookie': rc[ i ][ 'cookie' ], 'data': 'value {0}'.format( i ) } for i in range( 0, 3 ) ] ) == [ 'Accepted', 'Accepted', 'Accepted' ]
+  assert processJobs( s, [ 'testing' ], 10 ) == []
+  job = BaseJob.objects.get( pk=job.pk )
+  runner = job.getRunner()
+  assert runner.done
+  assert runner.variable_map == { 'aa': 'value 0', 'bb': 'value 1', 'cc': 'value 2' }
+
+  runner = VMRunner( parse( 'parallel()\n  aa = testing.remote()\n  bb = testing.remote()\nend' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  job = BaseJob( site=s, state='queued', script_name='test' )
+  job.setRunner( runner )
+  job.full_clean()
+  job.save()
+
+  rc = processJobs( s, [ 'testing' ], 10 )
+  assert len( rc ) == 2
+  with pytest.raises( ForemanException ):
+    jobError( job.pk, 'bad cookie', 'stuff' )
+
+  jobError( job.pk, rc[0][ 'cookie' ], 'the first one failed' )  # not the last cookie set up
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.state == 'error'
+  assert job.message == 'the first one failed'
+
+
+@pytest.mark.django_db()
+def test_job_results_batch():
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  for i in range( 0, 4 ):
+    runner = Runner( parse( 'testing.remote()' ) )
+    runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+    job = BaseJob( site=s, state='queued', script_name='test' )
+    job.setRunner( runner )
+    job.full_clean()
+    job.save()
+
+  rc = processJobs( s, [ 'testing' ], 10 )
+  rc.sort( key=lambda item: item[ 'job_id' ] )
+  assert len( rc ) == 4
+
+  result_list = [
+                  { 'job_id': rc[0][ 'job_id' ], 'cookie': rc[0][ 'cookie' ], 'data': 'stuff' },
+                  { 'job_id': rc[1][ 'job_id' ], 'cookie': 'bad', 'data': 'stuff' },
+                  { 'job_id': rc[2][ 'job_id' ], 'cookie': rc[2][ 'cookie' ], 'data': 'stuff' },
+                  { 'job_id': 1000, 'cookie': rc[3][ 'cookie' ], 'data': 'stuff' },
+                  { 'job_id': rc[0][ 'job_id' ], 'cookie': rc[0][ 'cookie' ], 'data': 'again' }
+                ]
+  with CaptureQueriesContext( connection ) as ctx:
+    assert jobResultsBatch( result_list ) == [ 'Accepted', 'Bad Cookie', 'Accepted', 'Job Not Found', 'Not Expecting Anything' ]
+  assert len( [ i for i in ctx.captured_queries if i[ 'sql' ].startswith( 'UPDATE' ) ] ) == 2
+
+  assert [ BaseJob.objects.get( pk=item[ 'job_id' ] ).waiting_on_subcontractor for item in rc ] == [ False, True, False, True ]
+
+  with pytest.raises( ForemanException ):
+    jobResults( rc[1][ 'job_id' ], 'bad', 'stuff' )
+
+  result_list = [
+                  { 'job_id': rc[1][ 'job_id' ], 'cookie': rc[1][ 'cookie' ] },
+                  { 'job_id': 'abc', 'cookie': rc[1][ 'cookie' ], 'data': 'stuff' },
+                  { 'cookie': rc[1][ 'cookie' ], 'data': 'stuff' },
+                  { 'job_id': rc[1][ 'job_id' ], 'cookie': rc[1][ 'cookie' ], 'data': 'stuff' },
+                  'stuff'
+                ]
+  assert jobResultsBatch( result_list ) == [ 'Invalid Entry', 'Invalid Entry', 'Invalid Entry', 'Accepted', 'Invalid Entry' ]
+  assert jobResultsBatch( [] ) == []
+  assert processJobs( s, [ 'testing' ], 10 ) == []
+  assert [ BaseJob.objects.get( pk=item[ 'job_id' ] ).getRunner().done for item in rc ] == [ True, True, True, False ]
+
+
+@pytest.mark.timeout( 20, method='thread' )
+@pytest.mark.django_db( transaction=True )
+def test_job_long_poll( mocker ):
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  start = time.monotonic()
+  assert processJobs( s, [ 'testing' ], 10, 1 ) == []
+  assert time.monotonic() - start >= 1
+
+  generation = siteGeneration( s.pk )
+  runner = Runner( parse( 'testing.remote()' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  job = BaseJob( site=s, state='queued', script_name='test' )
+  job.setRunner( runner )
+  job.full_clean()
+  job.save()
+  assert siteGeneration( s.pk ) == generation + 1
+
+  with transaction.atomic():  # not until it is commited
+    job.save()
+    assert siteGeneration( s.pk ) == generation + 1
+  assert siteGeneration( s.pk ) == generation + 2
+
+  transaction.set_autocommit( False )  # the way cinp does it, sqlite can't save with autocommit off, so just the signal
+  job_change_callback( instance=job )
+  transaction.commit()
+  assert siteGeneration( s.pk ) == generation + 2
+  transaction.set_autocommit( True )
+  assert siteGeneration( s.pk ) == generation + 3
+
+  start = time.monotonic()
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10, 10 ) )
+  assert rc == [ { 'function': 'remote_func', 'job_id': job.pk, 'module': 'testing', 'paramaters': 'the count "1"' } ]
+  assert time.monotonic() - start < 5
+
+  jobResults( job.pk, cookie, 'stuff' )
+  assert siteGeneration( s.pk ) == generation + 5  # processJobs saving the job, and then jobResults
+
+  mocker.patch( 'contractor.Foreman.lib._processJobs', side_effect=[ [], [], [ 'task' ] ] )
+  start = time.monotonic()
+  assert processJobs( s, [ 'testing' ], 10, 10 ) == []  # the job is there, but did not have anything to hand out
+  assert time.monotonic() - start < 5
+
+  start = time.monotonic()
+  assert processJobs( s, [ 'testing' ], 10, 1 ) == []  # nothing changed since
+  assert time.monotonic() - start >= 1
+
+  t = threading.Timer( 0.5, siteChanged, args=( s.pk, ) )
+  t.start()
+  start = time.monotonic()
+  assert processJobs( s, [ 'testing' ], 10, 10 ) == [ 'task' ]
+  assert 0.5 <= time.monotonic() - start < 5
+  t.join()
+
+
+@pytest.mark.django_db()
+def test_job_no_progress( mocker ):
+  mocker.patch( 'contractor.tscript.runner_plugins_test.Remote.run', lambda self: None )  # otherwise it counts each time it is run
+
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  runner = Runner( parse( 'testing.remote()' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  job = BaseJob( site=s, state='queued', script_name='test' )
+  job.setRunner( runner )
+  job.full_clean()
+  job.save()
+
+  assert processJobs( s, [], 10 ) == []  # runs up to the remote function, which this subcontractor can't do
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.status == [ [ 0.0, 'Scope', {} ], [ 0.0, 'Function', { 'dispatched': False, 'module': 'testing', 'name': 'remote' } ] ]
+  updated = job.updated
+
+  with CaptureQueriesContext( connection ) as ctx:
+    assert processJobs( s, [], 10 ) == []
+  update_list = [ i[ 'sql' ] for i in ctx.captured_queries if i[ 'sql' ].startswith( 'UPDATE' ) ]
+  assert len( update_list ) == 2  # claiming the lease, and giving it back
+  assert 'script_runner' not in update_list[1]
+  assert BaseJob.objects.get( pk=job.pk ).updated == updated
+
+  mocker.patch.object( connection.features, 'has_select_for_update_skip_locked', True )
+  with CaptureQueriesContext( connection ) as ctx:
+    assert processJobs( s, [], 10 ) == []
+  assert [ i[ 'sql' ] for i in ctx.captured_queries if i[ 'sql' ].startswith( 'UPDATE' ) ] == []
+
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
+  assert rc == [ { 'function': 'remote_func', 'job_id': job.pk, 'module': 'testing', 'paramaters': 'the count "0"' } ]
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.status == [ [ 0.0, 'Scope', {} ], [ 0.0, 'Function', { 'dispatched': True, 'module': 'testing', 'name': 'remote' } ] ]
+  assert job.updated > updated
+
+
+@pytest.mark.django_db()
+def test_job_profile():
+  s = Site( name='test', description='test' )
+  s.full_clean()
+  s.save()
+
+  runner = Runner( parse( 'aa = 1\ntesting.remote()' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  job = BaseJob( site=s, state='queued', script_name='test' )
+  job.setRunner( runner )
+  job.full_clean()
+  job.save()
+
+  assert job.jobRunnerProfile() == {}
+  job.profile( True )
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.jobRunnerProfile() == { 'line': {}, 'node': {}, 'function': {} }
+
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.jobRunnerProfile()[ 'line' ][ '1' ][ 'count' ] == 1
+  assert job.jobRunnerProfile()[ 'line' ][ '2' ][ 'count' ] == 1
+  assert job.jobRunnerProfile()[ 'function' ] == {}
+
+  jobResults( rc[0][ 'job_id' ], cookie, 'stuff' )
+  processJobs( s, [ 'testing' ], 10 )
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.jobRunnerProfile()[ 'function' ][ 'testing.remote' ][ 'count' ] == 1
+  assert job.jobRunnerProfile()[ 'line' ][ '2' ][ 'count' ] == 1
+
+  job.profile( False )
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.jobRunnerProfile() == {}
+  job.delete()
+
+  runner = Runner( parse( 'testing.remote()' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  job = BaseJob( site=s, state='queued', script_name='test' )
+  job.setRunner( runner )
+  job.full_clean()
+  job.save()
+
+  stale = BaseJob.objects.get( pk=job.pk )  # loaded before the job ran
+  cookie, rc = _stripcookie( processJobs( s, [ 'testing' ], 10 ) )
+  BaseJob.objects.filter( pk=job.pk ).update( state='paused' )
+  stale.profile( True )
+  job = BaseJob.objects.get( pk=job.pk )
+  assert job.state == 'paused'
+  assert job.waiting_on_subcontractor is True
+  assert job.jobRunnerProfile() == { 'line': {}, 'node': {}, 'function': {} }
+  assert jobResults( job.pk, cookie, 'stuff' ) == 'Accepted'
+
+
+def _make_waiting_jobs( si, fb, sb, prefix ):  # one of each type of job, none of them can start
+  f = Foundation( locator='{0}f'.format( prefix ), site=si, blueprint=fb )
+  f.full_clean()
+  f.save()
+  j = FoundationJob( foundation=f, site=si, state='waiting', script_name='create', script_runner=b'' )
+  j.full_clean()
+  j.save()
+
+  s = Structure( foundation=f, hostname='{0}s'.format( prefix ), site=si, blueprint=sb )
+  s.full_clean()
+  s.save()
+  j = StructureJob( structure=s, site=si, state='waiting', script_name='create', script_runner=b'' )
+  j.full_clean()
+  j.save()
+
+  f = Foundation( locator='{0}g'.format( prefix ), site=si, blueprint=fb )
+  f.full_clean()
+  f.save()
+  s = Structure( foundation=f, hostname='{0}t'.format( prefix ), site=si, blueprint=sb )
+  s.full_clean()
+  s.save()
+  f.setBuilt()
+  s.setBuilt()
+  j = FoundationJob( foundation=f, site=si, state='waiting', script_name='destroy', script_runner=b'' )
+  j.full_clean()
+  j.save()
+
+  d = Dependency( structure=s, link='soft' )
+  d.full_clean()
+  d.save()
+  d.setBuilt()
+  j = StructureJob( structure=s, site=si, state='waiting', script_name='destroy', script_runner=b'' )
+  j.full_clean()
+  j.save()
+  j = DependencyJob( dependency=d, site=si, state='waiting', script_name='create', script_runner=b'' )
+  j.full_clean()
+  j.save()
+
+  job = BaseJob( site=si, state='queued', script_name='test' )
+  job.setRunner( Runner( parse( 'delay( hours=1 )' ) ) )
+  job.full_clean()
+  job.save()
+
+
+@pytest.mark.django_db()
+def test_processjobs_queries():
+  si = Site( name='test', description='test' )
+  si.full_clean()
+  si.save()
+
+  fb = FoundationBluePrint( name='fdnb1', description='Foundation BluePrint 1' )
+  fb.foundation_type_list = [ 'Unknown' ]
+  fb.full_clean()
+  fb.save()
+
+  sb = StructureBluePrint( name='strb1', description='Structure BluePrint 1' )
+  sb.full_clean()
+  sb.save()
+  sb.foundation_blueprint_list.add( fb )
+
+  query_count_list = []
+  for i in range( 0, 3 ):
+    _make_waiting_jobs( si, fb, sb, 'set{0}'.format( i ) )
+    assert BaseJob.objects.filter( state='waiting' ).exclude( job_type='' ).count() == ( i + 1 ) * 5
+    BaseJob.objects.filter( state='queued' ).update( wake_at=None )
+
+    with CaptureQueriesContext( connection ) as ctx:
+      assert processJobs( si, [], 10 ) == []
+
+    assert BaseJob.objects.filter( state='waiting' ).count() == ( i + 1 ) * 5
+    assert BaseJob.objects.filter( state='queued', wake_at__isnull=False ).count() == i + 1
+    query_count_list.append( len( [ i for i in ctx.captured_queries if i[ 'sql' ].startswith( 'SELECT' ) ] ) )
+
+  assert query_count_list[0] == query_count_list[1] == query_count_list[2]
+
+
 @pytest.mark.django_db()
 def test_foundation_job_create():  # TODO: should also do tests depending on a Dependency
   si = Site()
@@ -454,6 +998,56 @@ def test_foundation_with_structure_job_create():
   assert str( execinfo.value.code ) == 'NOT_BUILT'
 
 
+@pytest.mark.django_db()
+def test_job_create_modules( mocker ):
+  si = Site( name='test', description='test' )
+  si.full_clean()
+  si.save()
+
+  fb = FoundationBluePrint( name='fdnb1', description='Foundation BluePrint 1' )
+  fb.foundation_type_list = [ 'Unknown' ]
+  fb.full_clean()
+  fb.save()
+
+  for name, script in ( ( 'create', 'aa = foundation.id' ), ( 'other', 'aa = 1' ), ( 'destroy', 'aa = testing.read_value( module="foundation", name="locator" )' ) ):
+    s = Script( name=name, description=name, script=script )
+    s.full_clean()
+    s.save()
+    BluePrintScript( blueprint=fb, script=s, name=name ).save()
+
+  f = Foundation( locator='test', site=si, blueprint=fb )
+  f.full_clean()
+  f.save()
+
+  assert Script.checkAll() == {}
+  parse_cache.clear()  # as if the Scripts were checked in an other process
+  parse = mocker.patch( 'contractor.Foreman.lib.parse' )
+  job = BaseJob.objects.get( pk=createJob( 'create', f, TestUser() ) )
+  assert parse.call_count == 0
+  mocker.stopall()
+  runner = job.getRunner()
+  assert [ i.TSCRIPT_NAME for i in runner.object_list ] == [ 'foundation', 'config' ]
+  assert runner.module_list == []
+  f.foundationjob.delete()
+
+  f = Foundation.objects.get( pk=f.pk )
+  f.setBuilt()
+  job = BaseJob.objects.get( pk=createJob( 'other', f, TestUser() ) )
+  runner = job.getRunner()
+  assert [ i.TSCRIPT_NAME for i in runner.object_list ] == [ 'foundation', 'config' ]
+  assert runner.module_list == []
+  job.delete()
+
+  mocker.patch( 'contractor.Foreman.lib.RUNNER_MODULE_LIST', [ 'contractor.tscript.runner_plugins_test' ] )
+  f = Foundation.objects.get( pk=f.pk )
+  job = BaseJob.objects.get( pk=createJob( 'destroy', f, TestUser() ) )  # the script never names foundation, the function reads it anyway
+  runner = job.getRunner()
+  assert runner.module_list == [ 'contractor.tscript.runner_plugins_test' ]
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'aa': 'test' }
+
+
 @pytest.mark.django_db()
 def test_structure_job_create():  # TODO: test structures with dependency
   si = Site()
@@ -2,7 +2,7 @@ from cinp.orm_django import DjangoCInP as CInP
 
 from contractor.Site.models import Site
 from contractor.Utilities.models import AddressBlock
-from contractor.Foreman.lib import processJobs, jobResults, jobError
+from contractor.Foreman.lib import processJobs, jobResults, jobResultsBatch, jobError
 from contractor.lib.config import getConfig
 
 cinp = CInP( 'SubContractor', '0.1' )
@@ -14,10 +14,18 @@ class Dispatch():
   def __init__( self ):
     super().__init__()
 
-  @cinp.action( return_type={ 'type': 'Map', 'is_array': True }, paramater_type_list=[ { 'type': 'Model', 'model': Site }, { 'type': 'String', 'is_array': True }, 'Integer' ] )
+  @cinp.action( return_type={ 'type': 'Map', 'is_array': True }, paramater_type_list=[ { 'type': 'Model', 'model': Site }, { 'type': 'String', 'is_array': True }, 'Integer', 'Integer' ] )
   @staticmethod
-  def getJobs( site, module_list, max_jobs=10 ):
-    result = processJobs( site, module_list, max_jobs )
+  def getJobs( site, module_list, max_jobs=10, wait_seconds=0 ):
+    """
+    Returns up to max_jobs tasks for subcontractor to do.  If the last getJobs for this site had nothing to hand
+    out and nothing has changed since, waits up to wait_seconds (at most 60) for something to change first.
+
+    NOTE: The wait happens before any job is locked, so the request's transaction is never split.  Jobs changed by this
+    process wake it up right away, changes made by other processes (ie: other API workers) are only noticed on the
+    next 10 second poll.
+    """
+    result = processJobs( site, module_list, max_jobs, wait_seconds )
     return result
 
   @cinp.action( return_type='String', paramater_type_list=[ 'Integer', 'String', 'Map' ] )
@@ -25,6 +33,11 @@ class Dispatch():
   def jobResults( job_id, cookie, data ):
     return jobResults( job_id, cookie, data )
 
+  @cinp.action( return_type={ 'type': 'String', 'is_array': True }, paramater_type_list=[ { 'type': 'Map', 'is_array': True } ] )
+  @staticmethod
+  def jobResultsBatch( result_list ):
+    return jobResultsBatch( result_list )
+
   @cinp.action( paramater_type_list=[ 'Integer', 'String', 'String' ] )
   @staticmethod
   def jobError( job_id, cookie, msg ):
@@ -1,6 +1,9 @@
+import logging
+import werkzeug
 from django.conf import settings
 
-from cinp.server_werkzeug import WerkzeugServer, NoCINP
+from cinp.server_common import Server, Response, InvalidRequest
+from cinp.server_werkzeug import WerkzeugServer, WerkzeugRequest, WerkzeugResponse, NoCINP
 
 from contractor.Auth.models import getUser
 from contractor.lib.config_handler import handler as config_handler
@@ -18,8 +21,40 @@ for item in os.scandir( plugin_dir ):
   plugin_list.append( 'contractor.plugins.{0}'.format( item.name ) )
 
 
+class ContractorRequest( WerkzeugRequest ):
+  def __init__( self, envrionment, *args, **kwargs ):
+    super().__init__( envrionment, *args, **kwargs )
+    for name in ( 'IF-NONE-MATCH', 'IF-MODIFIED-SINCE' ):  # CInP drops the headers it does not use, the /config/ handler needs these for conditional GETs
+      value = envrionment.get( 'HTTP_{0}'.format( name.replace( '-', '_' ) ), None )
+      if value is not None:
+        self.header_map[ name ] = value
+
+
+class ContractorServer( WerkzeugServer ):
+  def handle( self, envrionment ):  # the same as WerkzeugServer.handle, but with ContractorRequest
+    try:
+      response = Server.handle( self, ContractorRequest( envrionment ) )
+
+      if not isinstance( response, Response ):
+        if self.debug:
+          message = 'Invalid Response from handle, got "{0}" expected WerkzeugResponse'.format( type( response ).__name__ )
+        else:
+          message = 'Invalid Response from handle'
+
+        return werkzeug.wrappers.BaseResponse( response=message, status=500, content_type='text/plain' )
+
+      return WerkzeugResponse( response ).buildNativeResponse()
+
+    except InvalidRequest as e:
+      return WerkzeugResponse( e.asResponse() ).buildNativeResponse()
+
+    except Exception as e:
+      logging.exception( 'Top level Exception, "{0}"({1})'.format( e, type( e ).__name__ ) )
+      return werkzeug.wrappers.BaseResponse( response='Error getting WerkzeugResponse, "{0}"({1})'.format( e, type( e ).__name__ ), status=500, content_type='text/plain' )
+
+
 def get_app( debug ):
-  app = WerkzeugServer( root_path='/api/v1/', root_version='0.9', debug=debug, get_user=getUser, cors_allow_list=[ '*' ], debug_dump_location=settings.DEBUG_DUMP_LOCATION )
+  app = ContractorServer( root_path='/api/v1/', root_version='0.9', debug=debug, get_user=getUser, cors_allow_list=[ '*' ], debug_dump_location=settings.DEBUG_DUMP_LOCATION )
 
   app.registerNamespace( '/', 'contractor.Auth' )
   app.registerNamespace( '/', 'contractor.BluePrint' )
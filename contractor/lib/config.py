@@ -1,14 +1,24 @@
 import copy
 import json
 from datetime import datetime, timezone
-from jinja2 import Environment, Undefined, TemplateSyntaxError
+from jinja2 import Environment, Undefined, TemplateSyntaxError, meta
 
 from django.conf import settings
+from django.db.models import Count, Max
 
 from contractor.fields import config_name_regex
+from contractor.lib.lru import LRUCache
 
 VALUE_SORT_ORDER = '-_0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz<>~'
+CONFIG_CACHE_SIZE = 500
+TEMPLATE_CACHE_SIZE = 2000
 _jinja_environment = None
+_template_cache = LRUCache( TEMPLATE_CACHE_SIZE )  # template source -> compiled jinja template
+_template_name_cache = LRUCache( TEMPLATE_CACHE_SIZE )  # template source -> set of the variable names it uses
+
+# the blueprint and site layers of the config are the same for all the targets with the same blueprint, site and class list
+# ( blueprint pk, site pk, class list ) -> ( blueprint stamp, site stamp, config, last modified ), see _layerConfig
+_layer_cache = LRUCache( CONFIG_CACHE_SIZE )
 
 
 def value_key( item ):
@@ -37,6 +47,34 @@ def _jinjaEnv():
   return _jinja_environment
 
 
+def _template( source ):
+  try:
+    return _template_cache.get( source )
+  except KeyError:
+    pass
+
+  template = _jinjaEnv().from_string( source )
+  _template_cache.set( source, template )
+
+  return template
+
+
+def _templateNames( source ):
+  try:
+    return _template_name_cache.get( source )
+  except KeyError:
+    pass
+
+  name_set = meta.find_undeclared_variables( _jinjaEnv().parse( source ) )
+  _template_name_cache.set( source, name_set )
+
+  return name_set
+
+
+def _isPlain( value ):  # jinja would render this as is, jinja also changes \r\n to \n and drops a trailing \n, so thoes go through jinja too
+  return '{' not in value and '\r' not in value and not value.endswith( '\n' )
+
+
 def _updateConfig( config_value_map, class_list, config ):
   if config_value_map is None:
     return
@@ -140,43 +178,106 @@ def _updateConfig( config_value_map, class_list, config ):
       config[ name ] = value
 
 
-def _siteConfigInternal( site, class_list, config ):
+def _siteConfigInternal( site, class_list, config, stamp ):
   last_modified = site.updated
+  stamp[ site.pk ] = ( site.updated, site.parent_id )
 
   if site.parent is not None:
-    last_modified = max( last_modified, _siteConfigInternal( site.parent, class_list, config ) )
+    last_modified = max( last_modified, _siteConfigInternal( site.parent, class_list, config, stamp ) )
 
   _updateConfig( site.config_values, class_list, config )
 
   return last_modified
 
 
-def _siteConfig( site, class_list, config ):
-  last_modified = _siteConfigInternal( site, class_list, config )
+def _siteConfig( site, class_list, config, stamp ):  # stamp is filled in with site pk -> ( updated, parent ) for each site used, see _siteStamp
+  last_modified = _siteConfigInternal( site, class_list, config, stamp )
 
   config[ '_site' ] = site.pk
 
   return last_modified
 
 
-def _bluePrintConfigInternal( blueprint, class_list, config ):
+def _siteStamp( site_class, pk_list ):  # what the stamp of the sites is now, in one query
+  return dict( [ ( pk, ( updated, parent ) ) for ( pk, updated, parent ) in site_class.objects.filter( pk__in=pk_list ).values_list( 'pk', 'updated', 'parent' ) ] )
+
+
+def _bluePrintConfigInternal( blueprint, class_list, config, stamp ):
   last_modified = blueprint.updated
+  parent_list = list( blueprint.parent_list.all() )
+  stamp[ blueprint.pk ] = ( blueprint.updated, frozenset( [ i.pk for i in parent_list ] ) )
 
-  for parent in blueprint.parent_list.all():
-    last_modified = max( last_modified, _bluePrintConfigInternal( parent, class_list, config ) )
+  for parent in parent_list:
+    last_modified = max( last_modified, _bluePrintConfigInternal( parent, class_list, config, stamp ) )
 
   _updateConfig( blueprint.config_values, class_list, config )
   return last_modified
 
 
-def _bluePrintConfig( blueprint, class_list, config ):
-  last_modified = _bluePrintConfigInternal( blueprint, class_list, config )
+def _bluePrintConfig( blueprint, class_list, config, stamp ):  # stamp is filled in with blueprint pk -> ( updated, parent pks ) for each blueprint used, see _bluePrintStamp
+  last_modified = _bluePrintConfigInternal( blueprint, class_list, config, stamp )
 
   config[ '_blueprint' ] = blueprint.pk
 
   return last_modified
 
 
+def _bluePrintStamp( blueprint_class, pk_list ):  # what the stamp of the blueprints is now, in two queries, parent_list can change without the blueprint being saved
+  field = blueprint_class._meta.get_field( 'parent_list' )
+  parent_map = dict( [ ( pk, set() ) for pk in pk_list ] )
+  for ( pk, parent ) in field.remote_field.through.objects.filter( **{ '{0}__in'.format( field.m2m_field_name() ): pk_list } ).values_list( field.m2m_field_name(), field.m2m_reverse_field_name() ):
+    parent_map[ pk ].add( parent )
+
+  return dict( [ ( pk, ( updated, frozenset( parent_map[ pk ] ) ) ) for ( pk, updated ) in blueprint_class.objects.filter( pk__in=pk_list ).values_list( 'pk', 'updated' ) ] )
+
+
+def _layerKey( blueprint, site, class_list ):
+  return ( blueprint.pk if blueprint is not None else None, site.pk if site is not None else None, tuple( class_list ) )
+
+
+def _layerCached( blueprint, site, class_list ):  # returns the ( config, last_modified ) of the layers from the cache, None if it is not cached or is out of date
+  key = _layerKey( blueprint, site, class_list )
+  try:
+    ( blueprint_stamp, site_stamp, config, last_modified ) = _layer_cache.get( key )
+  except KeyError:
+    return None
+
+  if ( blueprint is None or _bluePrintStamp( blueprint.__class__, list( blueprint_stamp.keys() ) ) == blueprint_stamp ) and ( site is None or _siteStamp( site.__class__, list( site_stamp.keys() ) ) == site_stamp ):
+    return ( config, last_modified )
+
+  return None
+
+
+def _layerConfig( blueprint, site, class_list ):  # the blueprint layers then the site layers, returns ( config, last_modified ), the config is the caller's to change
+  key = _layerKey( blueprint, site, class_list )
+  cached = _layerCached( blueprint, site, class_list )
+  if cached is not None:
+    return ( copy.deepcopy( cached[0] ), cached[1] )
+
+  config = {}
+  last_modified = datetime( 1, 1, 1, tzinfo=timezone.utc )
+  blueprint_stamp = {}
+  site_stamp = {}
+
+  if blueprint is not None:
+    last_modified = max( last_modified, _bluePrintConfig( blueprint, class_list, config, blueprint_stamp ) )
+
+  if site is not None:
+    last_modified = max( last_modified, _siteConfig( site, class_list, config, site_stamp ) )
+
+  _layer_cache.set( key, ( blueprint_stamp, site_stamp, copy.deepcopy( config ), last_modified ) )  # the copies keep the values of the cache and the models from being changed by the caller
+
+  return ( config, last_modified )
+
+
+def _layerStamp( blueprint, site, class_list ):  # the blueprint and site stamps of _layerConfig, hashable, unlike last_modified they change when a parent is added/removed
+  if _layerCached( blueprint, site, class_list ) is None:
+    _layerConfig( blueprint, site, class_list )
+
+  ( blueprint_stamp, site_stamp, _, _ ) = _layer_cache.get( _layerKey( blueprint, site, class_list ) )
+  return ( tuple( sorted( blueprint_stamp.items() ) ), tuple( sorted( site_stamp.items() ) ) )
+
+
 def _foundationConfig( foundation, class_list, config ):
   config.update( foundation.configAttributes() )
   complex = getattr( foundation, 'complex', None )
@@ -194,10 +295,43 @@ def _structureConfig( structure, class_list, config ):
   return structure.updated
 
 
-def getConfig( target ):
-  config = {}
-  last_modified = datetime( 1, 1, 1, tzinfo=timezone.utc )
+def _networkStamp( foundation, structure ):  # the interfaces and addresses are in the config, changing them does not change the updated of the foundation/structure
+  result = ()
+  if foundation is not None:
+    interface = foundation.networkinterface_set.aggregate( count=Count( 'pk' ), updated=Max( 'updated' ), network_updated=Max( 'network__updated' ) )
+    result += ( interface[ 'count' ], interface[ 'updated' ], interface[ 'network_updated' ] )
+
+  if structure is not None:
+    address = structure.address_set.aggregate( count=Count( 'pk' ), updated=Max( 'updated' ), address_block_updated=Max( 'address_block__updated' ) )
+    result += ( address[ 'count' ], address[ 'updated' ], address[ 'address_block_updated' ] )
+
+  return result
 
+
+# NOTE: this is only as good as the updated timestamps, a change to something that goes into
+#       the config that does not save one of the models looked at here will not change the stamp
+def configStamp( target ):  # something hashable that changes when getConfig( target ) would return something else (other than __timestamp), with a few queries instead of building the config, None if it can't be worked out
+  if target.__class__.__name__ == 'Structure':
+    foundation = target.foundation.subclass
+    complex = getattr( foundation, 'complex', None )
+    return ( 'Structure', target.pk, _layerStamp( target.blueprint, target.site, foundation.class_list ), target.updated, foundation.updated, complex.updated if complex is not None else None ) + _networkStamp( foundation, target )
+
+  elif 'Foundation' in [ i.__name__ for i in target.__class__.__mro__ ]:
+    complex = getattr( target, 'complex', None )
+    try:
+      structure_id = target.structure.pk
+    except AttributeError:
+      structure_id = None
+
+    return ( 'Foundation', target.pk, _layerStamp( target.blueprint, target.site, target.class_list ), target.updated, complex.updated if complex is not None else None, structure_id ) + _networkStamp( target, None )
+
+  elif 'BaseAddress' in [ i.__name__ for i in target.__class__.__mro__ ]:
+    return ( 'BaseAddress', target.pk, _layerStamp( None, target.address_block.site, [] ), target.updated )
+
+  return None
+
+
+def getConfig( target ):
   if hasattr( target, 'class_list' ):
     class_list = target.class_list
 
@@ -208,20 +342,18 @@ def getConfig( target ):
     class_list = []
 
   if target.__class__.__name__ == 'Site':
-    last_modified = max( last_modified, _siteConfig( target, class_list, config ) )
+    ( config, last_modified ) = _layerConfig( None, target, class_list )
 
   elif target.__class__.__name__ in ( 'BluePrint', 'StructureBluePrint', 'FoundationBluePrint' ):
-    last_modified = max( last_modified, _bluePrintConfig( target, class_list, config ) )
+    ( config, last_modified ) = _layerConfig( target, None, class_list )
 
   elif target.__class__.__name__ == 'Structure':
-    last_modified = max( last_modified, _bluePrintConfig( target.blueprint, class_list, config ) )
-    last_modified = max( last_modified, _siteConfig( target.site, class_list, config ) )
+    ( config, last_modified ) = _layerConfig( target.blueprint, target.site, class_list )
     last_modified = max( last_modified, _foundationConfig( target.foundation.subclass, class_list, config ) )
     last_modified = max( last_modified, _structureConfig( target, class_list, config ) )
 
   elif 'Foundation' in [ i.__name__ for i in target.__class__.__mro__ ]:
-    last_modified = max( last_modified, _bluePrintConfig( target.blueprint, class_list, config ) )
-    last_modified = max( last_modified, _siteConfig( target.site, class_list, config ) )
+    ( config, last_modified ) = _layerConfig( target.blueprint, target.site, class_list )
     last_modified = max( last_modified, _foundationConfig( target, class_list, config ) )
     try:
       config[ '_structure_id' ] = target.structure.pk
@@ -229,7 +361,7 @@ def getConfig( target ):
       pass
 
   elif 'BaseAddress' in [ i.__name__ for i in target.__class__.__mro__ ]:
-    last_modified = max( last_modified, _siteConfig( target.address_block.site, class_list, config ) )
+    ( config, last_modified ) = _layerConfig( None, target.address_block.site, class_list )
 
   else:
     raise ValueError( 'Don\'t know how to get config for "{0}"'.format( target ) )
@@ -268,31 +400,90 @@ def _merge( target, value_map ):
     return new, dirty
 
   if isinstance( target, str ):
-    new = _jinjaEnv().from_string( target ).render( **value_map )
+    if _isPlain( target ):
+      return target, False
+
+    new = _template( target ).render( **value_map )
     return new, new != target
 
   return target, False
 
 
+def _names( target ):  # the variable names used by the templates in target
+  if isinstance( target, dict ):
+    target = target.values()
+
+  elif isinstance( target, str ):
+    if _isPlain( target ):
+      return set()
+
+    return _templateNames( target )
+
+  elif not isinstance( target, list ):
+    return set()
+
+  result = set()
+  for item in target:
+    result |= _names( item )
+
+  return result
+
+
+def _mergeOrder( value_map ):  # returns ( the names in value_map with the ones they depend on first, name -> the names it depends on )
+  depends_map = dict( [ ( name, sorted( _names( value ) & value_map.keys() ) ) for name, value in value_map.items() ] )
+
+  order = []
+  state_map = {}  # name -> 'visiting' while it's dependencies are being visited, then 'done'
+  for start in value_map:
+    if start in state_map:
+      continue
+
+    path = [ start ]
+    stack = [ iter( depends_map[ start ] ) ]  # iterative, a long chain of values would run out of recursion
+    state_map[ start ] = 'visiting'
+    while stack:
+      try:
+        name = next( stack[ -1 ] )
+      except StopIteration:
+        state_map[ path[ -1 ] ] = 'done'
+        order.append( path.pop() )
+        stack.pop()
+        continue
+
+      if name not in state_map:
+        state_map[ name ] = 'visiting'
+        path.append( name )
+        stack.append( iter( depends_map[ name ] ) )
+
+      elif state_map[ name ] == 'visiting':
+        cycle = path[ path.index( name ): ] + [ name ]
+        raise ValueError( 'config values depend on each other: {0}'.format( ' -> '.join( [ '"{0}"'.format( i ) for i in cycle ] ) ) )
+
+  return ( order, depends_map )
+
+
 def mergeValues( value_map ):
-  result = copy.deepcopy( value_map )
+  ( order, depends_map ) = _mergeOrder( value_map )
+
+  merged_map = {}
+  for name in order:  # the values each value uses are allready merged, so one render each, and only with what it uses
+    merged_map[ name ], _ = _merge( value_map[ name ], dict( [ ( i, merged_map[ i ] ) for i in depends_map[ name ] ] ) )
+
+  result = dict( [ ( name, merged_map[ name ] ) for name in value_map ] )
 
   dirty = True
-  while dirty:  # going to try and do this breath first, however we don't have a predictable order, not going to promise much
+  while dirty:  # only something that renders into a new template (ie: '{{ "{{" }}a}}') is dirty here, otherwise this is one pass over the values that are not plain
     result, dirty = _merge( result, result )
 
   return result
 
 
 def renderTemplate( template, value_map ):
-  env = _jinjaEnv()
-
   value_map = mergeValues( value_map )  # merge first, this way results are more consistant with requests that are getting just the values
 
   try:
     while template.count( '{{' ):
-      tpl = env.from_string( template )
-      template = tpl.render( **value_map )
+      template = _template( template ).render( **value_map )
 
   except TemplateSyntaxError as e:
     raise Exception( 'Error parsing template: "{0}" on line: "{1}"'.format( e.message, e.lineno ) )
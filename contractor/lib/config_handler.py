@@ -1,13 +1,56 @@
 import re
+import json
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from cinp.server_common import Response, _fromPythonMap
 
 from contractor.Building.models import Foundation, Structure
 from contractor.Utilities.models import BaseAddress, DynamicAddress
-from contractor.lib.config import getConfig, mergeValues, renderTemplate
+from contractor.lib.config import getConfig, configStamp, mergeValues, renderTemplate
+from contractor.lib.lru import LRUCache
+
+RENDER_CACHE_SIZE = 2000
+# ( request type, config stamp, pxe, pxe updated ) -> ( etag, last modified, rendered boot_script/pxe_template ), see configStamp
+# a rack booting asks for the same boot_script/pxe_template more than once, without this each one is a full getConfig and render
+_render_cache = LRUCache( RENDER_CACHE_SIZE )
 
 url_regex = re.compile( '^/config/([a-z_]+)/((c/[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[0-9a-f]{4}-[0-9a-f]{12})|(s/[0-9]+)|(f/[a-zA-Z0-9][a-zA-Z0-9_\-]*)|(a/(([0-9]{1,3}.[0-9]{1,3}.[0-9]{1,3}.[0-9]{1,3})|([0-9a-fA-F]{0,4}:){1,7}[0-9a-fA-F]{0,4})))?$' )
 
 
+def _notModified( header_map, etag, last_modified ):
+  if_none_match = header_map.get( 'IF-NONE-MATCH', None )
+  if if_none_match is not None:  # If-Modified-Since is ignored when there is a If-None-Match, see RFC 7232 section 6
+    tag_list = [ i.strip() for i in if_none_match.split( ',' ) ]
+    return '*' in tag_list or etag in [ i[ 2: ] if i.startswith( 'W/' ) else i for i in tag_list ]
+
+  try:
+    since = parsedate_to_datetime( header_map[ 'IF-MODIFIED-SINCE' ] )
+  except ( KeyError, TypeError, ValueError, IndexError ):
+    return False
+
+  if since.tzinfo is None:
+    since = since.replace( tzinfo=timezone.utc )
+
+  return last_modified.replace( microsecond=0 ) <= since
+
+
+def _etag( config, template ):  # what is sent is worked out from only the config and the template, so thoes are hashed instead of merging/rendering first
+  value_map = dict( config )
+  del value_map[ '__timestamp' ]  # the only thing that is different every time
+
+  return '"{0}"'.format( hashlib.sha256( json.dumps( [ template, value_map ], sort_keys=True, default=str ).encode( 'utf-8' ) ).hexdigest()[ :32 ] )
+
+
+def _conditionalResponse( request, etag, last_modified, render, content_type ):  # render is only called if the client does not allready have the current version
+  header_map = { 'ETag': etag, 'Last-Modified': format_datetime( last_modified.astimezone( timezone.utc ), usegmt=True ), 'Cache-Control': 'no-cache' }
+
+  if _notModified( request.header_map, etag, last_modified ):
+    return Response( 304, data='', header_map=header_map, content_type='text' )
+
+  return Response( 200, data=render(), header_map=header_map, content_type=content_type )
+
+
 def handler( request ):
   match = url_regex.match( request.uri.lower() )
   if not match:
@@ -53,9 +96,6 @@ def handler( request ):
   if target is None:
     return Response( 500, data='Target is missing', content_type='text' )
 
-  data = None
-  config = getConfig( target )
-
   if request_type in ( 'boot_script', 'pxe_template' ):
     pxe = None
     if isinstance( target, Structure ):
@@ -65,20 +105,43 @@ def handler( request ):
     elif isinstance( target, DynamicAddress ):
       pxe = target.pxe
 
+    render_key = None
+    stamp = configStamp( target )
+    if stamp is not None:
+      render_key = ( request_type, stamp, pxe.pk if pxe is not None else None, pxe.updated if pxe is not None else None )
+      try:
+        ( etag, last_modified, data ) = _render_cache.get( render_key )
+        return _conditionalResponse( request, etag, last_modified, lambda: data, 'text' )
+      except KeyError:
+        pass
+
+    config = getConfig( target )
+    last_modified = config[ '__last_modified' ]
+
     if pxe is None:
-      return Response( 200, data='', content_type='text' )
+      template = ''
+      data = ''
+
+    else:
+      if request_type == 'boot_script':
+        template = '#!ipxe\n\n' + pxe.boot_script
+
+      elif request_type == 'pxe_template':
+        template = pxe.template
 
-    if request_type == 'boot_script':
-      template = '#!ipxe\n\n' + pxe.boot_script
+      last_modified = max( last_modified, pxe.updated )
+      data = renderTemplate( template, config )
 
-    elif request_type == 'pxe_template':
-      template = pxe.template
+    etag = _etag( config, template )
+    if render_key is not None:
+      _render_cache.set( render_key, ( etag, last_modified, data ) )
 
-    data = renderTemplate( template, config )
-    return Response( 200, data=data, content_type='text' )
+    return _conditionalResponse( request, etag, last_modified, lambda: data, 'text' )
 
   elif request_type == 'config':
+    config = getConfig( target )
+    last_modified = config[ '__last_modified' ]
     _fromPythonMap( config )  # this does not go out CInP's converter, we need to make the python dict JSON encodable our selves
-    return Response( 200, data=mergeValues( config ) )
+    return _conditionalResponse( request, _etag( config, None ), last_modified, lambda: mergeValues( config ), 'json' )
 
   return Response( 400, data='Invalid request type', content_type='text' )
@@ -4,7 +4,7 @@ from contractor.Site.models import Site
 from contractor.Utilities.models import AddressBlock, Address, RealNetworkInterface, Network
 from contractor.BluePrint.models import FoundationBluePrint, StructureBluePrint, PXE
 from contractor.Building.models import Foundation, Structure
-from contractor.lib.config_handler import url_regex, handler
+from contractor.lib.config_handler import url_regex, handler, _render_cache
 
 
 def test_url_regex():
@@ -78,9 +78,10 @@ def test_url_regex():
 
 
 class Request:
-  def __init__( self, uri, remote_addr ):
+  def __init__( self, uri, remote_addr, header_map=None ):
     self.uri = uri
     self.remote_addr = remote_addr
+    self.header_map = header_map or {}
 
 
 def _test_dict( target, reference ):
@@ -221,3 +222,191 @@ def test_handler():
   resp = handler( Request( '/config/boot_script/', '10.0.0.5' ) )
   assert resp.http_code == 200
   assert resp.data == '#!ipxe\n\nboot'
+
+
+@pytest.mark.django_db
+def test_conditional():
+  s = Site( name='test', description='test site' )
+  s.full_clean()
+  s.save()
+
+  n = Network( name='test', site=s )
+  n.full_clean()
+  n.save()
+
+  fbp = FoundationBluePrint( name='fdn_test', description='foundation test bp' )
+  fbp.foundation_type_list = 'Unknown'
+  fbp.full_clean()
+  fbp.save()
+
+  sbp = StructureBluePrint( name='str_test', description='structure test bp' )
+  sbp.full_clean()
+  sbp.save()
+  sbp.foundation_blueprint_list.add( fbp )
+
+  pxe = PXE( name='testpxe', boot_script='boot {{_hostname}}', template='this is for {{_hostname}}' )
+  pxe.full_clean()
+  pxe.save()
+
+  fdn = Foundation( locator='ftester', blueprint=fbp, site=s )
+  fdn.full_clean()
+  fdn.save()
+
+  iface = RealNetworkInterface( name='eth0', is_provisioning=True, pxe=pxe )
+  iface.foundation = fdn
+  iface.physical_location = 'eth0'
+  iface.network = n
+  iface.full_clean()
+  iface.save()
+
+  str = Structure( hostname='stester', foundation=fdn, blueprint=sbp, site=s )
+  str.full_clean()
+  str.save()
+
+  uri = '/config/config/s/{0}'.format( str.pk )
+  resp = handler( Request( uri, None ) )
+  assert resp.http_code == 200
+  etag = resp.header_map[ 'ETag' ]
+  last_modified = resp.header_map[ 'Last-Modified' ]
+  assert etag.startswith( '"' ) and etag.endswith( '"' )
+  assert last_modified.endswith( ' GMT' )
+
+  resp = handler( Request( uri, None, { 'IF-NONE-MATCH': etag } ) )
+  assert resp.http_code == 304
+  assert resp.data == ''
+  assert resp.header_map[ 'ETag' ] == etag
+  assert resp.header_map[ 'Last-Modified' ] == last_modified
+
+  assert handler( Request( uri, None, { 'IF-NONE-MATCH': '"other", W/{0}'.format( etag ) } ) ).http_code == 304
+  assert handler( Request( uri, None, { 'IF-NONE-MATCH': '*' } ) ).http_code == 304
+  assert handler( Request( uri, None, { 'IF-NONE-MATCH': '"other"' } ) ).http_code == 200
+  assert handler( Request( uri, None, { 'IF-NONE-MATCH': '"other"', 'IF-MODIFIED-SINCE': last_modified } ) ).http_code == 200  # If-None-Match wins
+
+  assert handler( Request( uri, None, { 'IF-MODIFIED-SINCE': last_modified } ) ).http_code == 304
+  assert handler( Request( uri, None, { 'IF-MODIFIED-SINCE': 'Sat, 01 Jan 2000 00:00:00 GMT' } ) ).http_code == 200
+  assert handler( Request( uri, None, { 'IF-MODIFIED-SINCE': 'garbage' } ) ).http_code == 200
+
+  boot_resp = handler( Request( '/config/boot_script/s/{0}'.format( str.pk ), None ) )
+  assert boot_resp.http_code == 200
+  assert boot_resp.data == '#!ipxe\n\nboot stester'
+  assert boot_resp.header_map[ 'ETag' ] != etag
+  assert handler( Request( '/config/boot_script/s/{0}'.format( str.pk ), None, { 'IF-NONE-MATCH': boot_resp.header_map[ 'ETag' ] } ) ).http_code == 304
+  assert handler( Request( '/config/pxe_template/s/{0}'.format( str.pk ), None, { 'IF-NONE-MATCH': boot_resp.header_map[ 'ETag' ] } ) ).http_code == 200
+
+  str.config_values = { 'stuff': 'new' }
+  str.full_clean()
+  str.save()
+
+  resp = handler( Request( uri, None, { 'IF-NONE-MATCH': etag } ) )
+  assert resp.http_code == 200
+  assert resp.data[ 'stuff' ] == 'new'
+  assert resp.header_map[ 'ETag' ] != etag
+  assert handler( Request( uri, None, { 'IF-NONE-MATCH': resp.header_map[ 'ETag' ] } ) ).http_code == 304
+
+  pxe.boot_script = 'boot again'
+  pxe.full_clean()
+  pxe.save()
+  assert handler( Request( '/config/boot_script/s/{0}'.format( str.pk ), None, { 'IF-NONE-MATCH': boot_resp.header_map[ 'ETag' ] } ) ).http_code == 200
+
+
+@pytest.mark.django_db
+def test_render_cache():
+  s = Site( name='test', description='test site' )
+  s.full_clean()
+  s.save()
+
+  n = Network( name='test', site=s )
+  n.full_clean()
+  n.save()
+
+  fbp = FoundationBluePrint( name='fdn_test', description='foundation test bp' )
+  fbp.foundation_type_list = 'Unknown'
+  fbp.full_clean()
+  fbp.save()
+
+  parent_list = []
+  for color in ( 'blue', 'green' ):
+    pbp = StructureBluePrint( name='str_{0}'.format( color ), description='structure parent bp' )
+    pbp.config_values = { 'color': color }
+    pbp.full_clean()
+    pbp.save()
+    parent_list.append( pbp )
+
+  sbp = StructureBluePrint( name='str_test', description='structure test bp' )
+  sbp.full_clean()
+  sbp.save()
+  sbp.foundation_blueprint_list.add( fbp )
+  sbp.parent_list.add( parent_list[0] )
+
+  pxe = PXE( name='testpxe', boot_script='boot {{_hostname}}', template='this is for {{_hostname}} {{_provisioning_interface_mac}}' )
+  pxe.full_clean()
+  pxe.save()
+
+  iface_list = []
+  structure_list = []
+  for i in range( 0, 2 ):
+    fdn = Foundation( locator='ftester{0}'.format( i ), blueprint=fbp, site=s )
+    fdn.full_clean()
+    fdn.save()
+
+    iface = RealNetworkInterface( name='eth0', is_provisioning=True, pxe=pxe )
+    iface.foundation = fdn
+    iface.physical_location = 'eth0'
+    iface.network = n
+    iface.full_clean()
+    iface.save()
+    iface_list.append( iface )
+
+    str = Structure( hostname='stester{0}'.format( i ), foundation=fdn, blueprint=sbp, site=s )
+    str.full_clean()
+    str.save()
+    structure_list.append( str )
+
+  _render_cache.clear()
+  stats = _render_cache.stats
+
+  uri_0 = '/config/boot_script/s/{0}'.format( structure_list[0].pk )
+  uri_1 = '/config/boot_script/s/{0}'.format( structure_list[1].pk )
+  assert handler( Request( uri_0, None ) ).data == '#!ipxe\n\nboot stester0'
+  assert handler( Request( uri_0, None ) ).data == '#!ipxe\n\nboot stester0'
+  assert handler( Request( uri_1, None ) ).data == '#!ipxe\n\nboot stester1'
+  assert handler( Request( '/config/pxe_template/s/{0}'.format( structure_list[0].pk ), None ) ).data == 'this is for stester0 None'
+  assert _render_cache.stats[ 'hits' ] - stats[ 'hits' ] == 1
+  assert _render_cache.stats[ 'misses' ] - stats[ 'misses' ] == 3
+
+  resp = handler( Request( uri_0, None ) )
+  assert resp.http_code == 200
+  resp = handler( Request( uri_0, None, { 'IF-NONE-MATCH': resp.header_map[ 'ETag' ] } ) )
+  assert resp.http_code == 304
+  assert resp.data == ''
+  assert _render_cache.stats[ 'hits' ] - stats[ 'hits' ] == 3
+
+  iface = iface_list[0]  # does not save the structure or foundation
+  iface.mac = '00:11:22:33:44:55'
+  iface.full_clean()
+  iface.save()
+  assert handler( Request( '/config/pxe_template/s/{0}'.format( structure_list[0].pk ), None ) ).data == 'this is for stester0 00:11:22:33:44:55'
+
+  str = structure_list[0]
+  str.hostname = 'changed'
+  str.full_clean()
+  str.save()
+  assert handler( Request( uri_0, None ) ).data == '#!ipxe\n\nboot changed'
+
+  str.config_values = { 'extra': 'more' }
+  str.full_clean()
+  str.save()
+  pxe.boot_script = 'boot {{_hostname}} {{extra}}'
+  pxe.full_clean()
+  pxe.save()
+  assert handler( Request( uri_0, None ) ).data == '#!ipxe\n\nboot changed more'
+  assert handler( Request( uri_1, None ) ).data == '#!ipxe\n\nboot stester1 '
+
+  pxe.boot_script = 'boot {{_hostname}} {{color}}'
+  pxe.full_clean()
+  pxe.save()
+  assert handler( Request( uri_1, None ) ).data == '#!ipxe\n\nboot stester1 blue'
+
+  sbp.parent_list.remove( parent_list[0] )  # does not change the updated of any blueprint
+  sbp.parent_list.add( parent_list[1] )
+  assert handler( Request( uri_1, None ) ).data == '#!ipxe\n\nboot stester1 green'
@@ -5,7 +5,7 @@ from django.core.exceptions import ValidationError
 from contractor.Site.models import Site
 from contractor.BluePrint.models import StructureBluePrint, FoundationBluePrint
 from contractor.Building.models import Foundation, Structure
-from contractor.lib.config import _updateConfig, mergeValues, getConfig, renderTemplate
+from contractor.lib.config import _updateConfig, _layer_cache, _template_cache, mergeValues, getConfig, renderTemplate
 
 
 def _strip_base( value ):
@@ -268,6 +268,23 @@ def test_mergeValues():
   assert { 'a': 'c', 'b': 'a', 'd': 'c' } == mergeValues( values )
   assert { 'a': 'c', 'b': 'a', 'd': '{{ "{{" }}{{b}}}}' } == values
 
+  # order should not matter
+  values = { 'e': '{{d}}.e', 'd': '{{c}}.d', 'c': '{{b}}.c', 'b': '{{a}}.b', 'a': 'a' }
+  assert { 'e': 'a.b.c.d.e', 'd': 'a.b.c.d', 'c': 'a.b.c', 'b': 'a.b', 'a': 'a' } == mergeValues( values )
+
+  values = dict( [ ( 'v{0}'.format( i ), '{{{{v{0}}}}}'.format( i + 1 ) ) for i in range( 0, 500 ) ] )
+  values[ 'v500' ] = 'end'
+  assert set( mergeValues( values ).values() ) == set( [ 'end' ] )
+
+  values = { 'a': '{% for i in b %}{{i}}{{c}}{% endfor %}', 'b': [ '{{c}}', 'x' ], 'c': '-' }
+  assert { 'a': '--x-', 'b': [ '-', 'x' ], 'c': '-' } == mergeValues( values )
+
+  with pytest.raises( ValueError ):
+    mergeValues( { 'a': '{{b}}', 'b': '{{c}}', 'c': 'stuff {{a}}' } )
+
+  with pytest.raises( ValueError ):
+    mergeValues( { 'a': [ 'x', { 'y': '{{a}}' } ] } )
+
 
 def test_render():
   assert renderTemplate( 'This is a test', {} ) == 'This is a test'
@@ -282,6 +299,23 @@ def test_render():
   assert renderTemplate( 'This {{i|tojson}}', { 'i': [ 1, "sdf", [ 2, 3 ], { 'a': 'sdf' }, None, datetime.min ] } ) == 'This [1, "sdf", [2, 3], {"a": "sdf"}, null, "0001-01-01T00:00:00"]'
 
 
+def test_template_cache():
+  _template_cache.clear()
+
+  values = { 'a': 'plain', 'b': '{{a}} {{c}}', 'c': 'x', 'd': [ '{{a}}', 'also plain' ], 'e': 'windows\r\nline', 'f': 'trailing\n' }
+  assert mergeValues( values ) == { 'a': 'plain', 'b': 'plain x', 'c': 'x', 'd': [ 'plain', 'also plain' ], 'e': 'windows\nline', 'f': 'trailing' }
+  assert _template_cache.stats[ 'count' ] == 4  # the two with {{, and the two jinja changes
+  assert 'plain' not in _template_cache
+  assert '{{a}} {{c}}' in _template_cache
+
+  misses = _template_cache.stats[ 'misses' ]
+  assert mergeValues( values ) == { 'a': 'plain', 'b': 'plain x', 'c': 'x', 'd': [ 'plain', 'also plain' ], 'e': 'windows\nline', 'f': 'trailing' }
+  assert _template_cache.stats[ 'misses' ] == misses
+
+  assert renderTemplate( 'This {{b}}', values ) == 'This plain x'
+  assert 'This {{b}}' in _template_cache
+
+
 @pytest.mark.django_db
 def test_valid_names():
   s1 = Site( name='site1', description='test site 1' )
@@ -522,6 +556,77 @@ def test_blueprint():
                                             }
 
 
+@pytest.mark.django_db
+def test_layer_cache():
+  s1 = Site( name='site1', description='test site 1' )
+  s1.config_values = { 'aa': 'site1' }
+  s1.full_clean()
+  s1.save()
+
+  s2 = Site( name='site2', description='test site 2', parent=s1 )
+  s2.config_values = { '>aa': ' site2' }
+  s2.full_clean()
+  s2.save()
+
+  fb1 = FoundationBluePrint( name='fdnb1', description='Foundation BluePrint 1' )
+  fb1.foundation_type_list = [ 'Unknown' ]
+  fb1.config_values = { 'bb': 'fdnb1' }
+  fb1.full_clean()
+  fb1.save()
+
+  fb2 = FoundationBluePrint( name='fdnb2', description='Foundation BluePrint 2' )
+  fb2.foundation_type_list = [ 'Unknown' ]
+  fb2.config_values = { 'cc': 'fdnb2' }
+  fb2.full_clean()
+  fb2.save()
+
+  f1 = Foundation( site=s2, locator='fdn1', blueprint=fb1 )
+  f1.full_clean()
+  f1.save()
+
+  f2 = Foundation( site=s2, locator='fdn2', blueprint=fb1 )
+  f2.full_clean()
+  f2.save()
+
+  _layer_cache.clear()  # saving the models may of got config for them
+  config = getConfig( f1 )
+  assert config[ 'aa' ] == 'site1 site2'
+  assert config[ 'bb' ] == 'fdnb1'
+  assert config[ '_foundation_locator' ] == 'fdn1'
+  assert _layer_cache.stats[ 'count' ] == 1
+
+  config[ 'aa' ] = 'changed'  # the caller's copy
+  config = getConfig( f2 )
+  assert config[ 'aa' ] == 'site1 site2'
+  assert config[ '_foundation_locator' ] == 'fdn2'
+  assert _layer_cache.stats[ 'hits' ] == 1
+  assert s1.config_values == { 'aa': 'site1' }
+
+  s1.config_values = { 'aa': 'new site1' }
+  s1.full_clean()
+  s1.save()
+  assert getConfig( f1 )[ 'aa' ] == 'new site1 site2'
+
+  fb1.parent_list.add( fb2 )  # the blueprint is not saved
+  assert getConfig( f1 )[ 'cc' ] == 'fdnb2'
+  assert getConfig( f2 )[ 'cc' ] == 'fdnb2'
+
+  fb2.config_values = { 'cc': 'new fdnb2' }
+  fb2.full_clean()
+  fb2.save()
+  assert getConfig( f1 )[ 'cc' ] == 'new fdnb2'
+
+  s2.parent = None
+  s2.full_clean()
+  s2.save()
+  assert getConfig( f1 )[ 'aa' ] == ' site2'
+
+  getConfig( s2 )
+  hits = _layer_cache.stats[ 'hits' ]
+  assert getConfig( s2 )[ 'aa' ] == ' site2'
+  assert _layer_cache.stats[ 'hits' ] == hits + 1
+
+
 @pytest.mark.django_db
 def test_foundation():
   s1 = Site( name='site1', description='test site 1' )
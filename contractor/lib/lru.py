@@ -0,0 +1,55 @@
+import threading
+from collections import OrderedDict
+
+
+# simple bounded, thread safe Least Recently Used cache, get raises KeyError on a miss
+class LRUCache():
+  def __init__( self, size ):
+    super().__init__()
+    self.size = size
+    self.hits = 0
+    self.misses = 0
+    self._map = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get( self, key ):
+    with self._lock:
+      try:
+        value = self._map[ key ]
+      except KeyError:
+        self.misses += 1
+        raise
+
+      self._map.move_to_end( key )
+      self.hits += 1
+      return value
+
+  def set( self, key, value ):
+    with self._lock:
+      self._map[ key ] = value
+      self._map.move_to_end( key )
+      while len( self._map ) > self.size:
+        self._map.popitem( last=False )
+
+  def discard( self, key ):
+    with self._lock:
+      try:
+        del self._map[ key ]
+      except KeyError:
+        pass
+
+  def clear( self ):
+    with self._lock:
+      self._map.clear()
+      self.hits = 0
+      self.misses = 0
+
+  @property
+  def stats( self ):
+    return { 'hits': self.hits, 'misses': self.misses, 'count': len( self._map ), 'size': self.size }
+
+  def __contains__( self, key ):
+    return key in self._map
+
+  def __len__( self ):
+    return len( self._map )
@@ -0,0 +1,29 @@
+import pytest
+
+from contractor.lib.lru import LRUCache
+
+
+def test_lru():
+  cache = LRUCache( 2 )
+  assert len( cache ) == 0
+  with pytest.raises( KeyError ):
+    cache.get( 'a' )
+
+  cache.set( 'a', 1 )
+  cache.set( 'b', 2 )
+  assert cache.get( 'a' ) == 1
+  cache.set( 'c', 3 )  # b is the least recently used
+  assert 'a' in cache
+  assert 'b' not in cache
+  assert 'c' in cache
+  assert cache.stats == { 'hits': 1, 'misses': 1, 'count': 2, 'size': 2 }
+
+  cache.set( 'a', 4 )
+  assert cache.get( 'a' ) == 4
+  cache.discard( 'a' )
+  cache.discard( 'a' )
+  assert 'a' not in cache
+
+  cache.clear()
+  assert len( cache ) == 0
+  assert cache.stats == { 'hits': 0, 'misses': 0, 'count': 0, 'size': 2 }
@@ -0,0 +1,88 @@
+from contractor.tscript.parser import Types
+from contractor.tscript.runner import builtin_function_map
+
+# What a script uses from outside of itself, worked out from the AST without running it. This is
+# used to only register the modules/objects a script referrs to, and to find functions that are not
+# defined before the script is run.
+
+
+def _walk( operation, line_no, result ):  # appends ( 'function' or 'value', module, name, line no ) to result for each function call and module value
+  op_type = operation[0]
+  op_data = operation[1]
+
+  if op_type == Types.LINE:
+    line_no = operation[2]
+    child_list = [ op_data ]
+
+  elif op_type in ( Types.SCOPE, Types.PARALLEL ):
+    child_list = op_data[ '_children' ]
+
+  elif op_type == Types.WHILE:
+    child_list = [ op_data[ 'condition' ], op_data[ 'expression' ] ]
+
+  elif op_type == Types.IFELSE:
+    child_list = []
+    for branch in op_data:
+      if branch[ 'condition' ] is not None:
+        child_list.append( branch[ 'condition' ] )
+      child_list.append( branch[ 'expression' ] )
+
+  elif op_type == Types.ASSIGNMENT:  # the target is a VARIABLE or ARRAY_MAP_ITEM, so setting module values is picked up the same as getting them
+    child_list = [ op_data[ 'target' ], op_data[ 'value' ] ]
+
+  elif op_type == Types.FUNCTION:
+    result.append( ( 'function', op_data[ 'module' ], op_data[ 'name' ], line_no ) )
+    child_list = op_data[ 'paramaters' ].values()
+
+  elif op_type in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ):
+    if op_data[ 'module' ] is not None:
+      result.append( ( 'value', op_data[ 'module' ], op_data[ 'name' ], line_no ) )
+
+    child_list = [ op_data[ 'index' ] ] if op_type == Types.ARRAY_MAP_ITEM else []
+
+  elif op_type == Types.INFIX:
+    child_list = [ op_data[ 'left' ], op_data[ 'right' ] ]
+
+  elif op_type == Types.ARRAY:
+    child_list = op_data
+
+  elif op_type == Types.MAP:
+    child_list = op_data.values()
+
+  elif op_type == Types.EXISTS:
+    child_list = [ op_data ]
+
+  else:  # CONSTANT, JUMP_POINT, GOTO, OTHER
+    child_list = []
+
+  for child in child_list:
+    _walk( child, line_no, result )
+
+
+def _referenceList( ast ):
+  result = []
+  _walk( ast, None, result )
+  return result
+
+
+def references( ast ):  # returns ( function map, value map ), each is module name -> set of names the script uses, builtin functions are under the module None
+  function_map = {}
+  value_map = {}
+  for ( kind, module, name, line_no ) in _referenceList( ast ):
+    if kind == 'function':
+      function_map.setdefault( module, set() ).add( name )
+    else:
+      value_map.setdefault( module, set() ).add( name )
+
+  return ( function_map, value_map )
+
+
+# NOTE: ExternalFunction.getScriptValue can read modules/objects the script does not name, createJob
+#       only uses this for the function modules, the foundation/structure/config objects are allways registered
+def moduleNames( ast ):  # the names of the modules/objects the script needs registered
+  ( function_map, value_map ) = references( ast )
+  return ( set( function_map ) | set( value_map ) ) - set( [ None ] )
+
+
+def undefinedFunctions( ast ):  # list of ( name, line no ) of the builtin functions that do not exist, the module functions depend on what the job registers, so they are not checked
+  return [ ( name, line_no ) for ( kind, module, name, line_no ) in _referenceList( ast ) if kind == 'function' and module is None and name not in builtin_function_map ]
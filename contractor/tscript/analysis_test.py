@@ -0,0 +1,17 @@
+from contractor.tscript.parser import parse
+from contractor.tscript.analysis import references, moduleNames, undefinedFunctions
+
+
+def test_references():
+  ast = parse( 'aa = foundation.id\nif exists( config.stuff[ ( other.idx + 1 ) ] ) then foundation.power_on()\nstructure.value = len( array=[ dhcp.lease ] )\nparallel()\n  bb = foundation.wait()\nend' )
+  assert references( ast ) == ( { 'foundation': set( [ 'power_on', 'wait' ] ), None: set( [ 'len' ] ) }, { 'foundation': set( [ 'id' ] ), 'config': set( [ 'stuff' ] ), 'other': set( [ 'idx' ] ), 'structure': set( [ 'value' ] ), 'dhcp': set( [ 'lease' ] ) } )
+  assert moduleNames( ast ) == set( [ 'foundation', 'config', 'other', 'structure', 'dhcp' ] )
+
+  ast = parse( 'aa = 1\nwhile ( aa < 10 ) do aa = ( aa + 1 )\npause( msg="hi" )' )
+  assert references( ast ) == ( { None: set( [ 'pause' ] ) }, {} )
+  assert moduleNames( ast ) == set()
+
+
+def test_undefined():
+  assert undefinedFunctions( parse( 'len( array=[] )\nfoundation.stuff()' ) ) == []
+  assert undefinedFunctions( parse( 'aa = 1\nbegin()\n  aa = lenn( array=[] )\n  if ( aa > 1 ) then stuff()\nend' ) ) == [ ( 'lenn', 3 ), ( 'stuff', 4 ) ]
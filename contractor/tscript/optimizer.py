@@ -0,0 +1,130 @@
+from contractor.tscript.parser import Types
+from contractor.tscript.runner import _infixValue
+
+# Rewrites the AST so there is less to do at run time: infixs of constants are folded into a
+# constant, if/elif branches that can never run are removed, and lines that do nothing are
+# dropped. The LINE nodes that are left keep their line numbers, so status and errors still
+# point at the right place in the script.
+#
+# NOTE: the runner state is only good for the AST it was started with, the optimized AST is
+# cached and stored under it's own hash, see contractor.tscript.parser.scriptHash
+
+MAX_FOLD_EXPONENT = 64  # bigger powers are left for run time, so a script can't make the parser spin
+
+
+def optimize( ast ):  # returns a new AST, the one passed in is not changed
+  return _optimize( ast )
+
+
+def _isNoop( operation ):  # statements that can't change anything or raise an error
+  op_type = operation[0]
+  op_data = operation[1]
+
+  if op_type == Types.CONSTANT:
+    return True
+
+  if op_type == Types.IFELSE:
+    return op_data == []
+
+  if op_type == Types.WHILE:
+    return op_data[ 'condition' ][0] == Types.CONSTANT and not op_data[ 'condition' ][1]
+
+  return False
+
+
+def _fold( op_data, left, right ):  # returns the constant for the infix, None if it has to be left for run time
+  if left[0] != Types.CONSTANT or right[0] != Types.CONSTANT:
+    return None
+
+  if op_data[ 'operator' ] == '^' and isinstance( right[1], ( int, float ) ) and abs( right[1] ) > MAX_FOLD_EXPONENT:
+    return None
+
+  try:
+    value = _infixValue( op_data[ 'operator' ], left[1], right[1] )
+  except Exception:  # what ever it is, it happens at run time with the line number
+    return None
+
+  return ( Types.CONSTANT, value )
+
+
+def _ifelse( op_data ):
+  result = []
+  for branch in op_data:
+    condition = branch[ 'condition' ]
+    if condition is not None:
+      condition = _optimize( condition )
+      if condition[0] == Types.CONSTANT:
+        if not condition[1]:  # never going to run
+          continue
+
+        condition = None  # allways going to run, the rest are never going to be looked at
+
+    result.append( { 'condition': condition, 'expression': _optimize( branch[ 'expression' ] ) } )
+    if condition is None:
+      break
+
+  if len( result ) == 1 and result[0][ 'condition' ] is None:
+    return result[0][ 'expression' ]
+
+  return ( Types.IFELSE, result )
+
+
+def _optimize( operation ):
+  op_type = operation[0]
+  op_data = operation[1]
+
+  if op_type == Types.LINE:
+    return ( Types.LINE, _optimize( op_data ), operation[2] )
+
+  elif op_type in ( Types.SCOPE, Types.PARALLEL ):
+    result = dict( op_data )
+    result[ '_children' ] = []
+    for child in op_data[ '_children' ]:
+      child = _optimize( child )
+      if not _isNoop( child[1] ):
+        result[ '_children' ].append( child )
+
+    return ( op_type, result )
+
+  elif op_type == Types.INFIX:
+    left = _optimize( op_data[ 'left' ] )
+    right = _optimize( op_data[ 'right' ] )
+    return _fold( op_data, left, right ) or ( Types.INFIX, { 'operator': op_data[ 'operator' ], 'left': left, 'right': right } )
+
+  elif op_type == Types.IFELSE:
+    return _ifelse( op_data )
+
+  elif op_type == Types.WHILE:
+    return ( Types.WHILE, { 'condition': _optimize( op_data[ 'condition' ] ), 'expression': _optimize( op_data[ 'expression' ] ) } )
+
+  elif op_type == Types.ASSIGNMENT:
+    target = op_data[ 'target' ]
+    if target[0] == Types.ARRAY_MAP_ITEM:
+      target = _optimize( target )
+
+    return ( Types.ASSIGNMENT, { 'target': target, 'value': _optimize( op_data[ 'value' ] ) } )
+
+  elif op_type == Types.FUNCTION:
+    result = dict( op_data )
+    result[ 'paramaters' ] = dict( [ ( key, _optimize( value ) ) for key, value in op_data[ 'paramaters' ].items() ] )
+    return ( Types.FUNCTION, result )
+
+  elif op_type == Types.ARRAY_MAP_ITEM:
+    result = dict( op_data )
+    result[ 'index' ] = _optimize( op_data[ 'index' ] )
+    return ( Types.ARRAY_MAP_ITEM, result )
+
+  elif op_type == Types.ARRAY:  # not folded into a constant, the runner shares constants, and arrays/maps can be changed in place
+    return ( Types.ARRAY, [ _optimize( item ) for item in op_data ] )
+
+  elif op_type == Types.MAP:
+    return ( Types.MAP, dict( [ ( key, _optimize( value ) ) for key, value in op_data.items() ] ) )
+
+  elif op_type == Types.EXISTS:
+    value = _optimize( op_data )
+    if value[0] == Types.CONSTANT:
+      return ( Types.CONSTANT, True )
+
+    return ( Types.EXISTS, value )
+
+  return operation  # CONSTANT, VARIABLE, JUMP_POINT, GOTO, OTHER, nothing to do
@@ -0,0 +1,72 @@
+import pytest
+
+from contractor.tscript.parser import Parser
+from contractor.tscript.optimizer import optimize
+from contractor.tscript.runner import Runner, ParamaterError
+
+
+def _parse( script ):
+  return Parser().parse( script )
+
+
+def _line( ast, index=0 ):
+  return ast[1][ '_children' ][ index ]
+
+
+def test_fold():
+  ast = _parse( 'aa = ( 1 + ( 2 * 3 ) )' )
+  optimized = optimize( ast )
+  assert _line( optimized ) == ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'aa' } ), 'value': ( 'C', 7 ) } ), 1 )
+  assert _line( ast )[1][1][ 'value' ][0] == 'X'  # the original is left alone
+
+  assert _line( optimize( _parse( 'aa = ( "host" . ( 1 + 1 ) )' ) ) )[1][1][ 'value' ] == ( 'C', 'host2' )
+  assert _line( optimize( _parse( 'aa = ( 1 < 2 )' ) ) )[1][1][ 'value' ] == ( 'C', True )
+  assert _line( optimize( _parse( 'aa = not True' ) ) )[1][1][ 'value' ] == ( 'C', False )
+  assert _line( optimize( _parse( 'aa = len( array=[ ( 1 + 1 ) ] )' ) ) )[1][1][ 'value' ] == ( 'F', { 'module': None, 'name': 'len', 'paramaters': { 'array': ( 'Y', [ ( 'C', 2 ) ] ) } } )
+  assert _line( optimize( _parse( 'aa = bb[ ( 1 + 1 ) ]' ) ) )[1][1][ 'value' ] == ( 'R', { 'module': None, 'name': 'bb', 'index': ( 'C', 2 ) } )
+
+  # left for run time
+  assert _line( optimize( _parse( 'aa = ( bb + 1 )' ) ) )[1][1][ 'value' ][0] == 'X'
+  assert _line( optimize( _parse( 'aa = ( 1 / 0 )' ) ) )[1][1][ 'value' ][0] == 'X'
+  assert _line( optimize( _parse( 'aa = ( 1 + "a" )' ) ) )[1][1][ 'value' ][0] == 'X'
+  assert _line( optimize( _parse( 'aa = ( 2 ^ 100000 )' ) ) )[1][1][ 'value' ][0] == 'X'
+
+
+def test_ifelse():
+  ast = optimize( _parse( 'if True then aa = 1 else aa = 2' ) )
+  assert _line( ast ) == ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'aa' } ), 'value': ( 'C', 1 ) } ), 1 )
+
+  ast = optimize( _parse( 'if ( 1 == 2 ) then aa = 1 else aa = 2' ) )
+  assert _line( ast ) == ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'aa' } ), 'value': ( 'C', 2 ) } ), 1 )
+
+  ast = optimize( _parse( 'if False then aa = 1 elif bb then aa = 2 elif True then aa = 3 else aa = 4' ) )
+  assert _line( ast )[1][0] == 'I'
+  assert [ i[ 'condition' ] for i in _line( ast )[1][1] ] == [ ( 'V', { 'module': None, 'name': 'bb' } ), None ]
+  assert _line( ast )[1][1][1][ 'expression' ][1][ 'value' ] == ( 'C', 3 )
+
+  ast = optimize( _parse( 'if bb then aa = 1 else aa = 2' ) )
+  assert len( _line( ast )[1][1] ) == 2
+
+
+def test_noop():
+  ast = optimize( _parse( 'aa = 1\nif False then aa = 2\n42\nwhile False do aa = 3\nbegin( description="stuff" )\n  ( 1 + 2 )\n  bb = 2\nend\ncc = 3' ) )
+  assert [ i[2] for i in ast[1][ '_children' ] ] == [ 1, 5, 9 ]
+  assert _line( ast, 1 )[1] == ( 'S', { 'description': 'stuff', '_children': [ ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'bb' } ), 'value': ( 'C', 2 ) } ), 7 ) ] } )
+
+  ast = optimize( _parse( 'aa\npass\nwhile True do aa = 1' ) )  # these still do something, or raise an error
+  assert len( ast[1][ '_children' ] ) == 3
+
+
+def test_run():
+  script = 'cnt = 0\ntotal = ""\nwhile ( cnt < ( 2 * 5 ) ) do begin()\n  if ( 1 > 2 ) then total = "never" elif ( cnt > 4 ) then total = ( total . ( "-" . cnt ) )\n  cnt = ( cnt + 1 )\nend\nlast = ( "done" . ( 1 + 1 ) )'
+  plain = Runner( _parse( script ) )
+  plain.run()
+  optimized = Runner( optimize( _parse( script ) ) )
+  optimized.run()
+  assert optimized.done
+  assert optimized.variable_map == plain.variable_map == { 'cnt': 10, 'total': '-5-6-7-8-9', 'last': 'done2' }
+
+  runner = Runner( optimize( _parse( 'aa = 1\nif True then begin()\n  42\n  bb = ( 1 + "a" )\nend' ) ) )
+  with pytest.raises( ParamaterError ) as execinfo:
+    runner.run()
+  assert execinfo.value.line_no == 4
@@ -1,13 +1,20 @@
+import re
+import hashlib
+from bisect import bisect_left, bisect_right
 from datetime import timedelta
 
-from parsimonious import Grammar, ParseError, IncompleteParseError
+from contractor.lib.lru import LRUCache
 
+PARSE_CACHE_SIZE = 200
 
+
+# the Parser below is a hand written recursive descent parser of this grammar,
+# it tries the alternatives in the same order as this PEG grammar, keep them in sync
 tscript_grammar = """
 script              = lines
 lines               = line*
 line                = ( expression / ws_s ) comment? nl_p
-expression          = ws_s ( jump_point / goto / function / ifelse / whiledo / block / assignment / infix / boolean / not_ / none / exists / other / array_map_item / array / map / variable / time / number_float / number_int / text ) ws_s
+expression          = ws_s ( jump_point / goto / function / ifelse / whiledo / block / parallel / assignment / infix / boolean / not_ / none / exists / other / array_map_item / array / map / variable / time / number_float / number_int / text ) ws_s
 value_expression    = ws_s ( function / assignment / infix / boolean / not_ / none / exists / array_map_item / array / map / variable / time / number_float / number_int / text ) ws_s
 constant_expression = ws_s ( boolean / none / time / number_float / number_int / text ) ws_s
 comment             = "#" ~"[^\\r\\n]*"
@@ -16,6 +23,7 @@ goto                = "goto " label
 paramater_map       = ( ( ws_s label ws_s "=" value_expression "," )* ws_s label ws_s "=" value_expression )? ws_s
 const_paramater_map = ( ( ws_s label ws_s "=" constant_expression "," )* ws_s label ws_s "=" constant_expression )? ws_s
 block               = "begin(" const_paramater_map ")" lines ws_s "end"
+parallel            = "parallel(" const_paramater_map ")" lines ws_s "end"   # each line must be a function call, or an assignment of one to a variable
 
 whiledo             = "while" value_expression "do" em_p expression
 other               = ( "continue" / "break" / "pass" )
@@ -35,7 +43,7 @@ exists              = "exists(" ws_s ( array_map_item / variable ) ws_s ")"
 array               = "[" ( ( value_expression "," )* value_expression )? ws_s "]"
 map                 = "{" paramater_map "}"
 
-reserved            = ( "begin" / "end" / "while" / "do" / "goto" / "exists" / other ) !~"[a-zA-Z0-9_]"
+reserved            = ( "begin" / "end" / "while" / "do" / "goto" / "exists" / "parallel" / other ) !~"[a-zA-Z0-9_]"
 variable            = !reserved ( label "." )? label !"("
 
 function            = !reserved ( label "." )? label "(" paramater_map ")"
@@ -57,6 +65,30 @@ em_s                = ~"[\\x0d\\x0a \\x09]*"
 em_p                = ~"[\\x0d\\x0a \\x09]+"
 """
 
+_LABEL = re.compile( '[a-zA-Z][a-zA-Z0-9_]+' )
+_WORD_CHAR = re.compile( '[a-zA-Z0-9_]' )
+_WS_S = re.compile( '[ \t]*' )
+_NL_P = re.compile( '[\r\n]+' )
+_EM_S = re.compile( '[\r\n \t]*' )
+_EM_P = re.compile( '[\r\n \t]+' )
+_NEW_LINE = re.compile( '\n' )
+_COMMENT = re.compile( '#[^\r\n]*' )
+_NOT = re.compile( '[Nn]ot' )
+_TRUE = re.compile( '[Tt]rue' )
+_FALSE = re.compile( '[Ff]alse' )
+_NONE = re.compile( '[Nn]one' )
+_TIME = re.compile( '([0-9]{1,2}:){1,3}[0-9]{1,2}' )
+_NUMBER_FLOAT = re.compile( '[-+]?[0-9]+\.[0-9]+' )
+_NUMBER_INT = re.compile( '[-+]?[0-9]+' )
+_TEXT = re.compile( '\'([^\']*)\'|"([^"]*)"' )
+
+_RESERVED_LIST = ( 'begin', 'end', 'while', 'do', 'goto', 'exists', 'parallel', 'continue', 'break', 'pass' )
+_OTHER_LIST = ( 'continue', 'break', 'pass' )
+_INFIX_OPERATOR_LIST = ( '.', '^', '*', '/', '%', '+', '-', '&', '|', 'and', 'or', '==', '!=', '<=', '>=', '>', '<' )
+
+_LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_DIGITS = '0123456789'
+
 
 class Types():
   LINE = 'L'
@@ -74,6 +106,7 @@ class Types():
   FUNCTION = 'F'
   ASSIGNMENT = 'A'
   EXISTS = 'E'
+  PARALLEL = 'Q'
   OTHER = 'O'
 
 
@@ -87,240 +120,620 @@ class ParserError( Exception ):
     return 'ParseError, line: {0}, column: {1}, "{2}"'.format( self.line, self.column, self.msg )
 
 
+parse_cache = LRUCache( PARSE_CACHE_SIZE )  # script hash -> AST
+
+
+def scriptHash( script, optimize=False ):  # the optimized AST is a different AST, it gets it's own hash
+  if optimize:
+    script = '\0optimize\0' + script
+
+  return hashlib.sha256( script.encode( 'utf-8' ) ).hexdigest()
+
+
 def lint( script ):
   parser = Parser()
   return parser.lint( script )
 
 
-def parse( script ):
+# NOTE: the AST returned is shared with everything else that parsed the same
+# script, treat it as read only
+def parse( script, optimize=False ):  # see contractor.tscript.optimizer
+  script_hash = scriptHash( script, optimize )
+  try:
+    return parse_cache.get( script_hash )
+  except KeyError:
+    pass
+
+  parser = Parser()
+  return _cacheAST( script_hash, parser.parse( script ), optimize )
+
+
+def check( script, optimize=False ):  # lint and parse in one pass, returns ( lint message, AST ), if there is a message the AST is None, otherwise the AST is put in the parse cache
   parser = Parser()
-  return parser.parse( script )
+  ( message, ast ) = parser._lint( script )
+  if message is not None:
+    return ( message, None )
+
+  return ( None, _cacheAST( scriptHash( script, optimize ), ast, optimize ) )
+
+
+def _optimizeAST( ast, optimize ):
+  if optimize:
+    from contractor.tscript.optimizer import optimize as optimizeAST  # the optimizer needs the runner, which needs us
+    ast = optimizeAST( ast )
 
+  return ast
 
-class IsEmpty( Exception ):
-  pass
 
+def _cacheAST( script_hash, ast, optimize ):
+  ast = _optimizeAST( ast, optimize )
+  parse_cache.set( script_hash, ast )
 
+  return ast
+
+
+class IncompleteParse( Exception ):
+  def __init__( self, line, column ):
+    super().__init__()
+    self.line = line
+    self.column = column
+
+
+# each rule takes the position to start at, and returns None if it does not match,
+# otherwise ( value, position after the match ), the first alternative that
+# matches wins, same as a PEG
 class Parser( object ):
   def __init__( self ):
     super().__init__()
     self.line_endings = []
-    self.grammar = Grammar( tscript_grammar )
+    self.script = None
+    self._value_expression_cache = {}
 
   def lint( self, script ):
-    script += '\n'  # just incase the end of the script lacks a \n otherwise the *line* will not match
-    self.line_endings = [ i for i, c in enumerate( script ) if c == '\n' ]
-    try:
-      ast = self.grammar.parse( script )
-    except IncompleteParseError as e:
-      return 'Incomplete Parsing on line: {0} column: {1}'.format( e.line(), e.column() )
-    except ParseError as e:
-      return 'Error Parsing on line: {0} column: {1}'.format( e.line(), e.column() )
+    return self._lint( script )[0]
 
+  def _lint( self, script ):  # returns ( message, AST ), message is None if there is nothing wrong
     try:
-      self._eval( ast )
+      ast = ( Types.SCOPE, { '_children': self._parse( script ) } )
+    except IncompleteParse as e:
+      return ( 'Incomplete Parsing on line: {0} column: {1}'.format( e.line, e.column ), None )
     except Exception as e:
-      return 'Exception Parsing "{0}"'.format( e )
+      return ( 'Exception Parsing "{0}"'.format( e ), None )
 
-    return None
+    from contractor.tscript.analysis import undefinedFunctions  # the analysis needs the runner, which needs us
+    undefined_list = undefinedFunctions( ast )
+    if undefined_list:
+      return ( 'Not Defined {0}'.format( ', '.join( [ '"{0}" line {1}'.format( name, line_no ) for ( name, line_no ) in undefined_list ] ) ), None )
+
+    return ( None, ast )
 
   def parse( self, script ):
-    script += '\n'  # just incase the end of the script lacks a \n otherwise the *line* will not match
-    self.line_endings = [ i for i, c in enumerate( script ) if c == '\n' ]
     try:
-      ast = self.grammar.parse( script )
-    except IncompleteParseError as e:
-      raise ParserError( e.line(), e.column(), 'Incomplete Parse' )
-    except ParseError as e:
-      raise ParserError( e.line(), e.column(), 'Error Parsing' )
+      children = self._parse( script )
+    except IncompleteParse as e:
+      raise ParserError( e.line, e.column, 'Incomplete Parse' )
 
-    return ( Types.SCOPE, { '_children': self._eval( ast ) } )
+    return ( Types.SCOPE, { '_children': children } )
 
-  def _eval( self, node ):
-    if node.expr_name[ 0:3 ] in ( 'ws_', 'nl_', 'em_' ):  # ignore wite space
-      raise IsEmpty()
+  def _parse( self, script ):
+    script += '\n'  # just incase the end of the script lacks a \n otherwise the *line* will not match
+    self.script = script
+    self.line_endings = [ i.start() for i in _NEW_LINE.finditer( script ) ]
+    self._value_expression_cache = {}
 
     try:
-      handler = getattr( self, node.expr_name )
-    except AttributeError:
-      handler = self.anonymous
+      children, pos = self._lines( 0 )
+    finally:
+      self._value_expression_cache = {}
 
-    return handler( node )
+    if pos < len( script ):
+      line = bisect_left( self.line_endings, pos )
+      if line > 0:
+        column = pos - self.line_endings[ line - 1 ]
+      else:
+        column = pos + 1
 
-  def anonymous( self, node ):
-    if len( node.children ) < 1:
-      raise IsEmpty()
+      raise IncompleteParse( line + 1, column )
 
-    return self._eval( node.children[0] )
+    return children
 
-  def lines( self, node ):
-    if not node.children:
-      return []
+  def _lineNo( self, pos ):
+    return min( bisect_right( self.line_endings, pos ), len( self.line_endings ) - 1 ) + 1
 
+  def _lines( self, pos ):
     result = []
-    for child in node.children:
-      try:
-        result.append( self._eval( child ) )
-      except IsEmpty:
-        pass
+    while True:
+      match = self._line( pos )
+      if match is None:
+        return result, pos
+
+      value, pos = match
+      if value is not None:
+        result.append( value )
+
+  def _line( self, pos ):
+    script = self.script
+    match = self._expression( pos )
+    if match is None:
+      value = None
+      end = _WS_S.match( script, pos ).end()
+    else:
+      value = ( Types.LINE, match[0], self._lineNo( pos ) )
+      end = match[1]
+
+    if script.startswith( '#', end ):
+      end = _COMMENT.match( script, end ).end()
+
+    match = _NL_P.match( script, end )
+    if match is None:
+      return None
+
+    return value, match.end()
+
+  def _alternatives( self, rule_map, pos ):
+    script = self.script
+    pos = _WS_S.match( script, pos ).end()
+    for rule in rule_map.get( script[ pos:pos + 1 ], () ):
+      match = rule( self, pos )
+      if match is not None:
+        return match[0], _WS_S.match( script, match[1] ).end()
+
+    return None
+
+  def _expression( self, pos ):
+    return self._alternatives( self._expression_map, pos )
+
+  def _valueExpression( self, pos ):
+    try:
+      return self._value_expression_cache[ pos ]
+    except KeyError:
+      pass
+
+    result = self._alternatives( self._value_expression_map, pos )
+    self._value_expression_cache[ pos ] = result
 
     return result
 
-  def line( self, node ):
-    for i in range( 0, len( self.line_endings ) ):
-      if self.line_endings[ i ] > node.start:
-        break
+  def _constantExpression( self, pos ):
+    return self._alternatives( self._constant_expression_map, pos )
+
+  def _label( self, pos ):
+    match = _LABEL.match( self.script, pos )
+    if match is None:
+      return None
 
-    return ( Types.LINE, self._eval( node.children[0] ), i + 1 )
+    return match.group(), match.end()
 
-  def expression( self, node ):
-    return self._eval( node.children[1] )
+  def _reserved( self, pos ):
+    script = self.script
+    for word in _RESERVED_LIST:
+      if script.startswith( word, pos ):
+        return _WORD_CHAR.match( script, pos + len( word ) ) is None
 
-  def value_expression( self, node ):
-    return self._eval( node.children[1] )
+    return False
 
-  def constant_expression( self, node ):
-    return self._eval( node.children[1] )
+  def _name( self, pos ):  # !reserved ( label "." )? label
+    if self._reserved( pos ):
+      return None
 
-  def block( self, node ):
-    options = self._eval( node.children[1] )
-    options[ '_children' ] = self._eval( node.children[3] )
+    label = self._label( pos )
+    if label is None:
+      return None
 
-    return ( Types.SCOPE, options )
+    if self.script.startswith( '.', label[1] ):
+      name = self._label( label[1] + 1 )
+      if name is None:
+        return None
 
-  def paramater_map( self, node ):
-    children = node.children[0].children
-    if len( children ) == 0:
-      return {}
+      return label[0], name[0], name[1]
 
-    children = children[0].children
-    groups = [ children[1:] ]
-    for item in children[0]:
-      groups.append( item.children )
+    return None, label[0], label[1]
+
+  def _paramaterMap( self, pos, value_rule ):
+    script = self.script
+    group_list = []
+    end = pos
+    while True:
+      label = self._label( _WS_S.match( script, end ).end() )
+      if label is None:
+        group_list = []
+        break
+
+      end = _WS_S.match( script, label[1] ).end()
+      if not script.startswith( '=', end ):
+        group_list = []
+        break
+
+      value = value_rule( end + 1 )
+      if value is None:
+        group_list = []
+        break
+
+      group_list.append( ( label[0], value[0] ) )
+      end = value[1]
+      if not script.startswith( ',', end ):
+        break
+
+      end += 1
+
+    if not group_list:
+      end = pos
 
     result = {}
-    for item in groups:
-      try:
-        result[ item[1].text ] = self._eval( item[4] )
-      except IsEmpty:
-        raise Exception( 'Paramater values are not allowed to be IsEmpty' )
+    for key, value in group_list[ -1: ] + group_list[ :-1 ]:
+      result[ key ] = value
 
-    return result
+    return result, _WS_S.match( script, end ).end()
 
-  def const_paramater_map( self, node ):
-    result = self.paramater_map( node )
-    for key in result.keys():
-      if result[ key ][0] != Types.CONSTANT:
-        raise Exception( 'Expected Constant paramater, got type "{0}"'.format( result[ key ][0] ) )
+  def _jumpPoint( self, pos ):
+    label = self._label( pos + 1 )
+    if label is None:
+      return None
 
-      result[ key ] = result[ key ][1]
+    return ( Types.JUMP_POINT, label[0] ), label[1]
 
-    return result
+  def _goto( self, pos ):
+    if not self.script.startswith( 'goto ', pos ):
+      return None
+
+    label = self._label( pos + 5 )
+    if label is None:
+      return None
 
-  def jump_point( self, node ):
-    return ( Types.JUMP_POINT, node.children[1].text )
+    return ( Types.GOTO, label[0] ), label[1]
 
-  def goto( self, node ):
-    return ( Types.GOTO, node.children[1].text )
+  def _block( self, pos ):
+    script = self.script
+    if not script.startswith( 'begin(', pos ):
+      return None
 
-  def time( self, node ):  # days:hours:mins:seconds
-    parts = [ int( i ) for i in node.text.split( ':' ) ]
+    options, pos = self._paramaterMap( pos + 6, self._constantExpression )
+    if not script.startswith( ')', pos ):
+      return None
+
+    children, pos = self._lines( pos + 1 )
+    pos = _WS_S.match( script, pos ).end()
+    if not script.startswith( 'end', pos ):
+      return None
+
+    for key in options.keys():
+      options[ key ] = options[ key ][1]
+
+    options[ '_children' ] = children
+
+    return ( Types.SCOPE, options ), pos + 3
+
+  def _parallel( self, pos ):
+    script = self.script
+    if not script.startswith( 'parallel(', pos ):
+      return None
+
+    options, pos = self._paramaterMap( pos + 9, self._constantExpression )
+    if not script.startswith( ')', pos ):
+      return None
+
+    children, pos = self._lines( pos + 1 )
+    pos = _WS_S.match( script, pos ).end()
+    if not script.startswith( 'end', pos ):
+      return None
+
+    for child in children:  # only function calls can be run in parallel
+      operation = child[1]
+      if operation[0] == Types.ASSIGNMENT and operation[1][ 'target' ][0] == Types.VARIABLE:
+        operation = operation[1][ 'value' ]
+
+      if operation[0] != Types.FUNCTION:
+        return None
+
+    for key in options.keys():
+      options[ key ] = options[ key ][1]
+
+    options[ '_children' ] = children
+
+    return ( Types.PARALLEL, options ), pos + 3
+
+  def _whiledo( self, pos ):
+    script = self.script
+    if not script.startswith( 'while', pos ):
+      return None
+
+    condition = self._valueExpression( pos + 5 )
+    if condition is None or not script.startswith( 'do', condition[1] ):
+      return None
+
+    match = _EM_P.match( script, condition[1] + 2 )
+    if match is None:
+      return None
+
+    expression = self._expression( match.end() )
+    if expression is None:
+      return None
+
+    return ( Types.WHILE, { 'condition': condition[0], 'expression': expression[0] } ), expression[1]
+
+  def _conditionExpression( self, pos ):  # value_expression "then" em_p expression
+    script = self.script
+    condition = self._valueExpression( pos )
+    if condition is None or not script.startswith( 'then', condition[1] ):
+      return None
+
+    match = _EM_P.match( script, condition[1] + 4 )
+    if match is None:
+      return None
+
+    expression = self._expression( match.end() )
+    if expression is None:
+      return None
+
+    return { 'condition': condition[0], 'expression': expression[0] }, expression[1]
+
+  def _ifelse( self, pos ):
+    script = self.script
+    if not script.startswith( 'if', pos ):
+      return None
+
+    match = self._conditionExpression( pos + 2 )
+    if match is None:
+      return None
+
+    branches = [ match[0] ]
+    pos = match[1]
+    while True:
+      start = _EM_S.match( script, pos ).end()
+      if not script.startswith( 'elif', start ):
+        break
+
+      match = self._conditionExpression( start + 4 )
+      if match is None:
+        break
+
+      branches.append( match[0] )
+      pos = match[1]
+
+    start = _EM_S.match( script, pos ).end()
+    if script.startswith( 'else', start ):
+      match = _EM_P.match( script, start + 4 )
+      if match is not None:
+        expression = self._expression( match.end() )
+        if expression is not None:
+          branches.append( { 'condition': None, 'expression': expression[0] } )
+          pos = expression[1]
+
+    return ( Types.IFELSE, branches ), pos
+
+  def _not( self, pos ):
+    match = _NOT.match( self.script, pos )
+    if match is None:
+      return None
+
+    value = self._valueExpression( match.end() )
+    if value is None:
+      return None
+
+    return ( Types.INFIX, { 'operator': 'not', 'left': value[0], 'right': ( Types.CONSTANT, None ) } ), value[1]  # we are going to abuse the INFIX functino for this one
+
+  def _time( self, pos ):  # days:hours:mins:seconds
+    match = _TIME.match( self.script, pos )
+    if match is None:
+      return None
+
+    parts = [ int( i ) for i in match.group().split( ':' ) ]
 
     if len( parts ) == 4:
-      return ( Types.CONSTANT, timedelta( days=parts[0], hours=parts[1], minutes=parts[2], seconds=parts[3] ) )
+      value = timedelta( days=parts[0], hours=parts[1], minutes=parts[2], seconds=parts[3] )
     elif len( parts ) == 3:
-      return ( Types.CONSTANT, timedelta( hours=parts[0], minutes=parts[1], seconds=parts[2] ) )
+      value = timedelta( hours=parts[0], minutes=parts[1], seconds=parts[2] )
     else:
-      return ( Types.CONSTANT, timedelta( minutes=parts[0], seconds=parts[1] ) )
+      value = timedelta( minutes=parts[0], seconds=parts[1] )
 
-  def number_float( self, node ):
-    return ( Types.CONSTANT, float( node.text ) )
+    return ( Types.CONSTANT, value ), match.end()
 
-  def number_int( self, node ):
-    return ( Types.CONSTANT, int( node.text ) )
+  def _numberFloat( self, pos ):
+    match = _NUMBER_FLOAT.match( self.script, pos )
+    if match is None:
+      return None
 
-  def boolean( self, node ):
-    return ( Types.CONSTANT, True if node.text.lower() == 'true' else False )
+    return ( Types.CONSTANT, float( match.group() ) ), match.end()
 
-  def text( self, node ):
-    return ( Types.CONSTANT, node.children[0].children[1].text )
+  def _numberInt( self, pos ):
+    match = _NUMBER_INT.match( self.script, pos )
+    if match is None:
+      return None
 
-  def none( self, node ):
-    return ( Types.CONSTANT, None )
+    return ( Types.CONSTANT, int( match.group() ) ), match.end()
 
-  def exists( self, node ):
-    return ( Types.EXISTS, self._eval( node.children[2] ) )
+  def _text( self, pos ):
+    match = _TEXT.match( self.script, pos )
+    if match is None:
+      return None
 
-  def array( self, node ):
-    children = node.children[1].children
-    if len( children ) == 0:
-      return ( Types.ARRAY, [] )
+    value = match.group( 1 )
+    if value is None:
+      value = match.group( 2 )
 
-    children = children[0].children
-    values = []
-    for item in children[0]:
-      values.append( self._eval( item ) )
+    return ( Types.CONSTANT, value ), match.end()
+
+  def _boolean( self, pos ):
+    match = _TRUE.match( self.script, pos )
+    if match is not None:
+      return ( Types.CONSTANT, True ), match.end()
 
-    values.append( self._eval( children[1] ) )
+    match = _FALSE.match( self.script, pos )
+    if match is not None:
+      return ( Types.CONSTANT, False ), match.end()
 
-    return ( Types.ARRAY, values )
+    return None
 
-  def map( self, node ):
-    values = self._eval( node.children[1] )
+  def _none( self, pos ):
+    match = _NONE.match( self.script, pos )
+    if match is None:
+      return None
 
-    return ( Types.MAP, values )
+    return ( Types.CONSTANT, None ), match.end()
 
-  def variable( self, node ):
-    if len( node.children[1].children ) > 0:
-      module = node.children[1].children[0].children[0].text
-    else:
-      module = None
+  def _exists( self, pos ):
+    script = self.script
+    if not script.startswith( 'exists(', pos ):
+      return None
+
+    pos = _WS_S.match( script, pos + 7 ).end()
+    match = self._arrayMapItem( pos )
+    if match is None:
+      match = self._variable( pos )
+      if match is None:
+        return None
 
-    return ( Types.VARIABLE, { 'module': module, 'name': node.children[2].text } )
+    pos = _WS_S.match( script, match[1] ).end()
+    if not script.startswith( ')', pos ):
+      return None
 
-  def array_map_item( self, node ):
-    variable = self._eval( node.children[0] )
-    if variable[0] != Types.VARIABLE:
-      raise Exception( 'Can only index variables' )
+    return ( Types.EXISTS, match[0] ), pos + 1
 
-    index = self._eval( node.children[2] )
-    return ( Types.ARRAY_MAP_ITEM, { 'module': variable[1][ 'module' ], 'name': variable[1][ 'name' ], 'index': index } )
+  def _other( self, pos ):
+    for word in _OTHER_LIST:
+      if self.script.startswith( word, pos ):
+        return ( Types.OTHER, word ), pos + len( word )
 
-  def infix( self, node ):
-    return ( Types.INFIX, { 'operator': node.children[2].text, 'left': self._eval( node.children[1] ), 'right': self._eval( node.children[3] ) } )
+    return None
 
-  def not_( self, node ):  # we are going to abuse the INFIX functino for this one
-    return ( Types.INFIX, { 'operator': 'not', 'left': self._eval( node.children[1] ), 'right': ( Types.CONSTANT, None ) } )
+  def _array( self, pos ):
+    script = self.script
+    values = []
+    end = pos + 1
+    while True:
+      value = self._valueExpression( end )
+      if value is None:
+        values = []
+        break
 
-  def other( self, node ):
-    return ( Types.OTHER, node.children[0].text )
+      values.append( value[0] )
+      end = value[1]
+      if not script.startswith( ',', end ):
+        break
 
-  def whiledo( self, node ):
-    return ( Types.WHILE, { 'condition': self._eval( node.children[1] ), 'expression': self._eval( node.children[4] ) } )
+      end += 1
 
-  def ifelse( self, node ):
-    branches = []
-    branches.append( { 'condition': self._eval( node.children[1] ), 'expression': self._eval( node.children[4] ) } )
+    if not values:
+      end = pos + 1
 
-    for item in node.children[5].children:
-      branches.append( { 'condition': self._eval( item.children[2] ), 'expression': self._eval( item.children[5] ) } )
+    end = _WS_S.match( script, end ).end()
+    if not script.startswith( ']', end ):
+      return None
 
-    if len( node.children[6].children ) > 0:
-      branches.append( { 'condition': None, 'expression': self._eval( node.children[6].children[0].children[3] ) } )
+    return ( Types.ARRAY, values ), end + 1
 
-    return ( Types.IFELSE, branches )
+  def _map( self, pos ):
+    values, pos = self._paramaterMap( pos + 1, self._valueExpression )
+    if not self.script.startswith( '}', pos ):
+      return None
 
-  def function( self, node ):
-    params = self._eval( node.children[4] )
+    return ( Types.MAP, values ), pos + 1
 
-    if len( node.children[1].children ) > 0:
-      module = node.children[1].children[0].children[0].text
-    else:
-      module = None
+  def _variable( self, pos ):
+    name = self._name( pos )
+    if name is None or self.script.startswith( '(', name[2] ):
+      return None
+
+    return ( Types.VARIABLE, { 'module': name[0], 'name': name[1] } ), name[2]
+
+  def _function( self, pos ):
+    script = self.script
+    name = self._name( pos )
+    if name is None or not script.startswith( '(', name[2] ):
+      return None
 
-    return ( Types.FUNCTION, { 'module': module, 'name': node.children[2].text, 'paramaters': params } )
+    params, pos = self._paramaterMap( name[2] + 1, self._valueExpression )
+    if not script.startswith( ')', pos ):
+      return None
 
-  def assignment( self, node ):
-    target = self._eval( node.children[0] )
+    return ( Types.FUNCTION, { 'module': name[0], 'name': name[1], 'paramaters': params } ), pos + 1
 
-    return ( Types.ASSIGNMENT, { 'target': target, 'value': self._eval( node.children[3] ) } )
+  def _arrayMapItem( self, pos ):
+    script = self.script
+    variable = self._variable( pos )
+    if variable is None or not script.startswith( '[', variable[1] ):
+      return None
+
+    index = self._valueExpression( variable[1] + 1 )
+    if index is None or not script.startswith( ']', index[1] ):
+      return None
+
+    variable = variable[0][1]
+    return ( Types.ARRAY_MAP_ITEM, { 'module': variable[ 'module' ], 'name': variable[ 'name' ], 'index': index[0] } ), index[1] + 1
+
+  def _infix( self, pos ):
+    script = self.script
+    left = self._valueExpression( pos + 1 )
+    if left is None:
+      return None
+
+    pos = left[1]
+    for operator in _INFIX_OPERATOR_LIST:
+      if script.startswith( operator, pos ):
+        break
+    else:
+      return None
+
+    right = self._valueExpression( pos + len( operator ) )
+    if right is None or not script.startswith( ')', right[1] ):
+      return None
+
+    return ( Types.INFIX, { 'operator': operator, 'left': left[0], 'right': right[0] } ), right[1] + 1
+
+  def _assignment( self, pos ):
+    target = self._arrayMapItem( pos )
+    if target is None:
+      target = self._variable( pos )
+      if target is None:
+        return None
+
+    pos = _WS_S.match( self.script, target[1] ).end()
+    if not self.script.startswith( '=', pos ):
+      return None
+
+    value = self._valueExpression( pos + 1 )
+    if value is None:
+      return None
+
+    return ( Types.ASSIGNMENT, { 'target': target[0], 'value': value[0] } ), value[1]
+
+
+# rule -> the characters the rule can start with, used to skip the rules that can not match
+_FIRST_MAP = {
+               Parser._jumpPoint: ':',
+               Parser._goto: 'g',
+               Parser._function: _LETTERS,
+               Parser._ifelse: 'i',
+               Parser._whiledo: 'w',
+               Parser._block: 'b',
+               Parser._parallel: 'p',
+               Parser._assignment: _LETTERS,
+               Parser._infix: '(',
+               Parser._boolean: 'TtFf',
+               Parser._not: 'Nn',
+               Parser._none: 'Nn',
+               Parser._exists: 'e',
+               Parser._other: 'cbp',
+               Parser._arrayMapItem: _LETTERS,
+               Parser._array: '[',
+               Parser._map: '{',
+               Parser._variable: _LETTERS,
+               Parser._time: _DIGITS,
+               Parser._numberFloat: _DIGITS + '+-',
+               Parser._numberInt: _DIGITS + '+-',
+               Parser._text: '\'"'
+             }
+
+
+def _ruleMap( rule_list ):
+  result = {}
+  for rule in rule_list:
+    for char in _FIRST_MAP[ rule ]:
+      result.setdefault( char, [] ).append( rule )
+
+  return result
+
+
+Parser._expression_map = _ruleMap( [ Parser._jumpPoint, Parser._goto, Parser._function, Parser._ifelse, Parser._whiledo, Parser._block, Parser._parallel, Parser._assignment, Parser._infix, Parser._boolean, Parser._not, Parser._none, Parser._exists, Parser._other, Parser._arrayMapItem, Parser._array, Parser._map, Parser._variable, Parser._time, Parser._numberFloat, Parser._numberInt, Parser._text ] )
+Parser._value_expression_map = _ruleMap( [ Parser._function, Parser._assignment, Parser._infix, Parser._boolean, Parser._not, Parser._none, Parser._exists, Parser._arrayMapItem, Parser._array, Parser._map, Parser._variable, Parser._time, Parser._numberFloat, Parser._numberInt, Parser._text ] )
+Parser._constant_expression_map = _ruleMap( [ Parser._boolean, Parser._none, Parser._time, Parser._numberFloat, Parser._numberInt, Parser._text ] )
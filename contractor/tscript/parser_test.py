@@ -1,7 +1,7 @@
 import pytest
 from datetime import timedelta
 
-from contractor.tscript.parser import parse, lint, ParserError, Parser
+from contractor.tscript.parser import parse, check, lint, ParserError, Parser, parse_cache, scriptHash, PARSE_CACHE_SIZE
 
 
 def test_gramer_parses():
@@ -71,6 +71,7 @@ def test_begin():
   assert lint( 'begin()' ) == 'Incomplete Parsing on line: 1 column: 1'
   assert lint( 'begin()end' ) is None
   assert lint( '' ) is None
+  assert lint( 'aa = 1\nlenn( array=[] )\nfoo.bar()' ) == 'Not Defined "lenn" line 2'
 
   node = parse( 'begin()\n10\nend' )
   assert node == ( 'S', { '_children':
@@ -994,3 +995,80 @@ def test_exists():
                            'expression': ( 'C', 10 ) }
                          ] ),
                     1 ) ] } )
+
+
+def test_parallel():
+  node = parse( 'parallel()\nend' )
+  assert node == ( 'S', { '_children': [ ( 'L', ( 'Q', { '_children': [] } ), 1 ) ] } )
+
+  node = parse( 'parallel( description="power on" )\n  on( name="aa" )\n  bb = dd.on( name=cc, wait=( 1 + 2 ) )\n  # just a comment\nend' )
+  assert node == ( 'S', { '_children': [ ( 'L',
+                   ( 'Q', { 'description': 'power on', '_children': [
+                     ( 'L', ( 'F', { 'module': None, 'name': 'on', 'paramaters': { 'name': ( 'C', 'aa' ) } } ), 2 ),
+                     ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'bb' } ),
+                                     'value': ( 'F', { 'module': 'dd', 'name': 'on', 'paramaters': { 'name': ( 'V', { 'module': None, 'name': 'cc' } ),
+                                                                                                     'wait': ( 'X', { 'operator': '+', 'left': ( 'C', 1 ), 'right': ( 'C', 2 ) } ) } } ) } ), 3 ) ] } ),
+                   1 ) ] } )
+
+  node = parse( 'parallel_list = 1' )
+  assert node == ( 'S', { '_children': [ ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'parallel_list' } ), 'value': ( 'C', 1 ) } ), 1 ) ] } )
+
+  with pytest.raises( ParserError ):
+    parse( 'parallel()\n  aa = 1\nend' )
+
+  with pytest.raises( ParserError ):
+    parse( 'parallel()\n  aa[1] = on()\nend' )
+
+  with pytest.raises( ParserError ):
+    parse( 'parallel()\n  begin()\n  end\nend' )
+
+  with pytest.raises( ParserError ):
+    parse( 'parallel = 1' )
+
+  with pytest.raises( ParserError ):
+    parse( 'parallel()\n  on()' )
+
+
+def test_parse_cache():
+  parse_cache.clear()
+
+  node = parse( 'myvar = 10' )
+  assert parse_cache.stats == { 'hits': 0, 'misses': 1, 'count': 1, 'size': PARSE_CACHE_SIZE }
+  assert parse( 'myvar = 10' ) is node
+  assert parse_cache.stats == { 'hits': 1, 'misses': 1, 'count': 1, 'size': PARSE_CACHE_SIZE }
+  assert scriptHash( 'myvar = 10' ) in parse_cache
+
+  node2 = parse( 'myvar = 11' )
+  assert node2 is not node
+  assert node2 == ( 'S', { '_children': [ ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'myvar' } ), 'value': ( 'C', 11 ) } ), 1 ) ] } )
+  assert parse_cache.stats == { 'hits': 1, 'misses': 2, 'count': 2, 'size': PARSE_CACHE_SIZE }
+
+  with pytest.raises( ParserError ):
+    parse( 'asdf =' )
+
+  assert scriptHash( 'asdf =' ) not in parse_cache
+  assert len( parse_cache ) == 2
+
+  node3 = parse( 'myvar = ( 10 + 1 )', optimize=True )
+  assert node3 == node2
+  assert node3 is not node2
+  assert parse( 'myvar = ( 10 + 1 )', optimize=True ) is node3
+  assert scriptHash( 'myvar = ( 10 + 1 )', True ) in parse_cache
+  assert scriptHash( 'myvar = ( 10 + 1 )' ) not in parse_cache
+
+
+def test_check():
+  parse_cache.clear()
+
+  assert check( 'aa = ' ) == ( 'Incomplete Parsing on line: 1 column: 1', None )
+  assert check( 'lenn()' ) == ( 'Not Defined "lenn" line 1', None )
+  assert len( parse_cache ) == 0
+
+  ( message, node ) = check( 'myvar = 10' )
+  assert message is None
+  assert node == parse( 'myvar = 10' )
+  assert parse( 'myvar = 10' ) is node
+
+  ( message, node ) = check( 'myvar = ( 10 + 1 )', True )
+  assert node == ( 'S', { '_children': [ ( 'L', ( 'A', { 'target': ( 'V', { 'module': None, 'name': 'myvar' } ), 'value': ( 'C', 11 ) } ), 1 ) ] } )
+  assert parse( 'myvar = ( 10 + 1 )', True ) is node
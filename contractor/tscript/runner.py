@@ -1,4 +1,5 @@
 import sys
+import time
 import uuid
 import traceback
 import datetime
@@ -7,8 +8,11 @@ import logging
 from importlib import import_module
 from django.conf import settings
 
+from contractor.lib.lru import LRUCache
 from contractor.tscript.parser import Types
 
+CLOSURE_CACHE_SIZE = 200
+
 
 # thrown when the scipt would like to pause execution, calling run() resumes execution
 class Pause( Exception ):
@@ -153,6 +157,14 @@ class ExternalFunction( object ):
     # this can be called multiple times before and after done is True and/or the  vaule has been retrieved
     return ''
 
+  @property
+  def wake_at( self ):
+    # return a naive utc datetime before which done will not return True, or None if that is not known
+    # contractor uses this to skip running the script until then, this does not apply while dispatched to subcontractor
+    # keep in mind that subcontractor, users, and other processes cause this to be called
+    # THIS MUST NOT HANG/PAUSE/WAIT/POLL
+    return None
+
   @property
   def value( self ):
     # this returns the return value of this function, called only once, after done returns True
@@ -231,6 +243,9 @@ class Interrupt( Exception ):
   pass
 
 
+BUDGET_CHECK_INTERVAL = 100  # steps, how often run() looks at the clock when it has a budget
+
+
 class Delay( ExternalFunction ):
   def __init__( self, *args, **kwargs ):
     super().__init__( *args, **kwargs )
@@ -244,6 +259,10 @@ class Delay( ExternalFunction ):
   def message( self ):
     return 'Waiting for {0} more seconds'.format( ( self.end_at - datetime.datetime.utcnow() ).seconds )
 
+  @property
+  def wake_at( self ):
+    return self.end_at
+
   def setup( self, parms ):
     seconds = 0
     minutes = 0
@@ -288,6 +307,14 @@ builtin_function_map = {
                         }
 
 
+builtin_pure_list = ( 'len', 'slice', 'index' )  # builtin functions that can not pause or change their paramaters, see _compileClosure
+
+builtin_mutates_map = {  # builtin functions that change the paramater in place, see Runner._ownVariable
+                        'pop': 'array',
+                        'append': 'array'
+                      }
+
+
 infix_string_operator_map = {
                               '.': lambda a, b: a + b,
                             }
@@ -316,6 +343,32 @@ infix_logical_operator_map = {
                              }
 
 
+def _infixValue( operator, left_val, right_val, line_no=None ):
+  if operator in infix_string_operator_map:  # the string group
+    if not isinstance( left_val, str ):
+      left_val = str( left_val )
+    if not isinstance( right_val, str ):
+      right_val = str( right_val )
+
+    value = infix_string_operator_map[ operator ]( left_val, right_val )
+
+  elif operator in infix_math_operator_map:  # the number group
+    if not isinstance( left_val, ( int, float, bool ) ):
+      raise ParamaterError( 'left of operator', 'must be numeric', line_no )
+    if not isinstance( right_val, ( int, float, bool ) ):
+      raise ParamaterError( 'right of operator', 'must be numeric', line_no )
+
+    value = infix_math_operator_map[ operator ]( left_val, right_val )
+
+  elif operator in infix_logical_operator_map:  # the logical group
+    value = infix_logical_operator_map[ operator ]( left_val, right_val )
+
+  else:
+    raise NotDefinedError( operator, line_no )
+
+  return value
+
+
 def _debugDump( message, exception, ast, state ):
   import os
   from datetime import datetime
@@ -351,6 +404,313 @@ def _debugDump( message, exception, ast, state ):
     print( 'Error "{0}" when writing the debug dump'.format( e ) )
 
 
+def _statusList( item_list ):  # item_list is ( scope position, scope length, scope type, scope data ), outer most first
+  result = []
+  last_perc_complete = 0
+  for item in reversed( item_list ):  # work backwards, as we go up, we scale the last perc_complete acording to the % of the curent scope
+    # before + -> scaling the last % complete .... after the +  -> the curent %
+    perc_complete = ( 1.0 / item[1] ) * last_perc_complete + ( 100.0 * item[0] ) / item[1]
+    result.insert( 0, ( perc_complete, item[2], item[3] ) )
+    last_perc_complete = perc_complete
+
+  return result
+
+
+def _parallelBranches( op_data ):  # ( function op_data, assignment op_data or None ) for each line of a parallel block
+  result = []
+  for line in op_data[ '_children' ]:
+    operation = line[1]
+    if operation[0] == Types.ASSIGNMENT:
+      result.append( ( operation[1][ 'value' ][1], operation[1] ) )
+    else:
+      result.append( ( operation[1], None ) )
+
+  return result
+
+
+def _parallelStatus( function_list, work_list ):  # status item for a parallel block, function_list is the op_data of each function
+  if work_list is None:
+    work_list = []
+
+  done = 0
+  tmp = []
+  for i in range( 0, len( function_list ) ):
+    item = { 'module': function_list[i][ 'module' ], 'name': function_list[i][ 'name' ], 'done': False }
+    if i < len( work_list ):
+      if 'value' in work_list[i]:
+        item[ 'done' ] = True
+        done += 1
+      elif 'dispatched' in work_list[i]:
+        item[ 'dispatched' ] = work_list[i][ 'dispatched' ]
+
+    tmp.append( item )
+
+  return ( done, len( function_list ), 'Parallel', { 'function_list': tmp } )
+
+
+def _aliasNames( operation ):  # the variables the value of operation may share containers with, None if it could be anything ( ie: external functions )
+  op_type = operation[0]
+  op_data = operation[1]
+
+  if op_type in ( Types.CONSTANT, Types.EXISTS ):
+    return set()
+
+  if op_type in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ):  # the index is only used to look up the value, not returned
+    if op_data[ 'module' ] is None:
+      return set( [ op_data[ 'name' ] ] )
+
+    return set()
+
+  if op_type == Types.FUNCTION:
+    if op_data[ 'module' ] is not None:
+      return None
+
+    child_list = op_data[ 'paramaters' ].values()
+
+  elif op_type == Types.ARRAY:
+    child_list = op_data
+
+  elif op_type == Types.MAP:
+    child_list = op_data.values()
+
+  elif op_type == Types.INFIX:
+    child_list = ( op_data[ 'left' ], op_data[ 'right' ] )
+
+  else:
+    return None
+
+  result = set()
+  for child in child_list:
+    name_set = _aliasNames( child )
+    if name_set is None:
+      return None
+
+    result |= name_set
+
+  return result
+
+
+def _copyValue( value ):
+  if isinstance( value, ( list, dict ) ):
+    return copy.deepcopy( value )
+
+  return value
+
+
+closure_cache = LRUCache( CLOSURE_CACHE_SIZE )  # id( ast ) -> ( ast, closure map )
+
+CLOSURE_TYPES = ( Types.ARRAY, Types.MAP, Types.ARRAY_MAP_ITEM, Types.INFIX, Types.EXISTS, Types.FUNCTION )  # the values made of other values, worth skipping the state for
+
+
+def _compileClosure( op_type, op_data, closure_map ):  # closure_map is the closure of each child, returns a function( runner ) that gets the value, None if it can't
+  if op_type == Types.ARRAY:
+    item_list = [ closure_map[ i ] for i in range( 0, len( op_data ) ) ]
+    return lambda runner: [ item( runner ) for item in item_list ]
+
+  if op_type == Types.MAP:
+    return lambda runner: { key: item( runner ) for key, item in closure_map.items() }
+
+  if op_type == Types.ARRAY_MAP_ITEM:
+    index = closure_map[ 'index' ]
+    return lambda runner: runner._getArrayMapItem( op_data, index( runner ) )
+
+  if op_type == Types.INFIX:  # both sides are allways evaluated, same as _evaluate
+    left = closure_map[ 'left' ]
+    right = closure_map[ 'right' ]
+    return lambda runner: runner._infix( op_data, left( runner ), right( runner ) )
+
+  if op_type == Types.EXISTS:
+    value = closure_map[ 'value' ]
+
+    def exists( runner ):
+      try:
+        value( runner )
+      except NotDefinedError:
+        return False
+
+      return True
+
+    return exists
+
+  if op_type == Types.FUNCTION:  # anything else may pause or get the value from subcontractor
+    if op_data[ 'module' ] is not None or op_data[ 'name' ] not in builtin_pure_list:
+      return None
+
+    return lambda runner: runner._function( op_data, { 'paramaters': { key: paramater( runner ) for key, paramater in closure_map.items() } } )
+
+  return None
+
+
+def _closure( operation, result ):  # returns ( closure, count of nodes ) for operation, the closure is None if operation may pause, the compound closures are added to result
+  op_type = operation[0]
+  op_data = operation[1]
+
+  if op_type == Types.CONSTANT:
+    return ( lambda runner: op_data, 1 )
+
+  if op_type == Types.VARIABLE:
+    return ( lambda runner: runner._getVariable( op_data ), 1 )
+
+  child_map = {}  # key the closure uses to find the child -> child operation
+  if op_type in ( Types.LINE, Types.EXISTS ):
+    child_map[ 'value' ] = op_data
+
+  elif op_type in ( Types.SCOPE, Types.PARALLEL ):
+    child_map = dict( enumerate( op_data[ '_children' ] ) )
+
+  elif op_type == Types.WHILE:
+    child_map = { 'condition': op_data[ 'condition' ], 'expression': op_data[ 'expression' ] }
+
+  elif op_type == Types.IFELSE:
+    for i in range( 0, len( op_data ) ):
+      if op_data[i][ 'condition' ] is not None:
+        child_map[ ( i, 'condition' ) ] = op_data[i][ 'condition' ]
+      child_map[ ( i, 'expression' ) ] = op_data[i][ 'expression' ]
+
+  elif op_type == Types.ASSIGNMENT:
+    child_map[ 'value' ] = op_data[ 'value' ]
+    if op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM:
+      child_map[ 'index' ] = op_data[ 'target' ][1][ 'index' ]
+
+  elif op_type == Types.FUNCTION:
+    child_map = dict( op_data[ 'paramaters' ] )
+
+  elif op_type == Types.INFIX:
+    child_map = { 'left': op_data[ 'left' ], 'right': op_data[ 'right' ] }
+
+  elif op_type == Types.ARRAY:
+    child_map = dict( enumerate( op_data ) )
+
+  elif op_type == Types.MAP:
+    child_map = dict( op_data )
+
+  elif op_type == Types.ARRAY_MAP_ITEM:
+    child_map[ 'index' ] = op_data[ 'index' ]
+
+  count = 1
+  closure_map = {}
+  for key, child in child_map.items():
+    ( closure_map[ key ], child_count ) = _closure( child, result )
+    count += child_count
+
+  closure = None
+  if op_type in CLOSURE_TYPES and None not in closure_map.values():
+    closure = _compileClosure( op_type, op_data, closure_map )
+    if closure is not None:
+      result[ id( operation ) ] = ( closure, count )
+
+  return ( closure, count )
+
+
+# NOTE: the closure map is shared with every other Runner running the same AST
+def closureMap( ast ):  # id of operation -> ( function( runner ) returning it's value, count of nodes ), for the values that can't pause
+  try:
+    ( cached_ast, result ) = closure_cache.get( id( ast ) )
+    if cached_ast is ast:
+      return result
+  except KeyError:
+    pass
+
+  result = {}
+  _closure( ast, result )
+  closure_cache.set( id( ast ), ( ast, result ) )  # holding on to the ast keeps the id from being re-used
+
+  return result
+
+
+class _ObjectMap( dict ):  # the value/function maps of registered objects are not built until something looks up the object's name
+  def __init__( self, loader ):
+    super().__init__()
+    self.loader = loader
+
+  def __missing__( self, key ):
+    if not self.loader( key ):
+      raise KeyError( key )
+
+    return dict.get( self, key )
+
+
+class Tracer( object ):  # set as Runner.tracer to be told what the script is doing, it is pickled with the runner so keep it serializable
+  def start( self, line_no ):  # run() is starting, line_no is the line it is resuming at
+    pass
+
+  def stop( self ):  # run() is returning/raising
+    pass
+
+  def line( self, line_no ):  # line_no is starting
+    pass
+
+  def node( self, op_type, elapsed ):  # Runner only, an AST node has been evaluated, elapsed is in seconds and includes the node's children
+    pass
+
+  def functionStart( self, module, name ):  # an ExternalFunction has been setup, module is None for builtins
+    pass
+
+  def functionEnd( self, module, name ):  # an ExternalFunction has returned it's value
+    pass
+
+
+def _addTime( item_map, key, count, elapsed ):
+  try:
+    entry = item_map[ key ]
+  except KeyError:
+    entry = item_map[ key ] = [ 0, 0.0 ]
+
+  entry[0] += count
+  entry[1] += elapsed
+
+
+class ProfileTracer( Tracer ):
+  def __init__( self ):
+    super().__init__()
+    self.line_map = {}  # line no -> [ times started, seconds ]
+    self.node_map = {}  # node type -> [ times evaluated, seconds ]
+    self.function_map = {}  # ( module, name ) -> [ times called, wall clock seconds from setup to value ]
+    self.cur_line = None
+    self.line_start = None
+    self.function_start_map = {}  # ( module, name ) -> list of time.time() of the setup of the running functions, they can span many runs and processes
+
+  def start( self, line_no ):
+    self.cur_line = line_no
+    self.line_start = time.perf_counter()
+
+  def stop( self ):
+    self.line( None )
+
+  def line( self, line_no ):
+    now = time.perf_counter()
+    if self.cur_line in self.line_map:  # it is not when the run started before the first line
+      self.line_map[ self.cur_line ][1] += now - self.line_start
+
+    if line_no is not None:
+      _addTime( self.line_map, line_no, 1, 0.0 )
+
+    self.cur_line = line_no
+    self.line_start = now
+
+  def node( self, op_type, elapsed ):
+    _addTime( self.node_map, op_type, 1, elapsed )
+
+  def functionStart( self, module, name ):
+    self.function_start_map.setdefault( ( module, name ), [] ).append( time.time() )
+
+  def functionEnd( self, module, name ):
+    try:
+      start = self.function_start_map[ ( module, name ) ].pop( 0 )
+    except ( KeyError, IndexError ):
+      return
+
+    _addTime( self.function_map, ( module, name ), 1, time.time() - start )
+
+  def summary( self ):
+    type_name_map = dict( [ ( getattr( Types, i ), i ) for i in dir( Types ) if not i.startswith( '_' ) ] )
+    return {
+             'line': dict( [ ( str( key ), { 'count': value[0], 'seconds': value[1] } ) for key, value in self.line_map.items() ] ),
+             'node': dict( [ ( type_name_map.get( key, key ), { 'count': value[0], 'seconds': value[1] } ) for key, value in self.node_map.items() ] ),
+             'function': dict( [ ( key[1] if key[0] is None else '{0}.{1}'.format( *key ), { 'count': value[0], 'seconds': value[1] } ) for key, value in self.function_map.items() ] )
+           }
+
+
 class Runner( object ):
   def __init__( self, ast ):
     super().__init__()
@@ -363,11 +723,17 @@ class Runner( object ):
     self.variable_map = {}  # map of the variables, they are all global
     self.cur_line = 0
     self.contractor_cookie = None
+    self.tracer = None      # see Tracer, only serilized when set
 
     # do not serlize
+    self.script_hash = None  # set when the ast is stored by someone else, see contractor.Foreman.models.dumpRunner
     self.jump_point_map = {}
-    self.function_map = {}
-    self.value_map = {}
+    self.function_map = _ObjectMap( self._loadObject )
+    self.value_map = _ObjectMap( self._loadObject )
+    self.pending_object_map = {}  # objects that have been registered, but have yet to have their function/value maps loaded
+    self.owned_variable_set = set()  # variables that do not share any containers with anything else, and can be changed in place
+    self.alias_map = {}  # id of value operation -> _aliasNames of it
+    self.closure_map = {}  # see closureMap, set by run()
 
     # scan for all the jump points
     for i in range( 0, len( ast[1][ '_children' ] ) ):
@@ -389,7 +755,7 @@ class Runner( object ):
 
   @property
   def status( self ):  # list of ( % complete, status message )
-    logging.debug( 'runner: status state: {0}'.format( self.state ) )
+    logging.debug( 'runner: status state: %s', self.state )
     if self.done or self.aborted:
       return [ ( 100.0, 'Scope', None ) ]
     if len( self.state ) == 0:
@@ -456,6 +822,10 @@ class Runner( object ):
 
         item_list.append( ( 0, 1, 'Function', tmp ) )
 
+      elif step_type == Types.PARALLEL:  # the functions report their own status, no need to look at their paramaters
+        item_list.append( _parallelStatus( [ i[0] for i in _parallelBranches( operation[1] ) ], step_data ) )
+        break
+
       elif step_type == Types.ASSIGNMENT:
         if operation[1][ 'target' ][0] == Types.ARRAY_MAP_ITEM and ( step_data is None or 'index' not in step_data ):
           operation = operation[1][ 'target' ][1][ 'index' ]
@@ -482,17 +852,9 @@ class Runner( object ):
       else:
         raise Exception( 'Confused step type "{0}"'.format( step_type ) )
 
-    logging.debug( 'runner: status item_list {0}'.format( item_list ) )
+    logging.debug( 'runner: status item_list %s', item_list )
 
-    result = []
-    last_perc_complete = 0
-    for item in reversed( item_list ):  # work backwards, as we go up, we scale the last perc_complete acording to the % of the curent scope
-      # before + -> scaling the last % complete .... after the +  -> the curent %
-      perc_complete = ( 1.0 / item[1] ) * last_perc_complete + ( 100.0 * item[0] ) / item[1]
-      result.insert( 0, ( perc_complete, item[2], item[3] ) )
-      last_perc_complete = perc_complete
-
-    return result
+    return _statusList( item_list )
 
   def goto( self, jump_point ):
     try:
@@ -502,7 +864,7 @@ class Runner( object ):
 
     self.state = [ [ Types.SCOPE, pos ] ]
 
-  def run( self, ttl=1000 ):
+  def run( self, ttl=1000, budget=None ):  # budget is in seconds, when it is used up run() returns at the next step, running again picks up from there
     logging.debug( 'runner: run start' )
     if self.aborted:
       return 'aborted'
@@ -510,42 +872,96 @@ class Runner( object ):
     if self.done:
       return 'done'
 
-    self.ttl = ttl
+    self._setTTL( ttl, budget )
+    self._startRun()
+    self.closure_map = closureMap( self.ast )
 
-    while True:  # we are a while loop for the benifit of the goto
-      try:
-        self._evaluate( self.ast, 0 )
-        return ''
+    tracer = self.tracer
+    if tracer is not None:
+      tracer.start( self.cur_line )
+      self._evaluate = self._traceEvaluate
 
-      except Goto as e:  # yank the stack to this jump point,  NOTE: jump points can only be in the global scope
+    try:
+      while True:  # we are a while loop for the benifit of the goto
         try:
-          self.goto( e.name )
-        except NotDefinedError:
-          self.state = 'ABORTED'
-          raise NotDefinedError( e.name, e.line_no )
+          self._evaluate( self.ast, 0 )
+          return ''
 
-      except Interrupt as e:
-        return str( e )
+        except Goto as e:  # yank the stack to this jump point,  NOTE: jump points can only be in the global scope
+          try:
+            self.goto( e.name )
+          except NotDefinedError:
+            self.state = 'ABORTED'
+            raise NotDefinedError( e.name, e.line_no )
 
-      except ( Pause, ExecutionError ) as e:
-        raise e
+        except Interrupt as e:
+          return str( e )
 
-      except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
-        self.state = 'ABORTED'
-        raise e
+        except ( Pause, ExecutionError ) as e:
+          raise e
 
-      except Exception as e:
-        self.state = 'ABORTED'  # TODO: watch some kind of DEBUG flag to enable/disable the stack trace
-        logging.exception( 'runner: Unahndled Exception' )
-        raise UnrecoverableError( 'Unahndled Exception ({0}): "{1}"\ntrace:\n{2}'.format( type( e ).__name__, str( e ), traceback.format_exc() ) )
+        except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
+          self.state = 'ABORTED'
+          raise e
+
+        except Exception as e:
+          self.state = 'ABORTED'  # TODO: watch some kind of DEBUG flag to enable/disable the stack trace
+          logging.exception( 'runner: Unahndled Exception' )
+          raise UnrecoverableError( 'Unahndled Exception ({0}): "{1}"\ntrace:\n{2}'.format( type( e ).__name__, str( e ), traceback.format_exc() ) )
+
+    finally:
+      if tracer is not None:
+        del self._evaluate
+        tracer.stop()
 
     logging.debug( 'runner: run finish' )
 
+  def _setTTL( self, ttl, budget ):
+    self.ttl = ttl
+    if budget is None:
+      self.deadline = None
+      self.ttl_check_at = 0
+    else:
+      self.deadline = time.monotonic() + budget
+      self.ttl_check_at = max( ttl - BUDGET_CHECK_INTERVAL, 0 )  # never below 0, or a short ttl would run past 0 before Timeout
+
+  def _checkTTL( self ):  # the ttl has counted down to ttl_check_at, without a budget that is 0
+    if self.ttl <= 0:
+      raise Timeout( self.cur_line )
+
+    if time.monotonic() >= self.deadline:
+      raise Interrupt( 'Out of time, will resume next run' )
+
+    self.ttl_check_at = max( self.ttl - BUDGET_CHECK_INTERVAL, 0 )
+
+  def _traceEvaluate( self, operation, state_index ):  # stands in for _evaluate while there is a tracer, so _evaluate costs nothing extra without one
+    if operation[0] == Types.LINE and len( self.state ) <= state_index:  # not resuming the line
+      self.tracer.line( operation[2] )
+
+    start = time.perf_counter()
+    try:
+      Runner._evaluate( self, operation, state_index )
+    finally:
+      self.tracer.node( operation[0], time.perf_counter() - start )
+
   def _evaluate( self, operation, state_index ):
-    logging.debug( 'runner: _evaluate level: "{0}" operation: "{1}"'.format( state_index, operation ) )
-    logging.debug( 'runner: _evaluate level: "{0}" start state: "{1}"'.format( state_index, self.state ) )
+    if self.ttl <= self.ttl_check_at:  # before the state is touched, so stopping here leaves nothing half done
+      self._checkTTL()
+
+    self.ttl -= 1
 
     op_type = operation[0]
+    if len( self.state ) == state_index:  # not resuming, if it can't pause, get the value in one go
+      try:
+        ( closure, count ) = self.closure_map[ id( operation ) ]
+      except KeyError:
+        count = None
+
+      if count is not None and self.ttl - count >= self.ttl_check_at:  # the ttl would not have been checked part way through, so it stops in the same place
+        self.ttl -= count - 1
+        self.state.append( [ op_type, None, closure( self ) ] )
+        return
+
     op_data = operation[1]
     try:
       if self.state[ state_index ][0] != op_type:
@@ -553,11 +969,6 @@ class Runner( object ):
     except IndexError:
       self.state.append( [ op_type ] )
 
-    if self.ttl <= 0:
-      raise Timeout( self.cur_line )
-
-    self.ttl -= 1
-
     # NOTE:
     # the logic here can seem a bit funny, however you have to keep
     # in mind that this has to be "re-entrant" ( for lack of a better word )
@@ -586,31 +997,7 @@ class Runner( object ):
         self.state[ state_index ] += [ None, op_data ]
 
     elif op_type == Types.VARIABLE:  # reterieve variable value
-      if op_data[ 'module' ] is None:
-        try:
-          value = self.variable_map[ op_data[ 'name' ] ]
-        except KeyError:
-          raise NotDefinedError( op_data[ 'name' ], self.cur_line )
-
-      else:
-        try:
-          module = self.value_map[ op_data[ 'module' ] ]
-        except KeyError:
-          raise NotDefinedError( op_data[ 'module' ], self.cur_line )
-
-        try:
-          getter = module[ op_data[ 'name' ] ][0]  # index 0 is the getter
-        except KeyError:
-          raise NotDefinedError( '{0}" of module "{1}'.format( op_data[ 'name' ], op_data[ 'module' ] ), self.cur_line )
-
-        if getter is None:
-          raise ParamaterError( 'target', '"{0}" of module "{1}" is not gettable'.format( op_data[ 'name' ], op_data[ 'module' ] ), self.cur_line )
-
-        try:
-          value = getter()
-        except Exception as e:
-          _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line ), e, self.ast, self.state )
-          raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
+      value = self._getVariable( op_data )
 
       try:
         self.state[ state_index ][2] = value
@@ -671,39 +1058,7 @@ class Runner( object ):
         self.state[ state_index ][1][ 'index' ] = self.state[ state_index + 1 ][2]
         self.state = self.state[ :( state_index + 1 ) ]
 
-      # look up the variable
-      if op_data[ 'module' ] is None:
-        try:
-          value = self.variable_map[ op_data[ 'name' ] ]
-        except KeyError:
-          raise NotDefinedError( op_data[ 'name' ], self.cur_line )
-
-      else:
-        try:
-          module = self.value_map[ op_data[ 'module' ] ]
-        except KeyError:
-          raise NotDefinedError( op_data[ 'module' ], self.cur_line )
-
-        try:
-          getter = module[ op_data[ 'name' ] ][0]  # index 0 is the getter
-        except KeyError:
-          raise NotDefinedError( '{0}" of "{1}'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
-
-        if getter is None:
-          raise ParamaterError( 'target', '"{0}" of "{1}" is not gettable'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
-
-        try:
-          value = getter()
-        except Exception as e:
-          _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line ), e, self.ast, self.state )
-          raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
-
-      index = self.state[ state_index ][1][ 'index' ]
-
-      try:
-        value = value[ index ]
-      except ( IndexError, KeyError ):
-        raise NotDefinedError( 'Index/Key does not exist', self.cur_line )
+      value = self._getArrayMapItem( op_data, self.state[ state_index ][1][ 'index' ] )
 
       self.state[ state_index ][1] = None
       try:
@@ -743,34 +1098,7 @@ class Runner( object ):
         self.state[ state_index ][1][ 'value' ] = self.state[ state_index + 1 ][2]
         self.state = self.state[ :( state_index + 1 ) ]
 
-      target = op_data[ 'target' ][1]
-      value = copy.deepcopy( self.state[ state_index ][1][ 'value' ] )
-
-      if target[ 'module' ] is None:  # we don't evaluate the target, it can only be a variable
-        if op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM:
-          self.variable_map[ target[ 'name' ] ][ self.state[ state_index ][1][ 'index' ] ] = value
-        else:
-         self.variable_map[ target[ 'name' ] ] = value
-
-      else:
-        try:
-          module = self.value_map[ target[ 'module' ] ]
-        except KeyError:
-          raise NotDefinedError( target[ 'module' ], self.cur_line )
-
-        try:
-          setter = module[ target[ 'name' ] ][1]  # index 1 is the setter
-        except KeyError:
-          raise NotDefinedError( '{0}" of "{1}'.format( target[ 'module' ], target[ 'name' ] ), self.cur_line )
-
-        if setter is None:
-          raise ParamaterError( 'target', '"{0}" of "{1}" is not settable'.format( target[ 'module' ], target[ 'name' ] ), self.cur_line )
-
-        try:
-          setter( value )
-        except Exception as e:
-          _debugDump( 'setter "{0}" in module "{1}" error on line "{2}"'.format( target[ 'name' ], target[ 'module' ], self.cur_line ), e, self.ast, self.state )
-          raise UnrecoverableError( 'setter "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( target[ 'name' ], target[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
+      self._assign( op_data, self.state[ state_index ][1].get( 'index' ), self.state[ state_index ][1][ 'value' ] )
 
     elif op_type == Types.INFIX:  # infix type operators
       try:
@@ -800,30 +1128,7 @@ class Runner( object ):
         self.state[ state_index ][1][ 'right' ] = self.state[ state_index + 1 ][2]
         self.state = self.state[ :( state_index + 1 ) ]
 
-      left_val = self.state[ state_index ][1][ 'left' ]
-      right_val = self.state[ state_index ][1][ 'right' ]
-
-      if op_data[ 'operator' ] in infix_string_operator_map:  # the string group
-        if not isinstance( left_val, str ):
-          left_val = str( left_val )
-        if not isinstance( right_val, str ):
-          right_val = str( right_val )
-
-        value = infix_string_operator_map[ op_data[ 'operator' ] ]( left_val, right_val )
-
-      elif op_data[ 'operator' ] in infix_math_operator_map:  # the number group
-        if not isinstance( left_val, ( int, float, bool ) ):
-          raise ParamaterError( 'left of operator', 'must be numeric', self.cur_line )
-        if not isinstance( right_val, ( int, float, bool ) ):
-          raise ParamaterError( 'right of operator', 'must be numeric', self.cur_line )
-
-        value = infix_math_operator_map[ op_data[ 'operator' ] ]( left_val, right_val )
-
-      elif op_data[ 'operator' ] in infix_logical_operator_map:  # the logical group
-        value = infix_logical_operator_map[ op_data[ 'operator' ] ]( left_val, right_val )
-
-      else:
-        raise NotDefinedError( op_data[ 'operator' ], self.cur_line )
+      value = self._infix( op_data, self.state[ state_index ][1][ 'left' ], self.state[ state_index ][1][ 'right' ] )
 
       self.state[ state_index ][1] = None
       self.state[ state_index ].append( value )
@@ -839,97 +1144,8 @@ class Runner( object ):
         # function allready executed and was an Exception last time, just let things pass by us
 
       else:
-        # get the paramaters
-        for key in op_data[ 'paramaters' ]:
-          try:
-            self.state[ state_index ][1][ 'paramaters' ][ key ]
-          except KeyError:
-            try:
-              self.state[ state_index + 1 ][2]
-            except IndexError:
-              self._evaluate( op_data[ 'paramaters' ][ key ], state_index + 1 )
-
-            self.state[ state_index ][1][ 'paramaters' ][ key ] = self.state[ state_index + 1 ][2]
-            self.state = self.state[ :( state_index + 1 ) ]
-
-        try:
-          handler = self.state[ state_index ][1][ 'handler' ]
-        except KeyError:  # handler dosen't exist, let's find it and set it up
-          if op_data[ 'module' ] is None:  # built in function
-            try:
-              handler = builtin_function_map[ op_data[ 'name' ] ]
-            except KeyError:
-              raise NotDefinedError( op_data[ 'name' ], self.cur_line )
-
-            module = '<builtin>'
-
-          else:  # external function
-            try:
-              module = self.function_map[ op_data[ 'module' ] ]
-            except KeyError:
-              raise NotDefinedError( op_data[ 'module' ], self.cur_line )
-
-            try:
-              handler = module[ op_data[ 'name' ] ]()
-            except KeyError:
-              raise NotDefinedError( '{0}" of "{1}'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
-            except TypeError as e:  # hm.... this is bad
-              raise UnrecoverableError( 'Handler init function failed "{0}" on line {1}, possibly trying to call the function directly?'.format( op_data[ 'name' ], self.cur_line ) )
-
-            module = op_data[ 'module' ]
-
-          if isinstance( handler, tuple ):
-            module = handler[0]  # yes, overlay what ever was here
-            handler = handler[1]
-
-          if isinstance( handler, ExternalFunction ):
-            handler._runner = self
-            try:
-              handler.setup( self.state[ state_index ][1][ 'paramaters' ] )
-
-            except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-              raise e
-
-            except Exception as e:
-              _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-              raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
-
-            self.contractor_cookie = str( uuid.uuid4() )
-            self.state[ state_index ][1][ 'handler' ] = handler
-            self.state[ state_index ][1][ 'module' ] = module
-            self.state[ state_index ][1][ 'dispatched' ] = False
-
-          else:
-            try:
-              paramaters = self.state[ state_index ][1][ 'paramaters' ]
-            except TypeError as e:
-              raise ParamaterError( '<unknown>', e, self.cur_line )
-
-            try:
-              value = handler( **paramaters )
-            except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-              raise e
-
-            except Exception as e:
-              _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-              raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
-
-        if isinstance( handler, ExternalFunction ):  # else was allready run and set a value above
-          handler._runner = self
-          try:
-            if not handler.done:
-              handler.run()
-              raise Interrupt( handler.message )
-
-            value = handler.value
-
-          except( Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
-            raise e
-
-          except Exception as e:
-            module = op_data.get( 'module', '<builtin>' )
-            _debugDump( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
-            raise UnrecoverableError( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+        self._functionParamaters( op_data, self.state[ state_index ][1], state_index )
+        value = self._function( op_data, self.state[ state_index ][1] )
 
         self.state[ state_index ][1] = None
         if isinstance( value, Exception ):
@@ -939,6 +1155,26 @@ class Runner( object ):
         else:
           self.state[ state_index ].append( value )
 
+    elif op_type == Types.PARALLEL:
+      try:
+        work_list = self.state[ state_index ][1]
+      except IndexError:
+        work_list = []
+        self.state[ state_index ].append( work_list )
+
+      branch_list = _parallelBranches( op_data )
+      for i in range( 0, len( branch_list ) ):  # all the paramaters first, so nothing is started if one of them can't be evaluated
+        if i == len( work_list ):
+          work_list.append( { 'paramaters': {} } )
+
+        if 'paramaters' in work_list[i]:
+          self._functionParamaters( branch_list[i][0], work_list[i], state_index )
+
+      value_list = self._parallel( [ i[0] for i in branch_list ], work_list )
+      for ( function, assignment ), value in zip( branch_list, value_list ):
+        if assignment is not None:
+          self._assign( assignment, None, value )
+
     elif op_type == Types.WHILE:
       try:
         self.state[ state_index ][1]
@@ -1018,85 +1254,394 @@ class Runner( object ):
     else:
       self.state = self.state[ :state_index + 1 ]  # remove everything after this one, save this one's return value on the stack
 
-    logging.debug( 'runner: _evaluate level: "{0}" final state: '.format( state_index, self.state ) )
     if self.state == []:
       self.state = 'DONE'
       self.cur_line = None
 
-  def toSubcontractor( self, subcontractor_module_list ):
-    # return None if we done, or not started
-    if self.done or self.aborted or self.state == []:
-      return None
+  def _getVariable( self, op_data ):
+    if op_data[ 'module' ] is None:
+      try:
+        value = self.variable_map[ op_data[ 'name' ] ]
+      except KeyError:
+        raise NotDefinedError( op_data[ 'name' ], self.cur_line )
 
-    operation = self.state[ -1 ]
+    else:
+      try:
+        module = self.value_map[ op_data[ 'module' ] ]
+      except KeyError:
+        raise NotDefinedError( op_data[ 'module' ], self.cur_line )
 
-    # return None if the top of the stack is not a function
-    if operation[0] != Types.FUNCTION:
-      return None
+      try:
+        getter = module[ op_data[ 'name' ] ][0]  # index 0 is the getter
+      except KeyError:
+        raise NotDefinedError( '{0}" of module "{1}'.format( op_data[ 'name' ], op_data[ 'module' ] ), self.cur_line )
 
-    if operation[1][ 'module' ] not in subcontractor_module_list:
-      return None
+      if getter is None:
+        raise ParamaterError( 'target', '"{0}" of module "{1}" is not gettable'.format( op_data[ 'name' ], op_data[ 'module' ] ), self.cur_line )
 
-    if operation[1][ 'dispatched' ] is True:  # allready dispatchced, don't send anything else until something comes back
-      return None
+      try:
+        value = getter()
+      except Exception as e:
+        _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line ), e, self.ast, self.state )
+        raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
+
+    return value
+
+  def _getArrayMapItem( self, op_data, index ):
+    if op_data[ 'module' ] is None:
+      try:
+        value = self.variable_map[ op_data[ 'name' ] ]
+      except KeyError:
+        raise NotDefinedError( op_data[ 'name' ], self.cur_line )
+
+    else:
+      try:
+        module = self.value_map[ op_data[ 'module' ] ]
+      except KeyError:
+        raise NotDefinedError( op_data[ 'module' ], self.cur_line )
+
+      try:
+        getter = module[ op_data[ 'name' ] ][0]  # index 0 is the getter
+      except KeyError:
+        raise NotDefinedError( '{0}" of "{1}'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
+
+      if getter is None:
+        raise ParamaterError( 'target', '"{0}" of "{1}" is not gettable'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
+
+      try:
+        value = getter()
+      except Exception as e:
+        _debugDump( 'getter "{0}" in module "{1}" error during setup on line "{2}"'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line ), e, self.ast, self.state )
+        raise UnrecoverableError( 'getter "{0}" in module "{1}" error during setup on line "{2}": "{3}"({4})'.format( op_data[ 'name' ], op_data[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
 
-    handler = operation[1][ 'handler' ]
-    handler._runner = self
     try:
-      ( function_name, paramaters ) = handler.toSubcontractor()
-    except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error during toSubcontractor on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
-      return None  # TODO: log something?
+      value = value[ index ]
+    except ( IndexError, KeyError ):
+      raise NotDefinedError( 'Index/Key does not exist', self.cur_line )
+
+    return value
 
-    if paramaters is None:
+  def _ownVariable( self, name ):  # copy on write, returns the deepcopy memo ( original id -> copy ) if the value had to be copied
+    if name in self.owned_variable_set or name not in self.variable_map:
       return None
 
-    operation[1][ 'dispatched' ] = True
+    memo = {}
+    self.variable_map[ name ] = copy.deepcopy( self.variable_map[ name ], memo )
+    self.owned_variable_set.add( name )
+
+    return memo
+
+  def _releaseAliases( self, operation ):  # the value of operation is about to be shared, what it may of come from is no longer owned
+    try:
+      name_set = self.alias_map[ id( operation ) ]
+    except KeyError:
+      name_set = _aliasNames( operation )
+      self.alias_map[ id( operation ) ] = name_set
+
+    if name_set is None:
+      self.owned_variable_set.clear()
+    else:
+      self.owned_variable_set -= name_set
+
+  def _ownParamater( self, op_data, paramaters, name ):  # about to be changed in place, make sure it dosen't change any other variable
+    for key in paramaters:
+      if key != name:
+        paramaters[ key ] = _copyValue( paramaters[ key ] )  # in case it ends up in the one being changed
+
+    try:
+      operation = op_data[ 'paramaters' ][ name ]
+    except KeyError:
+      return
+
+    if operation[0] not in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ) or operation[1][ 'module' ] is not None:  # a new value, or one from a module
+      return
+
+    memo = self._ownVariable( operation[1][ 'name' ] )
+    if memo is not None and name in paramaters:
+      paramaters[ name ] = memo.get( id( paramaters[ name ] ), paramaters[ name ] )
+
+  def _assign( self, op_data, index, value ):  # the values are shared, not copied, see _ownVariable for where the copy happens
+    target = op_data[ 'target' ][1]
+
+    if target[ 'module' ] is None:  # we don't evaluate the target, it can only be a variable
+      if op_data[ 'target' ][0] == Types.ARRAY_MAP_ITEM:
+        self._ownVariable( target[ 'name' ] )
+        self.variable_map[ target[ 'name' ] ][ index ] = _copyValue( value )  # copied so the owned variable stays unshared
+      else:
+        self.owned_variable_set.discard( target[ 'name' ] )
+        self._releaseAliases( op_data[ 'value' ] )
+        self.variable_map[ target[ 'name' ] ] = value
+
+    else:
+      value = copy.deepcopy( value )  # no telling what the setter does with it
+      try:
+        module = self.value_map[ target[ 'module' ] ]
+      except KeyError:
+        raise NotDefinedError( target[ 'module' ], self.cur_line )
+
+      try:
+        setter = module[ target[ 'name' ] ][1]  # index 1 is the setter
+      except KeyError:
+        raise NotDefinedError( '{0}" of "{1}'.format( target[ 'module' ], target[ 'name' ] ), self.cur_line )
+
+      if setter is None:
+        raise ParamaterError( 'target', '"{0}" of "{1}" is not settable'.format( target[ 'module' ], target[ 'name' ] ), self.cur_line )
+
+      try:
+        setter( value )
+      except Exception as e:
+        _debugDump( 'setter "{0}" in module "{1}" error on line "{2}"'.format( target[ 'name' ], target[ 'module' ], self.cur_line ), e, self.ast, self.state )
+        raise UnrecoverableError( 'setter "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( target[ 'name' ], target[ 'module' ], self.cur_line, str( e ), e.__class__.__name__) )
+
+  def _infix( self, op_data, left_val, right_val ):
+    return _infixValue( op_data[ 'operator' ], left_val, right_val, self.cur_line )
+
+  def _functionParamaters( self, op_data, work, state_index ):  # evaluate the paramaters that are not allready in work, the function is at state_index
+    for key in op_data[ 'paramaters' ]:
+      try:
+        work[ 'paramaters' ][ key ]
+      except KeyError:
+        try:
+          self.state[ state_index + 1 ][2]
+        except IndexError:
+          self._evaluate( op_data[ 'paramaters' ][ key ], state_index + 1 )
+
+        work[ 'paramaters' ][ key ] = self.state[ state_index + 1 ][2]
+        self.state = self.state[ :( state_index + 1 ) ]
+
+  def _parallel( self, function_list, work_list ):  # run the functions of a parallel block, once they are all done returns their values
+    message_list = []
+    for op_data, work in zip( function_list, work_list ):
+      if 'value' in work:
+        continue
 
-    return { 'module': operation[1][ 'module' ], 'function': function_name, 'cookie': self.contractor_cookie, 'paramaters': paramaters }
+      try:
+        value = self._function( op_data, work )
+      except Interrupt as e:
+        message_list.append( str( e ) )
+        continue
+      finally:
+        if 'handler' in work:
+          work.setdefault( 'cookie', self.contractor_cookie )  # each function gets a new contractor_cookie when it is setup, keep it so the results can find their way back
+
+      work.clear()
+      if isinstance( value, Exception ):
+        work[ 'value' ] = None
+        raise value
+
+      work[ 'value' ] = value
+
+    if message_list:
+      raise Interrupt( ', '.join( message_list ) )
+
+    return [ work[ 'value' ] for work in work_list ]
+
+  def _function( self, op_data, work ):
+    try:
+      handler = work[ 'handler' ]
+    except KeyError:  # handler dosen't exist, let's find it and set it up
+      if op_data[ 'module' ] is None:  # built in function
+        try:
+          handler = builtin_function_map[ op_data[ 'name' ] ]
+        except KeyError:
+          raise NotDefinedError( op_data[ 'name' ], self.cur_line )
+
+        module = '<builtin>'
+
+      else:  # external function
+        try:
+          module = self.function_map[ op_data[ 'module' ] ]
+        except KeyError:
+          raise NotDefinedError( op_data[ 'module' ], self.cur_line )
+
+        try:
+          handler = module[ op_data[ 'name' ] ]()
+        except KeyError:
+          raise NotDefinedError( '{0}" of "{1}'.format( op_data[ 'module' ], op_data[ 'name' ] ), self.cur_line )
+        except TypeError as e:  # hm.... this is bad
+          raise UnrecoverableError( 'Handler init function failed "{0}" on line {1}, possibly trying to call the function directly?'.format( op_data[ 'name' ], self.cur_line ) )
+
+        module = op_data[ 'module' ]
+
+      if isinstance( handler, tuple ):
+        module = handler[0]  # yes, overlay what ever was here
+        handler = handler[1]
+
+      if isinstance( handler, ExternalFunction ):
+        handler._runner = self
+        try:
+          handler.setup( work[ 'paramaters' ] )
+
+        except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+          raise e
+
+        except Exception as e:
+          _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
+          raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+
+        if self.tracer is not None:
+          self.tracer.functionStart( op_data[ 'module' ], op_data[ 'name' ] )
+
+        self.contractor_cookie = str( uuid.uuid4() )
+        work[ 'handler' ] = handler
+        work[ 'module' ] = module
+        work[ 'dispatched' ] = False
+
+      else:
+        try:
+          paramaters = work[ 'paramaters' ]
+        except TypeError as e:
+          raise ParamaterError( '<unknown>', e, self.cur_line )
+
+        if op_data[ 'module' ] is None and op_data[ 'name' ] in builtin_mutates_map:
+          self._ownParamater( op_data, paramaters, builtin_mutates_map[ op_data[ 'name' ] ] )
+
+        try:
+          value = handler( **paramaters )
+        except ( ParamaterError, Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+          raise e
+
+        except Exception as e:
+          _debugDump( 'Handler "{0}" in module "{1}" error on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
+          raise UnrecoverableError( 'Handler "{0}" in module "{1}" error on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+
+    if isinstance( handler, ExternalFunction ):  # else was allready run and set a value above
+      handler._runner = self
+      try:
+        if not handler.done:
+          handler.run()
+          raise Interrupt( handler.message )
+
+        value = handler.value
+        if self.tracer is not None:
+          self.tracer.functionEnd( op_data[ 'module' ], op_data[ 'name' ] )
+
+      except( Pause, ExecutionError, UnrecoverableError, Interrupt ) as e:
+        raise e
+
+      except Exception as e:
+        module = op_data.get( 'module', '<builtin>' )
+        _debugDump( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}"'.format( handler.__class__.__name__, module, self.cur_line ), e, self.ast, self.state )
+        raise UnrecoverableError( 'Handler "{0}" in module "{1}" error during done/message/run/value on line "{2}": "{3}"({4})'.format( handler.__class__.__name__, module, self.cur_line, str( e ), e.__class__.__name__) )
+
+    return value
+
+  def _pendingFunctions( self ):  # the work of the functions the script is blocked on, more than one when it is in a parallel block
+    if self.done or self.aborted or self.state == []:
+      return []
+
+    operation = self.state[ -1 ]
+    if len( operation ) < 2:
+      return []
+
+    if operation[0] == Types.PARALLEL:
+      return [ work for work in operation[1] if 'handler' in work ]
+
+    if operation[0] == Types.FUNCTION and isinstance( operation[1], dict ) and 'handler' in operation[1]:
+      return [ operation[1] ]
+
+    return []
+
+  def _cookie( self, work ):
+    return work.get( 'cookie', self.contractor_cookie )
+
+  def isValidCookie( self, cookie ):  # the contractor_cookie, or the cookie of a function waiting on subcontractor, each function in a parallel has it's own
+    return cookie == self.contractor_cookie or cookie in [ self._cookie( work ) for work in self._pendingFunctions() ]
+
+  @property
+  def waiting_on_subcontractor( self ):  # True if running again will not do anything until fromSubcontractor/clearDispatched/rollback
+    work_list = self._pendingFunctions()
+    return work_list != [] and all( [ work[ 'dispatched' ] is True for work in work_list ] )
+
+  @property
+  def wake_at( self ):  # naive utc datetime before which running again will not do anything, None if unknown
+    result = None
+    for work in self._pendingFunctions():
+      if work[ 'dispatched' ] is True:  # running again does nothing for it, but might for the others
+        continue
+
+      handler = work[ 'handler' ]
+      handler._runner = self
+      try:
+        wake_at = handler.wake_at
+      except Exception:
+        return None
+
+      if wake_at is None:
+        return None
+
+      if result is None or wake_at < result:
+        result = wake_at
+
+    return result
+
+  def toSubcontractor( self, subcontractor_module_list ):  # one task per call, in a parallel block call again for the next one
+    # only functions that have been setup, it may be part way through it's paramaters if run() ran out of time
+    for work in self._pendingFunctions():
+      if work[ 'module' ] not in subcontractor_module_list:
+        continue
+
+      if work[ 'dispatched' ] is True:  # allready dispatchced, don't send anything else until something comes back
+        continue
+
+      handler = work[ 'handler' ]
+      handler._runner = self
+      try:
+        ( function_name, paramaters ) = handler.toSubcontractor()
+      except Exception as e:
+        _debugDump( 'Handler "{0}" in module "{1}" error during toSubcontractor on line "{2}"'.format( handler.__class__.__name__, work[ 'module' ], self.cur_line ), e, self.ast, self.state )
+        continue  # TODO: log something?
+
+      if paramaters is None:
+        continue
+
+      work[ 'dispatched' ] = True
+
+      return { 'module': work[ 'module' ], 'function': function_name, 'cookie': self._cookie( work ), 'paramaters': paramaters }
+
+    return None
 
   def fromSubcontractor( self, cookie, data ):
     if self.done or self.aborted or self.state == []:
       return ( 'Script not Running', None )
 
-    if cookie != self.contractor_cookie:
+    if not self.isValidCookie( cookie ):
       return ( 'Bad Cookie', None )
 
     operation = self.state[ -1 ]
 
-    if operation[0] != Types.FUNCTION:
-      return ( 'Not At a Function', None )
+    if operation[0] == Types.PARALLEL:
+      work_list = [ work for work in self._pendingFunctions() if self._cookie( work ) == cookie ]
+      if not work_list:  # the contractor_cookie, the function it was for is done
+        return ( 'Not Expecting Anything', None )
 
-    if operation[1][ 'dispatched' ] is False:
+      work = work_list[0]
+
+    else:
+      if operation[0] != Types.FUNCTION:
+        return ( 'Not At a Function', None )
+
+      work = operation[1]
+
+    if work[ 'dispatched' ] is False:
       return ( 'Not Expecting Anything', None )
 
-    handler = operation[1][ 'handler' ]
+    self._startRun()
+    handler = work[ 'handler' ]
     handler._runner = self
     try:
       handler.fromSubcontractor( data )
     except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error during fromSubcontractor on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
+      _debugDump( 'Handler "{0}" in module "{1}" error during fromSubcontractor on line "{2}"'.format( handler.__class__.__name__, work[ 'module' ], self.cur_line ), e, self.ast, self.state )
       return ( 'Error', None )  # TODO: log something?
 
-    operation[1][ 'dispatched' ] = False
+    work[ 'dispatched' ] = False
 
     return ( 'Accepted', handler.message )
 
   def clearDispatched( self ):
-    if self.done or self.aborted or self.state == []:
-      return
-
-    operation = self.state[ -1 ]
-
-    if operation[0] != Types.FUNCTION:
-      return
-
-    if not isinstance( operation[1], dict ) or 'dispatched' not in operation[1]:
-      return  # or?: raise Exception( 'Function is not dispatched or has allready returned its value' ), we don't say anything if it's not a function
-
-    operation[1][ 'dispatched' ] = False
-
-    return
+    for work in self._pendingFunctions():
+      work[ 'dispatched' ] = False
 
   def rollback( self ):  # TODO: make to/from subcontractor and  rollback consistant in how they handle errors, this will take some work with the things calling them
     if self.done or self.aborted or self.state == []:
@@ -1104,22 +1649,30 @@ class Runner( object ):
 
     operation = self.state[ -1 ]
 
-    if operation[0] != Types.FUNCTION:
+    if operation[0] == Types.PARALLEL:
+      work_list = self._pendingFunctions()
+    elif operation[0] == Types.FUNCTION:
+      work_list = [ operation[1] ]
+    else:
       return 'Not At a Function'
 
-    handler = operation[1][ 'handler' ]
-    try:
-      handler.rollback()
+    for work in work_list:
+      handler = work[ 'handler' ]
+      try:
+        handler.rollback()
 
-    except NoRollback:
-      return 'Rollback not possible'
+      except NoRollback:
+        return 'Rollback not possible'
 
-    except Exception as e:
-      _debugDump( 'Handler "{0}" in module "{1}" error starting rollback on line "{2}"'.format( handler.__class__.__name__, operation[1][ 'module' ], self.cur_line ), e, self.ast, self.state )
-      return 'Exception while trying to rollback'  # TODO: log?
+      except Exception as e:
+        _debugDump( 'Handler "{0}" in module "{1}" error starting rollback on line "{2}"'.format( handler.__class__.__name__, work[ 'module' ], self.cur_line ), e, self.ast, self.state )
+        return 'Exception while trying to rollback'  # TODO: log?
+
+      if 'cookie' in work:
+        work[ 'cookie' ] = str( uuid.uuid4() )
+      work[ 'dispatched' ] = False
 
     self.contractor_cookie = str( uuid.uuid4() )  # revoke any outstanding tasks, TODO: do we also rotate cookie on reset?  if not, should we rotate keys even if rollback is  not possible
-    operation[1][ 'dispatched' ] = False
 
     return 'Done'
 
@@ -1134,10 +1687,32 @@ class Runner( object ):
   def registerObject( self, obj ):  # all objects must be serializable, if not use the module, thoes are not serilized into the stored pickle, just the names so they can be auto-registered when unpickled
     name = obj.TSCRIPT_NAME
 
+    self.function_map.pop( name, None )
+    self.value_map.pop( name, None )
+    self.pending_object_map[ name ] = obj
+
+    self.object_list.append( obj )
+
+  def _loadObject( self, name ):
+    try:
+      obj = self.pending_object_map.pop( name )
+    except KeyError:
+      return False
+
     self.function_map[ name ] = obj.getFunctions()
     self.value_map[ name ] = obj.getValues()
 
-    self.object_list.append( obj )
+    return True
+
+  def loadObjects( self ):  # for things that need to iterate over function_map/value_map
+    for name in list( self.pending_object_map.keys() ):
+      self._loadObject( name )
+
+  def _startRun( self ):  # let objects that cache values (ie: config) know that a new run/fromSubcontractor has started
+    for obj in self.object_list:
+      start = getattr( obj, 'startRun', None )
+      if start is not None:
+        start()
 
   def getValue( self, module, name ):
     try:
@@ -1159,13 +1734,18 @@ class Runner( object ):
     return ( self.__class__, ( self.ast, ), self.__getstate__() )
 
   def __getstate__( self ):
-    return { 'module_list': self.module_list, 'object_list': self.object_list, 'state': self.state, 'variable_map': self.variable_map, 'cur_line': self.cur_line, 'contractor_cookie': self.contractor_cookie }
+    result = { 'module_list': self.module_list, 'object_list': self.object_list, 'state': self.state, 'variable_map': self.variable_map, 'cur_line': self.cur_line, 'contractor_cookie': self.contractor_cookie }
+    if self.tracer is not None:
+      result[ 'tracer' ] = self.tracer
+
+    return result
 
   def __setstate__( self, state ):
     self.state = state[ 'state' ]
     self.variable_map = state[ 'variable_map' ]
     self.cur_line = state[ 'cur_line' ]
     self.contractor_cookie = state[ 'contractor_cookie' ]
+    self.tracer = state.get( 'tracer', None )
     for module in state[ 'module_list' ]:
       self.registerModule( module )
 
@@ -112,6 +112,31 @@ class Count( ExternalFunction ):
     self.stop_at = state[2]
 
 
+class ReadValue( ExternalFunction ):  # reads a value the way a plugin would, the script does not need to name the module
+  def __init__( self, *args, **kwargs ):
+    super().__init__( *args, **kwargs )
+    self.module = None
+    self.name = None
+
+  def setup( self, parms ):
+    try:
+      self.module = str( parms[ 'module' ] )
+      self.name = str( parms[ 'name' ] )
+    except KeyError:
+      raise ParamaterError( 'module', 'module and name are required' )
+
+  @property
+  def value( self ):
+    return self.getScriptValue( self.module, self.name )
+
+  def __getstate__( self ):
+    return ( self.module, self.name )
+
+  def __setstate__( self, state ):
+    self.module = state[0]
+    self.name = state[1]
+
+
 big_stuff = 'the big stuff'
 little_stuff = None
 other_stuff = None
@@ -142,7 +167,8 @@ TSCRIPT_FUNCTIONS = {
                       'constant': Constant,
                       'multiply': Multiply,
                       'remote': Remote,
-                      'count': Count
+                      'count': Count,
+                      'read_value': ReadValue
                     }
 
 TSCRIPT_VALUES = {
@@ -1,11 +1,10 @@
 import pytest
 import pickle
 import time
+import datetime
 
 from contractor.tscript.parser import parse
-from contractor.tscript.runner import Runner, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, Timeout, Pause
-
-# TODO: test the assignment deepcopy, ie: a = {}, b = a  make sure changes to b are not reflected in a
+from contractor.tscript.runner import Runner, ProfileTracer, ExecutionError, UnrecoverableError, ParamaterError, NotDefinedError, Timeout, Pause
 
 
 class testExternalObject( object ):
@@ -33,6 +32,14 @@ class testExternalObject( object ):
     return ( self.__class__, ( self.dataRW, self.dataWO, self.dataRO ) )
 
 
+class countingObject( testExternalObject ):
+  load_count = 0
+
+  def getValues( self ):
+    countingObject.load_count += 1
+    return super().getValues()
+
+
 def test_begin():
   runner = Runner( parse( '' ) )
   assert runner.state == []
@@ -407,6 +414,228 @@ def test_object_values():
   assert runner3.object_list[0].dataRO == 'read me'
 
 
+def test_object_lazy():
+  countingObject.load_count = 0
+  runner = Runner( parse( 'var = test_obj.dataRO' ) )
+  runner.registerObject( countingObject( 'mod me', 'write me', 'read me' ) )
+  assert countingObject.load_count == 0
+  runner.run()
+  assert runner.variable_map == { 'var': 'read me' }
+  assert countingObject.load_count == 1
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert countingObject.load_count == 1
+  assert 'test_obj' not in runner.value_map
+  runner.loadObjects()
+  assert countingObject.load_count == 2
+  assert list( runner.value_map[ 'test_obj' ].keys() ) == [ 'dataRW', 'dataWO', 'dataRO' ]
+
+  runner = Runner( parse( 'var = other_obj.dataRO' ) )
+  runner.registerObject( countingObject( 'mod me', 'write me', 'read me' ) )
+  with pytest.raises( NotDefinedError ):
+    runner.run()
+  assert countingObject.load_count == 2
+
+
+def test_assignment_copy():
+  runner = Runner( parse( 'aa = [ 1, 2 ]\nbb = aa\nbb[0] = 5\nappend( array=bb, value=3 )' ) )
+  runner.run()
+  assert runner.variable_map == { 'aa': [ 1, 2 ], 'bb': [ 5, 2, 3 ] }
+
+  runner = Runner( parse( 'aa = [ 1, 2 ]\ncc = { xx=aa }\ndd = [ aa ]\naa[1] = 7\nappend( array=aa, value=8 )\nee = pop( array=dd[0] )' ) )
+  runner.run()
+  assert runner.variable_map == { 'aa': [ 1, 7, 8 ], 'cc': { 'xx': [ 1, 2 ] }, 'dd': [ [ 1 ] ], 'ee': 2 }
+
+  runner = Runner( parse( 'aa = [ [ 1 ], [ 2 ] ]\nbb = aa[0]\nappend( array=aa[0], value=5 )\ncc = [ 3 ]\naa[1] = cc\nappend( array=cc, value=4 )\nappend( array=aa, value=cc )\ncc[0] = 0' ) )
+  runner.run()
+  assert runner.variable_map == { 'aa': [ [ 1, 5 ], [ 3 ], [ 3, 4 ] ], 'bb': [ 1 ], 'cc': [ 0, 4 ] }
+
+  runner = Runner( parse( 'aa = test_obj.dataRO\nappend( array=aa, value=3 )\nbb = ( aa or [] )\ncc = 0\nwhile ( cc < 3 ) do begin()\n  bb[ cc ] = cc\n  cc = ( cc + 1 )\nend' ) )
+  runner.registerObject( testExternalObject( 'mod me', 'write me', [ 1, 2 ] ) )
+  runner.run()
+  assert runner.variable_map == { 'aa': [ 1, 2, 3 ], 'bb': [ 0, 1, 2 ], 'cc': 3 }
+  assert runner.object_list[0].dataRO == [ 1, 2 ]
+
+  runner = Runner( parse( 'aa = [ 1, 2 ]\nbb = aa\ncc = testing.remote()\nbb[0] = 5\naa[1] = 6' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  runner.run()
+  runner.toSubcontractor( [ 'testing' ] )
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert runner.variable_map[ 'aa' ] is runner.variable_map[ 'bb' ]  # still shared
+  runner.fromSubcontractor( runner.contractor_cookie, 'done' )
+  runner.run()
+  assert runner.variable_map == { 'aa': [ 1, 6 ], 'bb': [ 5, 2 ], 'cc': 'done' }
+
+
+def test_tracer():
+  runner = Runner( parse( 'aa = 1\nbb = 0\nwhile ( bb < 3 ) do bb = ( bb + 1 )\ncc = testing.count( count_by=1, stop_at=2 )' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  assert pickle.loads( pickle.dumps( runner ) ).tracer is None
+  runner.tracer = ProfileTracer()
+  assert runner.run() == 'at 1 of 2'
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert runner.run() == 'at 2 of 2'
+  assert runner.tracer.function_map == {}
+  assert runner.run() == ''
+  assert runner.done
+  assert runner.variable_map == { 'aa': 1, 'bb': 3, 'cc': None }
+
+  tracer = runner.tracer
+  assert dict( [ ( key, value[0] ) for key, value in tracer.line_map.items() ] ) == { 1: 1, 2: 1, 3: 1, 4: 1 }  # resuming line 4 is not starting it again
+  assert list( tracer.function_map.keys() ) == [ ( 'testing', 'count' ) ]
+  assert tracer.function_map[ ( 'testing', 'count' ) ][0] == 1
+  if not hasattr( runner, 'program' ):  # the VMRunner does not report nodes
+    assert tracer.node_map[ 'L' ][0] == 6  # line 4 is evaluated in each of the three runs
+    assert tracer.node_map[ 'W' ][0] == 1
+
+  summary = tracer.summary()
+  assert sorted( summary[ 'line' ].keys() ) == [ '1', '2', '3', '4' ]
+  assert summary[ 'function' ][ 'testing.count' ][ 'count' ] == 1
+  assert summary[ 'line' ][ '3' ][ 'seconds' ] > 0.0
+
+  runner = Runner( parse( 'aa = 1\nbb = 2' ) )
+  runner.tracer = ProfileTracer()
+  runner.run()
+  runner.tracer = None
+  runner = Runner( parse( 'aa = 1\nbb = 2' ) )
+  runner.run()
+  assert runner.variable_map == { 'aa': 1, 'bb': 2 }
+
+
+def test_budget():
+  runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 200 ) do cnt = ( cnt + 1 )' ) )
+  assert runner.run( ttl=100000, budget=0 ) == 'Out of time, will resume next run'
+  assert not runner.done
+  count = 1
+  while not runner.done:
+    runner = pickle.loads( pickle.dumps( runner ) )
+    runner.run( ttl=100000, budget=0 )
+    count += 1
+  assert count > 2
+  assert runner.variable_map == { 'cnt': 200 }
+
+  runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 200 ) do cnt = ( cnt + 1 )' ) )
+  with pytest.raises( Timeout ):
+    runner.run( ttl=150, budget=60 )
+
+  runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 200 ) do cnt = ( cnt + 1 )' ) )
+  assert runner.run( ttl=100000, budget=60 ) == ''
+  assert runner.done
+
+  # a ttl shorter than the check interval still stops at the ttl, with or without a budget
+  cnt_list = []
+  for budget in ( None, 0, 60 ):
+    runner = Runner( parse( 'cnt = 0\nwhile ( cnt < 200 ) do cnt = ( cnt + 1 )' ) )
+    with pytest.raises( Timeout ):
+      runner.run( ttl=50, budget=budget )
+    cnt_list.append( runner.variable_map[ 'cnt' ] )
+  assert cnt_list[0] < 50
+  assert cnt_list == [ cnt_list[0] ] * 3
+
+  # stopping part way through the paramaters of a function leaves nothing for subcontractor
+  ttl = 1
+  while True:
+    runner = Runner( parse( 'testing.remote( aa=1, bb=( 2 + 3 ) )' ) )
+    runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+    try:
+      message = runner.run( ttl=ttl )
+    except Timeout:
+      assert runner.toSubcontractor( [ 'testing' ] ) is None
+      ttl += 1
+      continue
+
+    assert message == 'Not Initilized'
+    assert runner.toSubcontractor( [ 'testing' ] )[ 'function' ] == 'remote_func'
+    break
+
+  assert ttl > 3
+
+
+def test_closures():
+  runner = Runner( parse( 'aa = [ 1, 2, 3 ]\nbb = { cc=( aa[ 1 ] + 1 ), dd=( "a" . len( array=aa ) ), ee=exists( aa[ 5 ] ), ff=slice( array=aa, start=1, end=3 ) }' ) )
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'aa': [ 1, 2, 3 ], 'bb': { 'cc': 3, 'dd': 'a3', 'ee': False, 'ff': [ 2, 3 ] } }
+  if not hasattr( runner, 'program' ):
+    assert len( runner.closure_map ) == 9  # the array, the map, and all the values in the map, with the items, len and the infixs inside of them
+
+  runner = Runner( parse( 'aa = [ 1, testing.multiply( value=( 1 + 2 ) ) ]' ) )  # the array may pause, the infix can't
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'aa': [ 1, 30 ] }
+  if not hasattr( runner, 'program' ):
+    assert len( runner.closure_map ) == 1
+
+  runner = Runner( parse( 'aa = ( 1 + ( 2 * "a" ) )' ) )
+  with pytest.raises( ParamaterError ):
+    runner.run()
+  assert runner.aborted
+
+  runner = Runner( parse( 'aa = 1\naa = ( aa + bb[ 1 ] )' ) )
+  with pytest.raises( NotDefinedError ):
+    runner.run()
+  assert runner.aborted
+  assert runner.line == 2
+
+
+def test_parallel():
+  runner = Runner( parse( 'aa = 1\nparallel()\n  bb = testing.remote()\n  testing.remote()\n  cc = testing.multiply( value=( aa + 1 ) )\nend\ndd = bb' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  assert runner.run() == 'Not Initilized, Not Initilized'
+  assert runner.status[ -1 ] == ( 100.0 / 3, 'Parallel', { 'function_list': [ { 'module': 'testing', 'name': 'remote', 'done': False, 'dispatched': False },
+                                                                              { 'module': 'testing', 'name': 'remote', 'done': False, 'dispatched': False },
+                                                                              { 'module': 'testing', 'name': 'multiply', 'done': True } ] } )
+  assert runner.waiting_on_subcontractor is False
+  assert runner.toSubcontractor( [ 'other' ] ) is None
+
+  task1 = runner.toSubcontractor( [ 'testing' ] )
+  assert task1[ 'function' ] == 'remote_func'
+  assert runner.waiting_on_subcontractor is False
+  task2 = runner.toSubcontractor( [ 'testing' ] )
+  assert task2[ 'function' ] == 'remote_func'
+  assert task1[ 'cookie' ] != task2[ 'cookie' ]
+  assert runner.toSubcontractor( [ 'testing' ] ) is None
+  assert runner.waiting_on_subcontractor is True
+  assert runner.wake_at is None
+
+  runner = pickle.loads( pickle.dumps( runner ) )
+  assert runner.isValidCookie( task1[ 'cookie' ] )
+  assert runner.isValidCookie( task2[ 'cookie' ] )
+  assert not runner.isValidCookie( 'bogus' )
+  assert runner.fromSubcontractor( 'bogus', 'nope' ) == ( 'Bad Cookie', None )
+  assert runner.fromSubcontractor( task2[ 'cookie' ], 'second' ) == ( 'Accepted', 'Current State "second"' )
+  assert runner.fromSubcontractor( task2[ 'cookie' ], 'second' ) == ( 'Not Expecting Anything', None )
+  assert runner.waiting_on_subcontractor is False
+  assert runner.run() == 'Not Initilized'  # the first is still out
+  assert runner.status[ -1 ][2][ 'function_list' ][1][ 'done' ] is True
+  assert runner.toSubcontractor( [ 'testing' ] ) is None
+
+  runner.clearDispatched()
+  task1 = runner.toSubcontractor( [ 'testing' ] )
+  assert runner.rollback() == 'Rollback not possible'
+  assert runner.fromSubcontractor( task1[ 'cookie' ], 'first' ) == ( 'Accepted', 'Current State "first"' )
+  assert runner.run() == ''
+  assert runner.done
+  assert runner.variable_map == { 'aa': 1, 'bb': 'first', 'cc': 20, 'dd': 'first' }
+
+  runner = Runner( parse( 'parallel()\n  aa = delay( seconds=30 )\n  bb = delay( seconds=10 )\nend' ) )
+  runner.run()
+  assert runner.wake_at > datetime.datetime.utcnow() + datetime.timedelta( seconds=5 )
+  assert runner.wake_at < datetime.datetime.utcnow() + datetime.timedelta( seconds=15 )
+
+  runner = Runner( parse( 'parallel()\n  aa = testing.remote()\n  bb = testing.remote()\nend' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  runner.run()
+  task1 = runner.toSubcontractor( [ 'testing' ] )
+  task2 = runner.toSubcontractor( [ 'testing' ] )
+  runner.fromSubcontractor( task1[ 'cookie' ], 'Bad' )
+  runner.fromSubcontractor( task2[ 'cookie' ], 'good' )
+  with pytest.raises( UnrecoverableError ):
+    runner.run()
+  assert runner.aborted
+  assert runner.variable_map == {}
+
+
 def test_infix():
   runner = Runner( parse( 'myvar = ( 1 + 2 )' ) )
   assert runner.variable_map == {}
@@ -717,6 +946,29 @@ def test_delay():
   assert runner.run() == 'Waiting for 7197 more seconds'
 
 
+def test_wake():
+  runner = Runner( parse( 'delay( minutes=5 )' ) )
+  assert runner.wake_at is None
+  assert runner.waiting_on_subcontractor is False
+  runner.run()
+  assert runner.wake_at - datetime.datetime.utcnow() > datetime.timedelta( minutes=4 )
+  assert runner.waiting_on_subcontractor is False
+
+  runner = Runner( parse( 'testing.remote()' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  runner.run()
+  assert runner.wake_at is None
+  assert runner.waiting_on_subcontractor is False
+  runner.toSubcontractor( [ 'testing' ] )
+  assert runner.wake_at is None
+  assert runner.waiting_on_subcontractor is True
+  runner.fromSubcontractor( runner.contractor_cookie, True )
+  assert runner.waiting_on_subcontractor is False
+  runner.run()
+  assert runner.done
+  assert runner.waiting_on_subcontractor is False
+
+
 def test_object_functions():  # TODO: this and pickleing too
   pass
 
@@ -0,0 +1,459 @@
+import logging
+import traceback
+
+from contractor.lib.lru import LRUCache
+from contractor.tscript.parser import Types
+from contractor.tscript.runner import Runner, Pause, ExecutionError, UnrecoverableError, ScriptError, ParamaterError, NotDefinedError, Interrupt, _statusList, _parallelBranches, _parallelStatus
+
+# Compiles the AST into a flat list of instructions and runs them with a program counter and a value stack,
+# the state is [ [ PROGRAM, { 'pc', 'stack', 'exists' } ] ], while a function is blocking execution it's
+# frame is on the end of the state, the same as in the tree walking Runner so to/fromSubcontractor, rollback,
+# and clearDispatched work the same.
+
+PROGRAM_CACHE_SIZE = 200
+
+PROGRAM = 'P'
+
+# instruction op codes
+( OP_LINE, OP_CONSTANT, OP_VARIABLE, OP_ARRAY_MAP_ITEM, OP_ARRAY, OP_MAP, OP_INFIX, OP_ASSIGN, OP_CALL,
+  OP_POP, OP_JUMP, OP_JUMP_FALSE, OP_GOTO, OP_EXISTS, OP_EXISTS_END, OP_BAD_ASSIGN, OP_UNIMPLEMENTED, OP_PARALLEL ) = range( 18 )
+
+VALUE_TYPES = ( Types.CONSTANT, Types.VARIABLE, Types.ARRAY, Types.MAP, Types.ARRAY_MAP_ITEM, Types.INFIX, Types.FUNCTION, Types.EXISTS )  # all the things that "return" a value
+
+program_cache = LRUCache( PROGRAM_CACHE_SIZE )  # id( ast ) -> ( ast, Program )
+
+
+class Program():
+  def __init__( self, code, status_list, line_pc_list ):
+    super().__init__()
+    self.code = code                  # list of ( op code, argument )
+    self.status_list = status_list    # for each instruction, the status items for where in the script it is
+    self.line_pc_list = line_pc_list  # pc of the start of each line of the global scope, for goto
+
+
+class Compiler():
+  def __init__( self ):
+    super().__init__()
+    self.code = []
+    self.status_list = []
+    self.line_pc_list = []
+    self.context = []  # the status items of the scope/while/ifelse we are curently compiling in
+    self.context_tuple = ()
+
+  def compile( self, ast ):
+    self._scope( ast[1], True )
+
+    return Program( self.code, self.status_list, self.line_pc_list )
+
+  def _emit( self, op, arg=None ):
+    self.code.append( ( op, arg ) )
+    self.status_list.append( self.context_tuple )
+    return len( self.code ) - 1
+
+  def _patch( self, pc ):  # point the jump at pc to the next instruction
+    self.code[ pc ] = ( self.code[ pc ][0], len( self.code ) )
+
+  def _pushContext( self, item ):
+    self.context.append( item )
+    self.context_tuple = tuple( self.context )
+
+  def _popContext( self ):
+    self.context.pop()
+    self.context_tuple = tuple( self.context )
+
+  def _discard( self, operation ):
+    self._node( operation )
+    if operation[0] in VALUE_TYPES:
+      self._emit( OP_POP )
+
+  def _scope( self, op_data, is_global ):
+    tmp = {}
+    for item in ( 'description', ):
+      try:
+        tmp[ item ] = op_data[ item ]
+      except KeyError:
+        pass
+
+    children = op_data[ '_children' ]
+    for i in range( 0, len( children ) ):
+      if is_global:
+        self.line_pc_list.append( len( self.code ) )
+
+      self._pushContext( ( i, len( children ), 'Scope', tmp ) )
+      self._discard( children[i] )
+      self._popContext()
+
+  def _node( self, operation ):
+    op_type = operation[0]
+    op_data = operation[1]
+
+    if op_type == Types.LINE:
+      self._emit( OP_LINE, operation[2] )
+      self._discard( op_data )
+
+    elif op_type == Types.SCOPE:
+      self._scope( op_data, False )
+
+    elif op_type == Types.CONSTANT:
+      self._emit( OP_CONSTANT, op_data )
+
+    elif op_type == Types.VARIABLE:
+      self._emit( OP_VARIABLE, op_data )
+
+    elif op_type == Types.ARRAY:
+      for item in op_data:
+        self._node( item )
+
+      self._emit( OP_ARRAY, len( op_data ) )
+
+    elif op_type == Types.MAP:
+      for key in op_data:
+        self._node( op_data[ key ] )
+
+      self._emit( OP_MAP, tuple( op_data.keys() ) )
+
+    elif op_type == Types.ARRAY_MAP_ITEM:
+      self._node( op_data[ 'index' ] )
+      self._emit( OP_ARRAY_MAP_ITEM, op_data )
+
+    elif op_type == Types.ASSIGNMENT:
+      target_type = op_data[ 'target' ][0]
+      if target_type not in ( Types.VARIABLE, Types.ARRAY_MAP_ITEM ) or ( target_type == Types.ARRAY_MAP_ITEM and op_data[ 'target' ][1][ 'module' ] is not None ):
+        self._emit( OP_BAD_ASSIGN )
+        return
+
+      if target_type == Types.ARRAY_MAP_ITEM:
+        self._node( op_data[ 'target' ][1][ 'index' ] )
+
+      self._node( op_data[ 'value' ] )
+      self._emit( OP_ASSIGN, ( op_data, target_type == Types.ARRAY_MAP_ITEM ) )
+
+    elif op_type == Types.INFIX:
+      self._node( op_data[ 'left' ] )
+      self._node( op_data[ 'right' ] )
+      self._emit( OP_INFIX, op_data )
+
+    elif op_type == Types.FUNCTION:
+      for key in op_data[ 'paramaters' ]:
+        self._node( op_data[ 'paramaters' ][ key ] )
+
+      self._emit( OP_CALL, ( op_data, tuple( op_data[ 'paramaters' ].keys() ) ) )
+
+    elif op_type == Types.PARALLEL:  # the paramaters of all the functions, then they are run together
+      branch_list = []
+      for ( function, assignment ) in _parallelBranches( op_data ):
+        for key in function[ 'paramaters' ]:
+          self._node( function[ 'paramaters' ][ key ] )
+
+        branch_list.append( ( function, tuple( function[ 'paramaters' ].keys() ), assignment ) )
+
+      self._emit( OP_PARALLEL, tuple( branch_list ) )
+
+    elif op_type == Types.WHILE:
+      self._pushContext( ( 0, 1, 'While', { 'doing': 'condition' } ) )
+      start = len( self.code )
+      self._node( op_data[ 'condition' ] )
+      exit_jump = self._emit( OP_JUMP_FALSE )
+      self._popContext()
+
+      self._pushContext( ( 0, 1, 'While', { 'doing': 'expression' } ) )
+      self._discard( op_data[ 'expression' ] )
+      self._emit( OP_JUMP, start )
+      self._popContext()
+
+      self._patch( exit_jump )
+
+    elif op_type == Types.IFELSE:
+      end_jump_list = []
+      for index in range( 0, len( op_data ) ):
+        branch = op_data[ index ]
+        next_jump = None
+        if branch[ 'condition' ] is not None:
+          self._pushContext( ( index, len( op_data ), 'IfElse', { 'doing': 'condition' } ) )
+          self._node( branch[ 'condition' ] )
+          next_jump = self._emit( OP_JUMP_FALSE )
+          self._popContext()
+
+        self._pushContext( ( index, len( op_data ), 'IfElse', { 'doing': 'expression' } ) )
+        self._discard( branch[ 'expression' ] )
+        if index < len( op_data ) - 1:
+          end_jump_list.append( self._emit( OP_JUMP ) )
+        self._popContext()
+
+        if next_jump is not None:
+          self._patch( next_jump )
+
+      for pc in end_jump_list:
+        self._patch( pc )
+
+    elif op_type == Types.EXISTS:
+      start = self._emit( OP_EXISTS )
+      self._node( op_data )
+      self._emit( OP_EXISTS_END )
+      self._patch( start )
+
+    elif op_type == Types.JUMP_POINT:  # just a NOP execution wise
+      pass
+
+    elif op_type == Types.GOTO:
+      self._emit( OP_GOTO, op_data )
+
+    else:
+      self._emit( OP_UNIMPLEMENTED, op_type )
+
+
+# NOTE: the Program is shared with every other VMRunner running the same AST, treat it as read only
+def compileAST( ast ):
+  try:
+    ( cached_ast, program ) = program_cache.get( id( ast ) )
+    if cached_ast is ast:
+      return program
+  except KeyError:
+    pass
+
+  program = Compiler().compile( ast )
+  program_cache.set( id( ast ), ( ast, program ) )  # holding on to the ast keeps the id from being re-used
+
+  return program
+
+
+class VMRunner( Runner ):
+  def __init__( self, ast ):
+    super().__init__( ast )
+    self.program = compileAST( ast )
+
+  @property
+  def status( self ):
+    if self.done or self.aborted:
+      return [ ( 100.0, 'Scope', None ) ]
+    if len( self.state ) == 0:
+      return [ ( 0.0, 'Scope', None ) ]
+
+    pc = self.state[0][1][ 'pc' ]
+    item_list = [ ( item[0], item[1], item[2], dict( item[3] ) ) for item in self.program.status_list[ pc ] ]
+
+    if len( self.state ) > 1 and self.state[ -1 ][0] == Types.PARALLEL:
+      item_list.append( _parallelStatus( [ i[0] for i in self.program.code[ pc ][1] ], self.state[ -1 ][1] ) )
+
+    elif len( self.state ) > 1:  # stoped in a function
+      work = self.state[ -1 ][1]
+      op_data = self.program.code[ pc ][1][0]
+      tmp = {}
+      if isinstance( work, dict ) and 'dispatched' in work:
+        tmp[ 'dispatched' ] = work[ 'dispatched' ]
+
+      tmp[ 'module' ] = op_data[ 'module' ]
+      tmp[ 'name' ] = op_data[ 'name' ]
+      item_list.append( ( 0, 1, 'Function', tmp ) )
+
+    return _statusList( item_list )
+
+  def goto( self, jump_point ):
+    try:
+      pos = self.jump_point_map[ jump_point ]
+    except KeyError:
+      raise NotDefinedError( jump_point )
+
+    self.state = [ [ PROGRAM, { 'pc': self.program.line_pc_list[ pos ], 'stack': [], 'exists': [] } ] ]
+
+  def run( self, ttl=1000, budget=None ):
+    if self.aborted:
+      return 'aborted'
+
+    if self.done:
+      return 'done'
+
+    self._setTTL( ttl, budget )
+    self._startRun()
+
+    if self.state == []:
+      self.state = [ [ PROGRAM, { 'pc': 0, 'stack': [], 'exists': [] } ] ]
+
+    tracer = self.tracer
+    if tracer is not None:
+      tracer.start( self.cur_line )
+
+    try:
+      self._execute()
+
+    except Interrupt as e:
+      return str( e )
+
+    except ( Pause, ExecutionError ) as e:
+      raise e
+
+    except ( UnrecoverableError, ParamaterError, NotDefinedError, ScriptError ) as e:
+      self.state = 'ABORTED'
+      raise e
+
+    except Exception as e:
+      self.state = 'ABORTED'
+      logging.exception( 'runner: Unahndled Exception' )
+      raise UnrecoverableError( 'Unahndled Exception ({0}): "{1}"\ntrace:\n{2}'.format( type( e ).__name__, str( e ), traceback.format_exc() ) )
+
+    finally:
+      if tracer is not None:
+        tracer.stop()
+
+    self.state = 'DONE'
+    self.cur_line = None
+
+    return ''
+
+  def _execute( self ):
+    code = self.program.code
+    end = len( code )
+    frame = self.state[0][1]
+    stack = frame[ 'stack' ]
+    pc = frame[ 'pc' ]
+    tracer = self.tracer  # the VMRunner only reports lines and functions, not nodes
+
+    while True:  # we are a while loop for the benifit of exists
+      try:
+        while pc < end:
+          if self.ttl <= self.ttl_check_at:
+            self._checkTTL()
+
+          self.ttl -= 1
+
+          ( op, arg ) = code[ pc ]
+
+          if op == OP_CONSTANT:
+            stack.append( arg )
+
+          elif op == OP_VARIABLE:
+            stack.append( self._getVariable( arg ) )
+
+          elif op == OP_LINE:
+            self.cur_line = arg
+            if tracer is not None:
+              tracer.line( arg )
+
+          elif op == OP_POP:
+            stack.pop()
+
+          elif op == OP_INFIX:
+            right = stack.pop()
+            stack[ -1 ] = self._infix( arg, stack[ -1 ], right )
+
+          elif op == OP_ASSIGN:
+            if arg[1]:
+              self._assign( arg[0], stack[ -2 ], stack[ -1 ] )
+              del stack[ -2: ]
+            else:
+              self._assign( arg[0], None, stack.pop() )
+
+          elif op == OP_JUMP_FALSE:
+            if not stack.pop():
+              pc = arg
+              continue
+
+          elif op == OP_JUMP:
+            pc = arg
+            continue
+
+          elif op == OP_CALL:
+            ( op_data, key_list ) = arg
+            if len( self.state ) > 1:  # returning to a function that was allready started
+              work = self.state[ -1 ][1]
+            else:
+              if key_list:
+                work = { 'paramaters': dict( zip( key_list, stack[ -len( key_list ): ] ) ) }
+                del stack[ -len( key_list ): ]
+              else:
+                work = { 'paramaters': {} }
+
+              self.state.append( [ Types.FUNCTION, work ] )
+
+            if work is None:  # function allready executed and was an Exception last time, it's value is None
+              value = None
+
+            else:
+              value = self._function( op_data, work )
+              if isinstance( value, Exception ):
+                self.state[ -1 ] = [ Types.FUNCTION, None, None ]
+                raise value
+
+            self.state.pop()
+            stack.append( value )
+
+          elif op == OP_PARALLEL:
+            if len( self.state ) > 1:  # returning to a block that was allready started
+              work_list = self.state[ -1 ][1]
+            else:
+              count = sum( [ len( i[1] ) for i in arg ] )
+              value_list = stack[ len( stack ) - count: ]
+              del stack[ len( stack ) - count: ]
+              work_list = []
+              for ( op_data, key_list, assignment ) in arg:
+                work_list.append( { 'paramaters': dict( zip( key_list, value_list[ :len( key_list ) ] ) ) } )
+                del value_list[ :len( key_list ) ]
+
+              self.state.append( [ Types.PARALLEL, work_list ] )
+
+            value_list = self._parallel( [ i[0] for i in arg ], work_list )
+            self.state.pop()
+            for ( op_data, key_list, assignment ), value in zip( arg, value_list ):
+              if assignment is not None:
+                self._assign( assignment, None, value )
+
+          elif op == OP_ARRAY_MAP_ITEM:
+            stack[ -1 ] = self._getArrayMapItem( arg, stack[ -1 ] )
+
+          elif op == OP_ARRAY:
+            if arg:
+              value = stack[ -arg: ]
+              del stack[ -arg: ]
+            else:
+              value = []
+
+            stack.append( value )
+
+          elif op == OP_MAP:
+            if arg:
+              value = dict( zip( arg, stack[ -len( arg ): ] ) )
+              del stack[ -len( arg ): ]
+            else:
+              value = {}
+
+            stack.append( value )
+
+          elif op == OP_EXISTS:
+            frame[ 'exists' ].append( ( arg, len( stack ) ) )
+
+          elif op == OP_EXISTS_END:
+            frame[ 'exists' ].pop()
+            stack[ -1 ] = True
+
+          elif op == OP_GOTO:
+            try:
+              self.goto( arg )
+            except NotDefinedError:
+              raise NotDefinedError( arg, self.cur_line )
+
+            frame = self.state[0][1]
+            stack = frame[ 'stack' ]
+            pc = frame[ 'pc' ]
+            continue
+
+          elif op == OP_BAD_ASSIGN:
+            raise ParamaterError( 'target', 'Can only assign to variables', self.cur_line )
+
+          else:
+            raise ScriptError( 'Unimplemented "{0}"'.format( arg ), self.cur_line )
+
+          pc += 1
+
+        return
+
+      except NotDefinedError:
+        if not frame[ 'exists' ]:
+          raise
+
+        ( pc, depth ) = frame[ 'exists' ].pop()
+        del stack[ depth: ]
+        stack.append( False )
+        del self.state[ 1: ]
+
+      finally:
+        frame[ 'pc' ] = pc
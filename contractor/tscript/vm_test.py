@@ -0,0 +1,120 @@
+import pytest
+import pickle
+
+from contractor.tscript import runner_test, runner_plugins_test
+from contractor.tscript.parser import parse
+from contractor.tscript.runner import Runner, NotDefinedError, Timeout, Pause
+from contractor.tscript.vm import VMRunner, compileAST, program_cache, OP_LINE, OP_CONSTANT, OP_VARIABLE, OP_INFIX, OP_ASSIGN, OP_JUMP, OP_JUMP_FALSE
+
+
+# the VMRunner has to behave the same as the Runner, so run the Runner's tests against it
+# test_jumppoint counts the ttl, which is per instruction for the VMRunner, and per AST node for the Runner
+@pytest.mark.parametrize( 'test_name', [ i for i in dir( runner_test ) if i.startswith( 'test_' ) and i != 'test_jumppoint' ] )
+def test_runner_tests( mocker, test_name ):
+  mocker.patch.object( runner_test, 'Runner', VMRunner )
+  mocker.patch.object( runner_plugins_test, 'other_stuff', None )  # the Runner's test allready set this
+  getattr( runner_test, test_name )()
+
+
+def test_compile():
+  ast = parse( 'cnt = 1\nwhile ( cnt < 10 ) do cnt = ( cnt + 1 )' )
+  program = compileAST( ast )
+  assert compileAST( ast ) is program
+  assert program_cache.get( id( ast ) ) == ( ast, program )
+
+  assert [ i[0] for i in program.code ] == [ OP_LINE, OP_CONSTANT, OP_ASSIGN,
+                                             OP_LINE, OP_VARIABLE, OP_CONSTANT, OP_INFIX, OP_JUMP_FALSE, OP_VARIABLE, OP_CONSTANT, OP_INFIX, OP_ASSIGN, OP_JUMP ]
+  assert program.code[7][1] == 13
+  assert program.code[12][1] == 4
+  assert program.line_pc_list == [ 0, 3 ]
+  assert program.status_list[0] == ( ( 0, 2, 'Scope', {} ), )
+  assert program.status_list[5] == ( ( 1, 2, 'Scope', {} ), ( 0, 1, 'While', { 'doing': 'condition' } ) )
+  assert program.status_list[9] == ( ( 1, 2, 'Scope', {} ), ( 0, 1, 'While', { 'doing': 'expression' } ) )
+
+  runner = VMRunner( ast )
+  assert runner.program is program
+
+
+def test_jumppoint():
+  runner = VMRunner( parse( 'goto jump_a\nabc = 1\n:jump_a\ndce = 2' ) )
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'dce': 2 }
+
+  runner = VMRunner( parse( 'goto jump_b\nabc = 1\n:jump_a\ndce = 2' ) )
+  with pytest.raises( NotDefinedError ):
+    runner.run()
+  assert runner.aborted
+  assert runner.status[0][0] == 100.0
+
+  runner = VMRunner( parse( 'goto jump_b\nabc = 1\n:jump_a\ndce = 2' ) )
+  runner.goto( 'jump_a' )
+  with pytest.raises( Timeout ):
+    runner.run( 1 )
+  assert runner.line == 3
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'dce': 2 }
+
+  runner = VMRunner( parse( 'cnt = 0\n:top\ncnt = ( cnt + 1 )\nif ( cnt < 5 ) then goto top' ) )
+  runner.run()
+  assert runner.done
+  assert runner.variable_map == { 'cnt': 5 }
+
+
+def test_exists():
+  runner = VMRunner( parse( 'bb = [ 1, 2 ]\naa = exists( bb[ len( array=cc ) ] )' ) )
+  runner.run()
+  assert runner.variable_map == { 'aa': False, 'bb': [ 1, 2 ] }
+
+  runner = VMRunner( parse( 'bb = { key=1 }\naa = [ 5, exists( bb[ pause( msg="here" ) ] ) ]' ) )
+  with pytest.raises( Pause ):
+    runner.run()
+  assert runner.state[0][1][ 'exists' ] == [ ( 11, 1 ) ]  # end of the exists, and the depth of the stack ( the 5 )
+  runner.run()
+  assert runner.variable_map == { 'aa': [ 5, False ], 'bb': { 'key': 1 } }
+  assert runner.done
+
+
+def test_serilizer():
+  runner = VMRunner( parse( 'aa = 1\nbb = [ aa, testing.remote() ]\ncc = ( aa + 2 )' ) )
+  runner.registerModule( 'contractor.tscript.runner_plugins_test' )
+  assert runner.run() == 'Not Initilized'
+  assert runner.toSubcontractor( [ 'testing' ] ) == { 'cookie': runner.contractor_cookie, 'module': 'testing', 'function': 'remote_func', 'paramaters': 'the count "1"' }
+
+  runner2 = pickle.loads( pickle.dumps( runner ) )
+  assert isinstance( runner2, VMRunner )
+  assert runner2.state == runner.state[ :1 ] + [ runner2.state[1] ]
+  assert runner2.status == runner.status
+  assert runner2.fromSubcontractor( runner2.contractor_cookie, 'stuff' ) == ( 'Accepted', 'Current State "stuff"' )
+  assert runner2.run() == ''
+  assert runner2.done
+  assert runner2.variable_map == { 'aa': 1, 'bb': [ 1, 'stuff' ], 'cc': 3 }
+
+
+def test_same_as_runner():
+  script = """
+fib = [ 0, 1 ]
+cnt = 2
+while ( cnt < 30 ) do begin()
+  append( array=fib, value=( fib[ ( cnt - 1 ) ] + fib[ ( cnt - 2 ) ] ) )
+  cnt = ( cnt + 1 )
+end
+info = { name="test", count=len( array=fib ), last=fib[ -1 ] }
+if ( info[ "count" ] == 30 ) then label = ( "count " . info[ "count" ] ) elif False then label = "no" else label = "other"
+info[ "name" ] = "changed"
+has_it = exists( info[ "last" ] )
+not_it = exists( info[ "nope" ] )
+flag = ( not has_it or not_it )
+"""
+  tree = Runner( parse( script ) )
+  tree.run( ttl=100000 )
+  assert tree.done
+
+  vm = VMRunner( parse( script ) )
+  vm.run( ttl=100000 )
+  assert vm.done
+
+  assert vm.variable_map == tree.variable_map
+  assert vm.variable_map[ 'label' ] == 'count 30'
+  assert vm.variable_map[ 'info' ] == { 'name': 'changed', 'count': 30, 'last': 514229 }